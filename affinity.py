@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Prefix-affinity routing voor de guardrail proxy
+Ollama hergebruikt zijn prompt (KV) cache als een request hetzelfde begin
+heeft als de vorige op dezelfde backend. Daarom onthouden we per prefix
+(model, system prompt en de eerste berichten) welke backend die het laatst
+bediende, en sturen we het gesprek daar weer heen zolang die niet overbelast is.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+PREFIX_AFFINITY = os.environ.get('PREFIX_AFFINITY', '1') != '0'
+AFFINITY_TABLE_SIZE = int(os.environ.get('AFFINITY_TABLE_SIZE', 10000))
+
+# Niet-system berichten in de prefix; 1 = alle turns van een gesprek delen de key
+AFFINITY_PREFIX_MESSAGES = int(os.environ.get('AFFINITY_PREFIX_MESSAGES', 1))
+
+# Zoveel requests meer in flight dan de rustigste backend mag de vaste backend hebben
+AFFINITY_MAX_SKEW = int(os.environ.get('AFFINITY_MAX_SKEW', 2))
+
+
+def prefix_key(data: dict, prefix_messages: int = AFFINITY_PREFIX_MESSAGES):
+    """Hash of the model and leading messages of a chat request, or None without messages"""
+    messages = data.get('messages') or []
+    system = [m.get('content') for m in messages if m.get('role') == 'system']
+    leading = [[m.get('role'), m.get('content')] for m in messages if m.get('role') != 'system'][:prefix_messages]
+    if not leading and not system:
+        return None
+    canonical = json.dumps([data.get('model', ''), system, leading], sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+
+class AffinityTable:
+    """
+    Bounded LRU of prefix -> backend url.
+    route() kiest de vaste backend als die kan, anders de rustigste, en
+    onthoudt die keuze: daar staat na deze turn de nieuwste prefix in de cache.
+    """
+
+    def __init__(self, size: int = AFFINITY_TABLE_SIZE, max_skew: int = AFFINITY_MAX_SKEW):
+        self.size = size
+        self.max_skew = max_skew
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'fallbacks': 0, 'evictions': 0}
+
+    def route(self, key, candidates, least):
+        """
+        Pick a backend for key among candidates (least = the least-loaded one).
+        Returns (backend, result) with result 'hit', 'miss' or 'fallback'.
+        """
+        with self.lock:
+            url = self.entries.get(key)
+            if url is None:
+                result = 'miss'
+            else:
+                preferred = next((b for b in candidates if b.url == url), None)
+                if preferred is not None and preferred.outstanding - least.outstanding <= self.max_skew:
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return preferred, 'hit'
+                # Uitgeworpen, al geprobeerd of overbelast
+                result = 'fallback'
+
+            self.counters['misses' if result == 'miss' else 'fallbacks'] += 1
+            self.entries[key] = least.url
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.counters['evictions'] += 1
+            return least, result
+
+    def forget_backend(self, url: str) -> int:
+        """Drop all prefixes pinned to a backend (bv. na een restart: cache is leeg)"""
+        with self.lock:
+            keys = [k for k, v in self.entries.items() if v == url]
+            for k in keys:
+                del self.entries[k]
+            return len(keys)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            routed = self.counters['hits'] + self.counters['misses'] + self.counters['fallbacks']
+            return {
+                'enabled': PREFIX_AFFINITY,
+                'entries': len(self.entries),
+                'max_entries': self.size,
+                'max_skew': self.max_skew,
+                **self.counters,
+                'hit_ratio': round(self.counters['hits'] / routed, 4) if routed else 0.0,
+            }
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Audit log voor de guardrail proxy
+In-memory ring buffer met lopende tellers, plus een achtergrond-writer die
+elke entry naar roterende JSONL segmenten op disk schrijft.
+"""
+
+import os
+import re
+import json
+import queue
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+AUDIT_LOG_DIR = os.environ.get('AUDIT_LOG_DIR', 'audit_logs')  # leeg = geen disk log
+RING_SIZE = 1000
+SEGMENT_BYTES = 16 * 1024 * 1024
+MAX_SEGMENTS = 64
+WRITE_QUEUE_SIZE = 10000
+READ_BLOCK_BYTES = 64 * 1024  # blokken bij achterstevoren lezen
+
+SEGMENT_FORMAT = 'audit-%Y%m%d-%H%M%S-%f.jsonl'
+
+# Entries worden met json.dumps geschreven, timestamp als eerste veld
+TIMESTAMP_PREFIX = re.compile(r'\{"timestamp": "([^"\\]+)"')
+
+
+def line_timestamp(line: str):
+    """Timestamp of one JSONL line, from its prefix when possible; None for a broken line"""
+    match = TIMESTAMP_PREFIX.match(line)
+    try:
+        if match:
+            return datetime.fromisoformat(match.group(1))
+        return datetime.fromisoformat(json.loads(line)['timestamp'])
+    except (ValueError, KeyError, TypeError):
+        return None  # half geschreven regel na een crash
+
+
+def local_naive(value: datetime):
+    """Entries have naive local timestamps; an aware bound is converted to match"""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone().replace(tzinfo=None)
+
+
+def read_lines(paths):
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            yield from f
+
+
+def read_lines_reversed(paths, block_bytes: int = READ_BLOCK_BYTES):
+    """Lines of the files, last line of the last file first, read from the end in blocks"""
+    for path in reversed(paths):
+        with open(path, 'rb') as f:
+            position = f.seek(0, os.SEEK_END)
+            rest = b''
+            while position > 0:
+                size = min(block_bytes, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + rest).split(b'\n')
+                rest = lines.pop(0)  # kan nog doorlopen in het vorige blok
+                for line in reversed(lines):
+                    if line:
+                        yield line.decode('utf-8', 'replace')
+            if rest:
+                yield rest.decode('utf-8', 'replace')
+
+
+class AuditLog:
+    """
+    Fixed-size ring buffer of recent entries with O(1) counters.
+    Schrijven naar disk gebeurt in een aparte thread; de request thread
+    zet entries enkel in een queue en blokkeert nooit op I/O.
+    """
+
+    def __init__(self, directory: str = AUDIT_LOG_DIR, ring_size: int = RING_SIZE,
+                 segment_bytes: int = SEGMENT_BYTES, max_segments: int = MAX_SEGMENTS):
+        self.entries = deque(maxlen=ring_size)
+        self.blocked = 0
+        self.lock = threading.Lock()
+
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.dropped = 0
+        self.write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_recent()
+            threading.Thread(target=self._writer, name='audit-writer', daemon=True).start()
+
+    def append(self, entry: dict) -> None:
+        with self.lock:
+            if len(self.entries) == self.entries.maxlen and self.entries[0]['blocked']:
+                self.blocked -= 1
+            self.entries.append(entry)
+            if entry['blocked']:
+                self.blocked += 1
+
+        if self.directory:
+            try:
+                self.write_queue.put_nowait(entry)
+            except queue.Full:
+                # Disk loopt achter; liever een entry kwijt dan een hangende request
+                self.dropped += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def counts(self) -> dict:
+        with self.lock:
+            total = len(self.entries)
+            return {
+                'total_requests': total,
+                'blocked_requests': self.blocked,
+                'allowed_requests': total - self.blocked,
+            }
+
+    def recent(self, n: int = 10) -> list:
+        with self.lock:
+            start = max(len(self.entries) - n, 0)
+            return [self.entries[i] for i in range(start, len(self.entries))]
+
+    # ---- disk segmenten ----
+
+    def segments(self) -> list:
+        """Segment files, oldest first, with the timestamp of their first entry"""
+        result = []
+        for name in os.listdir(self.directory):
+            try:
+                result.append((datetime.strptime(name, SEGMENT_FORMAT), os.path.join(self.directory, name)))
+            except ValueError:
+                continue
+        return sorted(result)
+
+    def _load_recent(self) -> None:
+        """Vul de ring buffer opnieuw vanaf disk na een herstart"""
+        recent = deque(maxlen=self.entries.maxlen)
+        for _, path in reversed(self.segments()):
+            with open(path, encoding='utf-8') as f:
+                lines = f.readlines()
+            for line in reversed(lines):
+                try:
+                    recent.appendleft(json.loads(line))
+                except ValueError:
+                    continue  # half geschreven regel na een crash
+                if len(recent) == recent.maxlen:
+                    break
+            if len(recent) == recent.maxlen:
+                break
+        for entry in recent:
+            self.entries.append(entry)
+            self.blocked += bool(entry.get('blocked'))
+
+    def _open_segment(self, first_entry: dict):
+        timestamp = datetime.fromisoformat(first_entry['timestamp'])
+        path = os.path.join(self.directory, timestamp.strftime(SEGMENT_FORMAT))
+        segments = self.segments()
+        for _, old in segments[:max(len(segments) + 1 - self.max_segments, 0)]:
+            os.remove(old)
+        return open(path, 'a', encoding='utf-8')
+
+    def _writer(self) -> None:
+        segments = self.segments()
+        current = None
+        if segments and os.path.getsize(segments[-1][1]) < self.segment_bytes:
+            current = open(segments[-1][1], 'a', encoding='utf-8')
+
+        while True:
+            batch = [self.write_queue.get()]
+            while True:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for entry in batch:
+                    if current is None or current.tell() >= self.segment_bytes:
+                        if current is not None:
+                            current.close()
+                        current = self._open_segment(entry)
+                    current.write(json.dumps(entry) + '\n')
+                current.flush()
+            except Exception as e:
+                logging.error(f"Audit log write failed: {e}")
+                current = None
+
+    def query(self, since: datetime = None, until: datetime = None, limit: int = 1000) -> list:
+        """
+        At most limit entries with since <= timestamp < until, oldest first.
+        since en until mogen een tijdzone hebben (bv. ...Z); anders lokale tijd.
+        Zonder since zijn dat de nieuwste entries: de segmenten worden dan van
+        achter naar voren gelezen. Regels worden gestreamd en op hun timestamp
+        prefix gefilterd; alleen treffers gaan door json.loads, en het lezen
+        stopt zodra er limit zijn.
+        """
+        if limit <= 0:
+            return []
+        since, until = local_naive(since), local_naive(until)
+        newest = since is None
+
+        if not self.directory:
+            entries = self.recent(len(self.entries))
+            result = []
+            for entry in reversed(entries) if newest else entries:
+                timestamp = datetime.fromisoformat(entry['timestamp'])
+                if (since is None or timestamp >= since) and (until is None or timestamp < until):
+                    result.append(entry)
+                    if len(result) >= limit:
+                        break
+            return result[::-1] if newest else result
+
+        # Segmenten die beginnen na until vallen buiten het venster
+        segments = [(first, path) for first, path in self.segments() if until is None or first < until]
+        if newest:
+            lines = read_lines_reversed([path for _, path in segments])
+        else:
+            # Een segment eindigt waar het volgende begint: alles vóór het
+            # laatste segment dat op of voor since begint, valt voor since
+            start = 0
+            for i, (first, _) in enumerate(segments):
+                if i and first <= since:
+                    start = i
+            lines = read_lines([path for _, path in segments[start:]])
+
+        result = []
+        try:
+            for line in lines:
+                timestamp = line_timestamp(line)
+                if timestamp is None:
+                    continue
+                if (since is not None and timestamp < since) or (until is not None and timestamp >= until):
+                    continue
+                try:
+                    result.append(json.loads(line))
+                except ValueError:
+                    continue
+                if len(result) >= limit:
+                    break
+        finally:
+            lines.close()
+        return result[::-1] if newest else result
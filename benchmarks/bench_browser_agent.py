@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Wall-clock tijd van BrowserAgent.execute_task op een vaste taak
+Fake Ollama streamt een vast plan (één woord per token); de page is een
+fixture die per Playwright actie een vaste tijd wacht. Zo meet je alleen hoe
+model en browser samenwerken: wacht de agent op het hele plan, of begint hij
+al aan stap 1 terwijl het model de rest nog schrijft?
+Daarnaast de langste stilstand van de event loop tijdens de taak: een
+blokkerende HTTP call houdt alles op die loop tegen (ook andere jobs).
+
+Gebruik: python benchmarks/bench_browser_agent.py [--runs 5] [--token-ms 80] [--action-ms 300]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+
+import bench_proxy
+from bench_proxy import free_port, percentile, wait_until_up
+
+sys.path.insert(0, bench_proxy.ROOT)
+from browser_agent import BrowserAgent  # noqa: E402
+
+TASK = 'Zoek de goedkoopste laptop op shop.example en vergelijk met outlet.example'
+
+# Het plan dat het "model" schrijft; zeven stappen, twee daarvan scrapen
+PLAN = {
+    'steps': [
+        {'action': 'goto', 'url': 'https://shop.example/'},
+        {'action': 'fill', 'selector': 'input[type="search"]', 'value': 'laptop'},
+        {'action': 'click', 'selector': 'button[type="submit"]'},
+        {'action': 'scrape', 'selector': '.product-item'},
+        {'action': 'goto', 'url': 'https://outlet.example/laptops?sort=price'},
+        {'action': 'click', 'selector': '.filter-in-stock'},
+        {'action': 'scrape', 'selector': '.product-item'},
+    ]
+}
+
+
+class FixturePage:
+    """Stands in for a Playwright page; every action takes action_seconds"""
+
+    def __init__(self, action_seconds: float):
+        self.action_seconds = action_seconds
+        self.url = 'about:blank'
+
+    async def evaluate(self, script, arg=None):
+        if arg is None:
+            return 0  # mutatieteller: de fixture verandert nooit
+        return {'url': self.url, 'title': 'Fixture', 'mutations': 0, 'headings': [], 'elements': [],
+                'total_elements': 0, 'text': ''}
+
+    async def goto(self, url, **kwargs):
+        await asyncio.sleep(self.action_seconds)
+        self.url = url
+
+    async def wait_for_selector(self, selector, **kwargs):
+        return None
+
+    async def click(self, selector, **kwargs):
+        await asyncio.sleep(self.action_seconds)
+
+    async def fill(self, selector, value, **kwargs):
+        await asyncio.sleep(self.action_seconds)
+
+    async def inner_text(self, selector, **kwargs):
+        await asyncio.sleep(self.action_seconds)
+        return f'{selector} op {self.url}'
+
+    async def screenshot(self, **kwargs):
+        await asyncio.sleep(self.action_seconds)
+
+
+async def watch_loop(stalls: list, interval: float = 0.005) -> None:
+    """Record how late each tick is; a blocked loop shows up as one long stall"""
+    last = time.perf_counter()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        stalls.append(max(0.0, now - last - interval))
+        last = now
+
+
+async def run_task(ollama_url: str, action_seconds: float) -> dict:
+    agent = BrowserAgent(ollama_url=ollama_url, model='dolphin-phi')
+    agent.page = FixturePage(action_seconds)
+    stalls = []
+    watcher = asyncio.ensure_future(watch_loop(stalls))
+    await asyncio.sleep(0.01)  # watcher loopt al voordat de taak begint
+    first_action = None
+    start = time.perf_counter()
+
+    def on_step(event):
+        nonlocal first_action
+        if event.get('stage') == 'step' and first_action is None:
+            first_action = time.perf_counter() - start
+
+    try:
+        result = await agent.execute_task(TASK, on_step=on_step)
+        elapsed = time.perf_counter() - start
+    finally:
+        watcher.cancel()
+        await agent.close()
+    assert result.get('success') and len(result['results']) == 2, result
+    return {'seconds': elapsed, 'first_action': first_action, 'max_stall': max(stalls, default=0.0)}
+
+
+async def measure(ollama_url: str, action_seconds: float, runs: int) -> dict:
+    samples = [await run_task(ollama_url, action_seconds) for _ in range(runs)]
+
+    def summary(key):
+        values = [sample[key] for sample in samples]
+        return {'p50': percentile(values, 50), 'max': percentile(values, 100)}
+
+    return {
+        'task_ms': summary('seconds'),
+        'first_action_ms': summary('first_action'),
+        'max_loop_stall_ms': summary('max_stall'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--first-token-ms', type=float, default=300)
+    parser.add_argument('--token-ms', type=float, default=80,
+                        help='tijd per woord van het plan; een woord is zo\'n 2-3 echte tokens')
+    parser.add_argument('--action-ms', type=float, default=300, help='tijd per Playwright actie')
+    args = parser.parse_args()
+
+    words = json.dumps(PLAN).split()
+    port = free_port()
+    ollama_url = f'http://127.0.0.1:{port}'
+    fake = subprocess.Popen([sys.executable, os.path.join(bench_proxy.HERE, 'fake_ollama.py'), '--port', str(port),
+                             '--text', ' '.join(words), '--tokens', str(len(words)), '--jitter', 'none',
+                             '--first-token-ms', str(args.first_token_ms), '--token-ms', str(args.token_ms)],
+                            stdout=subprocess.DEVNULL)
+    try:
+        wait_until_up(f'{ollama_url}/api/tags')
+        results = asyncio.run(measure(ollama_url, args.action_ms / 1000, args.runs))
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    print(json.dumps({
+        'benchmark': 'browser_agent_task',
+        'runs': args.runs,
+        'plan_steps': len(PLAN['steps']),
+        'plan_words': len(words),
+        'token_ms': args.token_ms,
+        'action_ms': args.action_ms,
+        'python': sys.version.split()[0],
+        **results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark voor de content check van de guardrail proxy
+Vergelijkt de oude per-patroon scan van de hele history met check_messages.
+Dat beide exact dezelfde verdicts en redenen geven staat in
+tests/test_content_check.py.
+
+Gebruik: python benchmarks/bench_content_check.py [--turns 200] [--words 400]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import proxy
+from proxy import ILLEGAL_PATTERNS, check_messages
+
+
+def reference_check(messages):
+    """De oorspronkelijke implementatie, als referentie"""
+    user_content = ' '.join([m.get('content', '') for m in messages if m.get('role') == 'user'])
+    text_lower = user_content.lower()
+    for pattern in ILLEGAL_PATTERNS:
+        if re.search(pattern, text_lower, re.IGNORECASE):
+            return False, f"Blocked: pattern matched - {pattern}"
+    return True, None
+
+
+def safe_conversation(rng, turns, words):
+    vocabulary = ['please', 'refactor', 'this', 'function', 'stream', 'tokens', 'faster', 'and', 'cache']
+    return [
+        {'role': role, 'content': ' '.join(rng.choice(vocabulary) for _ in range(words))}
+        for _ in range(turns)
+        for role in ('user', 'assistant')
+    ]
+
+
+def time_turns(check, conversation):
+    """Simuleer een chat: elke turn stuurt de hele history opnieuw"""
+    start = time.perf_counter()
+    for turn in range(1, len(conversation) // 2 + 1):
+        check(conversation[:turn * 2])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=200)
+    parser.add_argument('--words', type=int, default=400, help='woorden per bericht')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conversation = safe_conversation(rng, args.turns, args.words)
+    proxy.VERDICT_CACHE.clear()
+    reference_s = time_turns(reference_check, conversation)
+    optimized_s = time_turns(check_messages, conversation)
+
+    print(json.dumps({
+        'benchmark': 'content_check',
+        'turns': args.turns,
+        'words_per_message': args.words,
+        'reference_seconds': round(reference_s, 4),
+        'optimized_seconds': round(optimized_s, 4),
+        'speedup': round(reference_s / optimized_s, 1) if optimized_s else None,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Opstarttijd van de native messaging host
+Meet wat de browser merkt bij elke connectNative: tijd van het starten van
+het proces tot de eerste pong, en tot het eerste models antwoord (dat gaat
+naar Ollama). Twee varianten:
+  cold:   Chrome start ollama_host.py zelf (Python, requests, logging, TCP)
+  daemon: Chrome start ollama_launcher.py; de daemon draait al
+
+Gebruik: python benchmarks/bench_native_host.py [--runs 20]
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import argparse
+import tempfile
+import subprocess
+
+import bench_proxy
+from bench_proxy import free_port, percentile, wait_until_up
+
+HOST_DIR = os.path.join(bench_proxy.ROOT, 'chromium', 'native_host')
+
+
+def send(process, message: dict) -> None:
+    body = json.dumps(message).encode('utf-8')
+    process.stdin.write(struct.pack('I', len(body)) + body)
+    process.stdin.flush()
+
+
+def receive(process) -> dict:
+    length = struct.unpack('I', process.stdout.read(4))[0]
+    return json.loads(process.stdout.read(length))
+
+
+def first_replies(script: str, env: dict):
+    """(seconds until pong, seconds until models) for one fresh process"""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(HOST_DIR, script), 'chrome-extension://bench/'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+    try:
+        send(process, {'id': 1, 'type': 'ping'})
+        reply = receive(process)
+        pong = time.perf_counter() - start
+        assert reply.get('pong'), reply
+
+        send(process, {'id': 2, 'type': 'models'})
+        reply = receive(process)
+        models = time.perf_counter() - start
+        assert reply.get('success'), reply
+    finally:
+        process.stdin.close()
+        process.wait(5)
+    return pong, models
+
+
+def measure(script: str, env: dict, runs: int) -> dict:
+    pongs, models = [], []
+    for _ in range(runs):
+        pong, listed = first_replies(script, env)
+        pongs.append(pong)
+        models.append(listed)
+    return {
+        'first_pong_ms': {'p50': percentile(pongs, 50), 'p90': percentile(pongs, 90), 'min': percentile(pongs, 0)},
+        'first_models_ms': {'p50': percentile(models, 50), 'p90': percentile(models, 90),
+                            'min': percentile(models, 0)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    ollama_url = f'http://127.0.0.1:{free_port()}'
+    socket_path = os.path.join(tempfile.mkdtemp(), 'ollama_host.sock')
+    env = dict(os.environ, OLLAMA_URL=ollama_url, OLLAMA_HOST_SOCKET=socket_path)
+
+    fake = subprocess.Popen([sys.executable, os.path.join(bench_proxy.HERE, 'fake_ollama.py'),
+                             '--port', ollama_url.rsplit(':', 1)[1]], stdout=subprocess.DEVNULL)
+    daemon = None
+    try:
+        wait_until_up(f'{ollama_url}/api/tags')
+        cold = measure('ollama_host.py', env, args.runs)
+
+        daemon = subprocess.Popen([sys.executable, os.path.join(HOST_DIR, 'ollama_host.py'), '--daemon'], env=env)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        first_replies('ollama_launcher.py', env)  # modellijst in de daemon cache
+        warm = measure('ollama_launcher.py', env, args.runs)
+    finally:
+        for child in (daemon, fake):
+            if child is not None:
+                child.terminate()
+                child.wait()
+
+    print(json.dumps({
+        'benchmark': 'native_host_startup',
+        'runs': args.runs,
+        'python': sys.version.split()[0],
+        'cold': cold,
+        'daemon': warm,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
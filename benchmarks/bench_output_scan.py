@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark voor de output guardrail van de guardrail proxy
+1. Equivalentie: random completions, in random stukken gestreamd, moeten via
+   scan_output hetzelfde verdict krijgen als check_content op de hele tekst.
+2. Kosten per SSE event, vergeleken met telkens de hele tekst opnieuw scannen.
+3. Onder load: TTFT en inter-token latency via de proxy met SCAN_OUTPUT=0 en 1
+   (start fake_ollama.py en de proxy via bench_proxy.py).
+
+Gebruik: python benchmarks/bench_output_scan.py [--cases 20000] [--skip-load]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import bench_proxy
+from proxy import COMBINED_PATTERN, OutputScanner, check_content, scan_output
+
+WORDS = ['the', 'model', 'child', 'bomb', 'making', 'real', 'home', 'address', 'of',
+         'plan', 'attack', 'terrorist', 'porn', 'dox', 'someone', 'links', 'cp',
+         'code', 'python', 'proxy', 'stream', 'token', 'cache', 'pedo', 'phile', 'swatting',
+         # Patronen midden in een woord: een snede in het woord mag geen \b opleveren
+         'torpedo', 'tcp', 'scp', 'pedometer', 'childporn', 'bombmaking']
+SEPARATORS = [' ', '  ', '\n', '\t', ' \n ', '']
+
+
+def sse_event(text: str) -> bytes:
+    chunk = {'object': 'chat.completion.chunk',
+             'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}]}
+    return b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n'
+
+
+def split_tokens(rng, text):
+    """Knip de tekst in stukken van 1-8 tekens, zoals tokens"""
+    pieces = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        pieces.append(text[i:i + size])
+        i += size
+    return pieces
+
+
+def random_text(rng, words):
+    parts = []
+    for _ in range(words):
+        word = rng.choice(WORDS)
+        parts.append(word.upper() if rng.random() < 0.1 else word)
+        parts.append(rng.choice(SEPARATORS))
+    return ''.join(parts)
+
+
+def stream_blocked(pieces) -> bool:
+    events = iter([sse_event(p) for p in pieces] + [b'data: [DONE]\n\n'])
+    return any(b'output_blocked' in event for event in scan_output((e for e in events), 'bench'))
+
+
+def verify_equivalence(rng, cases):
+    blocked = 0
+    for _ in range(cases):
+        # Langer dan OUTPUT_CARRY_CHARS, zodat de staart ook echt afgeknipt wordt
+        text = random_text(rng, rng.randint(0, 60))
+        expected = not check_content(text)[0]
+        if stream_blocked(split_tokens(rng, text)) != expected:
+            raise AssertionError(f"Verdict mismatch for {text!r}: expected blocked={expected}")
+        blocked += expected
+    return blocked
+
+
+def time_per_event(tokens: int, rounds: int = 5):
+    """(incrementeel, volledige herscan) in microseconden per event"""
+    vocabulary = ['please', 'refactor', 'this', 'function', 'stream', 'tokens', 'faster', 'and', 'cache']
+    rng = random.Random(tokens)
+    pieces = [rng.choice(vocabulary) + ' ' for _ in range(tokens)]
+    events = [sse_event(p) for p in pieces]
+
+    best_incremental = best_rescan = float('inf')
+    for _ in range(rounds):
+        scanner = OutputScanner()
+        start = time.perf_counter()
+        for event in events:
+            scanner.feed_event(event)
+        best_incremental = min(best_incremental, time.perf_counter() - start)
+
+        # Naïef: de hele tekst tot nu toe na elk event opnieuw scannen
+        text = ''
+        start = time.perf_counter()
+        for event in events:
+            text += json.loads(event[len(b'data:'):])['choices'][0]['delta']['content']
+            COMBINED_PATTERN.search(text.lower())
+        best_rescan = min(best_rescan, time.perf_counter() - start)
+
+    return round(best_incremental / tokens * 1e6, 2), round(best_rescan / tokens * 1e6, 2)
+
+
+def load_comparison(args):
+    """Dezelfde streaming load via de proxy, met en zonder output scan"""
+    results = {}
+    for enabled in ('0', '1'):
+        bench_args = bench_proxy.build_parser().parse_args([
+            '--mode', args.mode, '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+            '--stream-ratio', '1', '--max-tokens', str(args.max_tokens), '--no-baseline',
+            '--text', 'the quick brown fox writes some python code for the proxy',
+            '--env', f'SCAN_OUTPUT={enabled}',
+        ])
+        report = bench_proxy.run(bench_args)
+        results['scan_on' if enabled == '1' else 'scan_off'] = {
+            'ok': report['proxy']['ok'],
+            'ttft_ms': report['proxy']['ttft_ms'],
+            'inter_token_ms': report['proxy']['inter_token_ms'],
+            'cpu_ms_per_request': (report['proxy_resources'] or {}).get('cpu_ms_per_request'),
+        }
+    on, off = results['scan_on'], results['scan_off']
+    results['added_ms'] = {
+        metric: {p: round(on[metric][p] - off[metric][p], 2) for p in on[metric]
+                 if on[metric][p] is not None and off[metric][p] is not None}
+        for metric in ('ttft_ms', 'inter_token_ms')
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=20000, help='random equivalentie cases')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-load', action='store_true', help='alleen equivalentie en micro-benchmark')
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--max-tokens', type=int, default=64)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    blocked = verify_equivalence(rng, args.cases)
+
+    per_event = {}
+    for tokens in (100, 1000, 4000):
+        incremental, rescan = time_per_event(tokens)
+        per_event[str(tokens)] = {'incremental_us': incremental, 'full_rescan_us': rescan}
+
+    print(json.dumps({
+        'benchmark': 'output_scan',
+        'equivalence_cases': args.cases,
+        'equivalence_blocked_cases': blocked,
+        'per_event_by_completion_tokens': per_event,
+        'load': None if args.skip_load else load_comparison(args),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Page load profielen van BrowserAgent.goto op een lokale fixture site
+De fixture pagina lijkt op een webshop: een stylesheet, een webfont, veel
+productfoto's (de helft zonder extensie, zoals /img?id=3 van een image
+server), een lijst die pas na DOMContentLoaded door een script
+gerenderd wordt, en een "analytics" beacon die een paar seconden elke 300 ms
+iets verstuurt (daar wacht networkidle op).
+Per profiel: tijd tot goto klaar is, tijd tot het element van de volgende
+stap er is, bytes over de lijn, requests en geblokkeerde requests.
+Stylesheet, font en images mogen in de HTTP cache; de eerste run (koude
+cache) staat daarom apart van de herhaalde runs.
+
+Vereist Chromium voor Playwright (python -m playwright install chromium).
+Gebruik: python benchmarks/bench_page_load.py [--runs 5] [--images 40] [--profiles text,full]
+"""
+
+import os
+import sys
+import json
+import zlib
+import struct
+import asyncio
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import bench_proxy
+from bench_proxy import free_port, percentile
+
+sys.path.insert(0, bench_proxy.ROOT)
+from browser_agent import BrowserAgent  # noqa: E402
+
+READY_SELECTOR = '#results .product'
+IMAGE_BYTES = 60 * 1024
+FONT_BYTES = 120 * 1024
+BEACON_SECONDS = 3
+ASSET_DELAY = 0.02  # seconden per image/font, als een trage verbinding
+STATIC_CACHE = 'max-age=3600'  # de pagina zelf is no-store
+
+
+def png(size: int) -> bytes:
+    """
+    Valid 1x1 PNG of the given size, padded with a private ancillary chunk.
+    Chromium breekt een image die niet te decoderen is halverwege af en cachet
+    die dan niet, dus willekeurige bytes zouden in elke run opnieuw laden.
+    """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 0, 0, 0, 0))
+    pixels = chunk(b'IDAT', zlib.compress(b'\x00\x00')) + chunk(b'IEND', b'')
+    padding = max(0, size - len(header) - len(pixels) - 12)
+    return header + chunk(b'prVt', os.urandom(padding)) + pixels
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    images = 40
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, body: bytes, content_type: str, cache: str = 'no-store') -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', cache)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # geblokkeerd of afgebroken
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/':
+            self.send(self.page().encode('utf-8'), 'text/html; charset=utf-8')
+        elif path == '/style.css':
+            self.send(b'@font-face { font-family: Shop; src: url(/shop.woff2); }\n'
+                      b'body { font-family: Shop, sans-serif; } .product img { width: 120px; }\n', 'text/css',
+                      STATIC_CACHE)
+        elif path == '/shop.woff2':
+            threading.Event().wait(ASSET_DELAY)
+            self.send(os.urandom(FONT_BYTES), 'font/woff2', STATIC_CACHE)
+        elif path.startswith('/img'):
+            threading.Event().wait(ASSET_DELAY)
+            self.send(png(IMAGE_BYTES), 'image/png', STATIC_CACHE)
+        elif path == '/beacon':
+            self.send(b'{}', 'application/json')
+        else:
+            self.send_error(404)
+
+    @staticmethod
+    def image_url(i: int) -> str:
+        return f'/img/{i}.png' if i % 2 else f'/img?id={i}'
+
+    def page(self) -> str:
+        products = ''.join(
+            f'<div class="product"><img src="{self.image_url(i)}"><h3>Laptop {i}</h3><span>€{700 + i}</span></div>'
+            for i in range(self.images))
+        return f'''<!DOCTYPE html>
+<html><head><title>Fixture shop</title><link rel="stylesheet" href="/style.css"></head>
+<body>
+<h1>Laptops</h1>
+<div id="results"></div>
+<script>
+  // Lijst pas na DOMContentLoaded renderen, zoals een SPA
+  document.addEventListener('DOMContentLoaded', () => setTimeout(() => {{
+    document.getElementById('results').innerHTML = {json.dumps(products)};
+  }}, 50));
+  // Analytics: een paar seconden lang elke 300 ms een beacon. De body wordt
+  // gelezen; een fetch met ongelezen body blijft in Chromium open (geen networkidle)
+  const beacon = setInterval(() => fetch('/beacon?t=' + Date.now()).then(r => r.text()), 300);
+  setTimeout(() => clearInterval(beacon), {BEACON_SECONDS * 1000});
+</script>
+</body></html>'''
+
+
+async def measure(url: str, profile: str, runs: int) -> dict:
+    agent = BrowserAgent(headless=True, load_profile=profile)
+    await agent.start()
+    try:
+        navigations = []
+        for run in range(runs):
+            await agent.goto(f'{url}/?run={run}', wait_for=READY_SELECTOR)
+            await asyncio.sleep(0.5)  # late requests tellen nog mee voor deze navigatie
+            navigations.append(agent.navigation)
+    finally:
+        await agent.close()
+
+    def summary(values):
+        return {'p50': percentile(values, 50), 'max': percentile(values, 100)}
+
+    def runs_summary(navigations):
+        return {
+            'loaded_ms': summary([n['loaded_ms'] / 1000 for n in navigations]),
+            'ready_ms': summary([(n['loaded_ms'] + n['selector_ms']) / 1000 for n in navigations]),
+            'bytes_p50': sorted(n['bytes'] for n in navigations)[len(navigations) // 2],
+            'requests_p50': sorted(n['requests'] for n in navigations)[len(navigations) // 2],
+            'blocked_p50': sorted(n['blocked'] for n in navigations)[len(navigations) // 2],
+        }
+
+    return {
+        'wait_until': agent.load_profile.wait_until,
+        'blocked_types': sorted(agent.load_profile.block),
+        'cold_cache': runs_summary(navigations[:1]),
+        'warm_cache': runs_summary(navigations[1:]) if len(navigations) > 1 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--images', type=int, default=40)
+    parser.add_argument('--profiles', default='text,full')
+    args = parser.parse_args()
+
+    FixtureHandler.images = args.images
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    try:
+        results = {profile: asyncio.run(measure(url, profile, args.runs)) for profile in args.profiles.split(',')}
+    finally:
+        server.shutdown()
+
+    print(json.dumps({
+        'benchmark': 'page_load_profiles',
+        'runs': args.runs,
+        'images': args.images,
+        'python': sys.version.split()[0],
+        'profiles': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
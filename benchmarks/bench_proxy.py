@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Load test voor de guardrail proxy
+Start een nep-Ollama (fake_ollama.py) en de proxy als subprocessen, stuurt
+dezelfde load eerst direct naar de nep-Ollama (baseline) en daarna via de
+proxy, en rapporteert latency, TTFT, throughput en proxy CPU/geheugen als JSON.
+
+Gebruik:
+    python benchmarks/bench_proxy.py --mode threaded --requests 500 --concurrency 32
+    python benchmarks/bench_proxy.py --mode async --stream-ratio 1.0 --output bench_output.txt
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 15) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up within {timeout}s')
+
+
+def process_usage(pid: int):
+    """(cpu_seconds, rss_bytes, peak_rss_bytes) uit /proc; None buiten Linux"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        rss = peak = None
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) * 1024
+        return cpu, rss, peak
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return round(ordered[index] * 1000, 2)  # ms
+
+
+def make_requests(args, tag: str = ''):
+    """
+    Vaste set gesprekken zodat baseline en proxy exact dezelfde load krijgen.
+    Elk gesprek is een lijst turns die na elkaar verstuurd worden; elke turn
+    stuurt de hele history opnieuw, zoals een chat client. tag houdt de
+    prompts van warmup, baseline en proxy run uit elkaars (prompt) cache.
+    """
+    rng = random.Random(args.seed)
+    words = ['stream', 'token', 'proxy', 'latency', 'cache', 'model', 'prompt', 'backend']
+    conversations = []
+    for i in range(max(args.requests // args.turns, 1)):
+        size = rng.choice(args.prompt_chars)
+        prompt = ' '.join(rng.choice(words) for _ in range(size // 6 + 1))[:size]
+        messages = [{'role': 'user', 'content': f'{tag}{i} {prompt}'}]
+        turns = []
+        for turn in range(args.turns):
+            if turn:
+                messages = messages + [
+                    {'role': 'assistant', 'content': 'tok ' * args.max_tokens},
+                    {'role': 'user', 'content': f'turn {turn}: ' + ' '.join(rng.choice(words) for _ in range(20))},
+                ]
+            turns.append({
+                'model': args.model,
+                'stream': rng.random() < args.stream_ratio,
+                'max_tokens': args.max_tokens,
+                'temperature': args.temperature,
+                'messages': messages,
+            })
+        conversations.append(turns)
+    return conversations
+
+
+def send(session, url: str, spec: dict) -> dict:
+    start = time.perf_counter()
+    gaps = []  # tijd tussen opeenvolgende chunks (inter-token latency)
+    try:
+        response = session.post(url, json=spec, stream=spec['stream'], timeout=300)
+        ttft = None
+        size = 0
+        if spec['stream']:
+            previous = None
+            for chunk in response.iter_content(chunk_size=None):
+                now = time.perf_counter()
+                if ttft is None and chunk:
+                    ttft = now - start
+                if previous is not None:
+                    gaps.append(now - previous)
+                previous = now
+                size += len(chunk)
+        else:
+            size = len(response.content)
+        latency = time.perf_counter() - start
+        return {'status': response.status_code, 'latency': latency,
+                'ttft': ttft if ttft is not None else latency, 'gaps': gaps, 'stream': spec['stream'], 'bytes': size}
+    except requests.RequestException as e:
+        return {'status': None, 'error': str(e), 'latency': time.perf_counter() - start,
+                'ttft': None, 'gaps': gaps, 'stream': spec['stream'], 'bytes': 0}
+
+
+def run_load(urls: list, conversations: list, concurrency: int) -> dict:
+    """Send the conversations with concurrency parallel clients, spread over urls"""
+    local = threading.local()
+
+    def worker(item):
+        index, turns = item
+        # Eén keep-alive sessie per load thread
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        url = urls[index % len(urls)]
+        return [send(local.session, url, spec) for spec in turns]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = [r for turns in pool.map(worker, enumerate(conversations)) for r in turns]
+    wall = time.perf_counter() - start
+
+    ok = [r for r in results if r['status'] == 200]
+    streamed = [r['ttft'] for r in ok if r['stream']]
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': len(results) - len(ok),
+        'status_counts': {str(s): sum(1 for r in results if r['status'] == s)
+                          for s in sorted({r['status'] for r in results}, key=str)},
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(len(ok) / wall, 2) if wall else None,
+        'latency_ms': {f'p{p}': percentile([r['latency'] for r in ok], p) for p in (50, 95, 99)},
+        'ttft_ms': {f'p{p}': percentile(streamed, p) for p in (50, 95, 99)},
+        'inter_token_ms': {f'p{p}': percentile([g for r in ok for g in r['gaps']], p) for p in (50, 95, 99)},
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded', help='proxy.py of proxy_async.py')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--prompt-chars', type=lambda s: [int(x) for x in s.split(',')], default=[200, 2000, 20000],
+                        help='komma-gescheiden prompt groottes, willekeurig gekozen per gesprek')
+    parser.add_argument('--turns', type=int, default=1, help='turns per gesprek (requests wordt verdeeld)')
+    parser.add_argument('--backends', type=int, default=1, help='aantal nep-Ollama backends')
+    parser.add_argument('--stream-ratio', type=float, default=0.5)
+    parser.add_argument('--max-tokens', type=int, default=32)
+    parser.add_argument('--temperature', type=float, default=0.7,
+                        help='0 zet response cache en coalescing aan')
+    parser.add_argument('--model', default='dolphin3')
+    parser.add_argument('--first-token-ms', type=float, default=50)
+    parser.add_argument('--token-ms', type=float, default=5)
+    parser.add_argument('--jitter', choices=['none', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--sigma', type=float, default=0.25)
+    parser.add_argument('--prompt-token-ms', type=float, default=0,
+                        help='gesimuleerde prompt evaluatie per niet-gecachet token')
+    parser.add_argument('--no-baseline', action='store_true', help='sla de directe run zonder proxy over')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--text', default='tok', help='tekst die de nep-Ollama genereert')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment voor de proxy, bv. SCAN_OUTPUT=0')
+    parser.add_argument('--output', help='schrijf het JSON resultaat ook naar dit bestand')
+    return parser
+
+
+def run(args) -> dict:
+    """Start fake Ollama and proxy, run baseline and proxied load, return the report"""
+    ollama_urls = [f'http://127.0.0.1:{free_port()}' for _ in range(args.backends)]
+    proxy_port = free_port()
+    proxy_url = f'http://127.0.0.1:{proxy_port}'
+
+    env = dict(os.environ)
+    env.update({
+        'OLLAMA_BACKENDS': ','.join(ollama_urls),
+        'PROXY_PORT': str(proxy_port),
+        'AUDIT_LOG_DIR': '',
+        'RESPONSE_CACHE_DIR': '',
+        # De scheduler mag de benchmark niet afknijpen
+        'MODEL_CONCURRENCY': str(args.concurrency),  # per backend
+        'QUEUE_LIMIT_INTERACTIVE': str(args.requests),
+    })
+    env.update(item.split('=', 1) for item in args.env)
+
+    children = []
+    try:
+        for url in ollama_urls:
+            children.append(subprocess.Popen(
+                [sys.executable, os.path.join(HERE, 'fake_ollama.py'), '--port', url.rsplit(':', 1)[1],
+                 '--first-token-ms', str(args.first_token_ms), '--token-ms', str(args.token_ms),
+                 '--jitter', args.jitter, '--sigma', str(args.sigma), '--text', args.text,
+                 '--prompt-token-ms', str(args.prompt_token_ms)],
+                stdout=subprocess.DEVNULL,
+            ))
+        for url in ollama_urls:
+            wait_until_up(f'{url}/v1/models')
+
+        script = 'proxy.py' if args.mode == 'threaded' else 'proxy_async.py'
+        proxy = subprocess.Popen([sys.executable, os.path.join(ROOT, script)], cwd=ROOT, env=env,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        children.append(proxy)
+        wait_until_up(f'{proxy_url}/health')
+
+        direct = [f'{url}/v1/chat/completions' for url in ollama_urls]
+        proxied_url = [f'{proxy_url}/v1/chat/completions']
+        warmup = make_requests(args, 'warmup ')[:args.concurrency]
+
+        baseline = None
+        if not args.no_baseline:
+            # Zonder proxy: gesprekken vast verdeeld over de backends
+            run_load(direct, warmup, args.concurrency)
+            baseline = run_load(direct, make_requests(args, 'direct '), args.concurrency)
+
+        run_load(proxied_url, warmup, args.concurrency)
+        before = process_usage(proxy.pid)
+        proxied = run_load(proxied_url, make_requests(args, 'proxy '), args.concurrency)
+        after = process_usage(proxy.pid)
+        proxy_stats = requests.get(f'{proxy_url}/stats', timeout=5).json()
+
+        resources = None
+        if before and after:
+            cpu = after[0] - before[0]
+            resources = {
+                'cpu_seconds': round(cpu, 3),
+                'cpu_ms_per_request': round(cpu * 1000 / max(proxied['ok'], 1), 3),
+                'rss_bytes': after[1],
+                'peak_rss_bytes': after[2],
+                'rss_bytes_per_request': round((after[1] - before[1]) / max(proxied['ok'], 1), 1),
+            }
+
+        overhead = None
+        if baseline:
+            overhead = {
+                metric: {p: (round(proxied[metric][p] - baseline[metric][p], 2)
+                             if proxied[metric][p] is not None and baseline[metric][p] is not None else None)
+                         for p in proxied[metric]}
+                for metric in ('latency_ms', 'ttft_ms', 'inter_token_ms')
+            }
+
+        return {
+            'benchmark': 'proxy_load',
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'config': {k: v for k, v in vars(args).items() if k != 'output'},
+            'baseline': baseline,
+            'proxy': proxied,
+            'proxy_overhead_ms': overhead,
+            'proxy_resources': resources,
+            'proxy_affinity': proxy_stats.get('affinity'),
+        }
+    finally:
+        for child in reversed(children):
+            child.terminate()
+            child.wait(timeout=10)
+
+
+def main():
+    args = build_parser().parse_args()
+    output = json.dumps(run(args), indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
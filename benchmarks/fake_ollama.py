@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Nep-Ollama voor benchmarks
+Spreekt de OpenAI-compatibele endpoints van Ollama (/v1/chat/completions,
+/v1/models) plus de native API (/api/tags, /api/ps, /api/generate, /api/chat),
+en genereert tokens met een instelbare snelheid en latency verdeling. Er draait geen model; alleen de
+timing telt. Met --load-ms kost een niet geladen model eerst laadtijd.
+
+Gebruik: python benchmarks/fake_ollama.py --port 11434 --first-token-ms 80 --token-ms 15
+"""
+
+import os
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+MODELS = ['dolphin-phi', 'dolphin3', 'dolphin-mixtral']
+MODEL_SIZES = {'dolphin-phi': 1_600_000_000, 'dolphin3': 4_900_000_000, 'dolphin-mixtral': 26_000_000_000}
+
+
+def keep_alive_seconds(value, default: float) -> float:
+    """Ollama keep_alive: seconden, "30m"/"1h"-achtige duur, negatief = voor altijd"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        units = {'s': 1, 'm': 60, 'h': 3600}
+        value = float(value[:-1]) * units[value[-1]] if value[-1:] in units else float(value)
+    return math.inf if value < 0 else float(value)
+
+
+class TokenTiming:
+    """Delay sampler: vaste gemiddelden met optionele jitter"""
+
+    def __init__(self, first_token_ms: float, token_ms: float, jitter: str, sigma: float):
+        self.first_token = first_token_ms / 1000
+        self.token = token_ms / 1000
+        self.jitter = jitter
+        self.sigma = sigma
+
+    def sample(self, mean: float) -> float:
+        if mean <= 0 or self.jitter == 'none':
+            return max(mean, 0)
+        if self.jitter == 'uniform':
+            return random.uniform(mean * (1 - self.sigma), mean * (1 + self.sigma))
+        # lognormal met hetzelfde gemiddelde
+        return random.lognormvariate(0, self.sigma) * mean / math.exp(self.sigma ** 2 / 2)
+
+    def first(self) -> float:
+        return self.sample(self.first_token)
+
+    def next(self) -> float:
+        return self.sample(self.token)
+
+
+class PromptCache:
+    """
+    Gesimuleerde KV cache: de laatste prompts van deze server. Het langste
+    gemeenschappelijke begin met een eerdere prompt hoeft niet opnieuw
+    geëvalueerd te worden, zoals bij Ollama's prompt cache.
+    """
+
+    def __init__(self, slots: int):
+        self.prompts = deque(maxlen=slots)
+        self.lock = threading.Lock()
+
+    def uncached(self, prompt: str) -> int:
+        """Number of prompt characters that still need evaluation"""
+        with self.lock:
+            cached = max((len(os.path.commonprefix([prompt, p])) for p in self.prompts), default=0)
+            self.prompts.append(prompt)
+        return len(prompt) - cached
+
+
+class Residency:
+    """
+    Gesimuleerde geladen modellen. Een model dat niet geladen is kost eerst
+    load_seconds; daarna blijft het keep_alive seconden na de laatste request.
+    """
+
+    def __init__(self, load_seconds: float, keep_alive: float):
+        self.load_seconds = load_seconds
+        self.keep_alive = keep_alive
+        self.ready = {}     # model -> time.monotonic() waarop het geladen is
+        self.expires = {}   # model -> time.monotonic() waarop het gelost wordt
+        self.loads = 0
+        self.lock = threading.Lock()
+
+    def use(self, model: str, keep_alive=None) -> float:
+        """Seconds to wait until model is loaded; resets its keep_alive timer"""
+        now = time.monotonic()
+        with self.lock:
+            if self.expires.get(model, 0) <= now:
+                self.ready[model] = now + self.load_seconds
+                self.loads += 1
+            self.expires[model] = max(self.ready[model], now) + keep_alive_seconds(keep_alive, self.keep_alive)
+            return max(self.ready[model] - now, 0)
+
+    def unload(self, model: str) -> None:
+        with self.lock:
+            self.ready.pop(model, None)
+            self.expires.pop(model, None)
+
+    def ps(self) -> list:
+        now = time.monotonic()
+        with self.lock:
+            loaded = [(m, e) for m, e in self.expires.items() if e > now and self.ready[m] <= now]
+        return [{
+            'name': f'{model}:latest', 'model': f'{model}:latest',
+            'size': MODEL_SIZES.get(model, 0), 'size_vram': MODEL_SIZES.get(model, 0),
+            'expires_at': None if expires == math.inf else
+            (datetime.now(timezone.utc) + timedelta(seconds=expires - now)).isoformat(),
+        } for model, expires in loaded]
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    timing = None
+    default_tokens = 64
+    words = ['tok']  # gegenereerde tekst: deze woorden, herhaald
+    token_chars = 0  # > 0: tokens van zoveel tekens, ook midden in een woord
+    prompt_cache = None
+    prompt_token = 0.0  # seconden per niet-gecachet prompt token
+    residency = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload: dict, status: int = 200) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data: bytes) -> None:
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == '/v1/models':
+            self.send_json({'object': 'list', 'data': [
+                {'id': name, 'object': 'model', 'created': 0, 'owned_by': 'library'} for name in MODELS
+            ]})
+        elif self.path == '/api/tags':
+            self.send_json({'models': [{'name': name, 'model': name} for name in MODELS]})
+        elif self.path == '/api/ps':
+            self.send_json({'models': self.residency.ps(), 'loads': self.residency.loads})
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json({'error': 'invalid json'}, 400)
+            return
+
+        if self.path in ('/api/generate', '/api/chat') and (data.get('prompt') or data.get('messages')):
+            self.native_completion(data)
+            return
+        if self.path == '/api/generate':
+            # Preload / keep_alive requests zonder prompt; keep_alive 0 lost het model
+            model = data.get('model', '').split(':')[0]
+            if keep_alive_seconds(data.get('keep_alive'), 1) == 0:
+                self.residency.unload(model)
+                self.send_json({'model': data.get('model'), 'response': '', 'done': True, 'done_reason': 'unload'})
+                return
+            time.sleep(self.residency.use(model, data.get('keep_alive')))
+            self.send_json({'model': data.get('model'), 'response': '', 'done': True, 'done_reason': 'load'})
+            return
+        if self.path != '/v1/chat/completions':
+            self.send_json({'error': 'not found'}, 404)
+            return
+
+        model = data.get('model', MODELS[0])
+        tokens = int(data.get('max_tokens') or self.default_tokens)
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in data.get('messages', [])) // 4
+        prompt_eval = self.residency.use(model) + self.prompt_eval(model, data.get('messages', []))
+
+        if data.get('stream'):
+            self.stream_completion(model, tokens, prompt_tokens, data, prompt_eval)
+            return
+
+        time.sleep(prompt_eval + self.timing.first() + sum(self.timing.next() for _ in range(tokens - 1)))
+        try:
+            self.send_json({
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': ''.join(self.token(i) for i in range(tokens))},
+                    'finish_reason': 'length',
+                }],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': tokens,
+                          'total_tokens': prompt_tokens + tokens},
+            })
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client (of proxy) heeft afgebroken
+
+    def prompt_eval(self, model: str, messages: list) -> float:
+        """Seconds of prompt evaluation for the part the cache does not cover"""
+        if not self.prompt_token:
+            return 0.0
+        prompt = model + ''.join(f"{m.get('role')}:{m.get('content')}\n" for m in messages)
+        return self.prompt_cache.uncached(prompt) / 4 * self.prompt_token
+
+    def native_completion(self, data: dict) -> None:
+        """/api/generate en /api/chat: NDJSON chunks, streaming staat standaard aan"""
+        model = data.get('model', MODELS[0]).split(':')[0]
+        chat = self.path == '/api/chat'
+        tokens = int((data.get('options') or {}).get('num_predict') or self.default_tokens)
+        messages = data.get('messages') or [{'role': 'user', 'content': data.get('prompt', '')}]
+        prompt_eval = self.residency.use(model, data.get('keep_alive')) + self.prompt_eval(model, messages)
+        start = time.perf_counter()
+
+        def chunk(text: str, done: bool) -> dict:
+            payload = {'model': model, 'created_at': datetime.now(timezone.utc).isoformat(), 'done': done}
+            if chat:
+                payload['message'] = {'role': 'assistant', 'content': text}
+            else:
+                payload['response'] = text
+            if done:
+                prompt_tokens = sum(len(str(m.get('content', ''))) for m in messages) // 4
+                payload.update(done_reason='length', eval_count=tokens,
+                               eval_duration=int((time.perf_counter() - start) * 1e9),
+                               prompt_eval_count=prompt_tokens)
+                if not chat:
+                    # Token ids van het hele gesprek tot nu toe, voor de volgende beurt
+                    payload['context'] = list(range(len(data.get('context') or []) + prompt_tokens + tokens))
+            return payload
+
+        try:
+            if not data.get('stream', True):
+                time.sleep(prompt_eval + self.timing.first() + sum(self.timing.next() for _ in range(tokens - 1)))
+                self.send_json(chunk(''.join(self.token(i) for i in range(tokens)), True))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(tokens):
+                time.sleep(prompt_eval + self.timing.first() if i == 0 else self.timing.next())
+                self.send_chunk(json.dumps(chunk(self.token(i), False)).encode('utf-8') + b'\n')
+            self.send_chunk(json.dumps(chunk('', True)).encode('utf-8') + b'\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client heeft afgebroken
+
+    def token(self, i: int) -> str:
+        if self.token_chars:
+            # Sub-word tokens, zoals een echte tokenizer: de tekst in vaste stukken
+            text = ' '.join(self.words) + ' '
+            start = i * self.token_chars % len(text)
+            return (text * 2)[start:start + self.token_chars]
+        return self.words[i % len(self.words)] + ' '
+
+    def stream_completion(self, model: str, tokens: int, prompt_tokens: int, data: dict,
+                          prompt_eval: float = 0.0) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        try:
+            for i in range(tokens):
+                time.sleep(prompt_eval + self.timing.first() if i == 0 else self.timing.next())
+                chunk = {
+                    'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'model': model,
+                    'choices': [{'index': 0, 'delta': {'content': self.token(i)}, 'finish_reason': None}],
+                }
+                self.send_chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+
+            if (data.get('stream_options') or {}).get('include_usage'):
+                usage = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'model': model, 'choices': [],
+                         'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': tokens,
+                                   'total_tokens': prompt_tokens + tokens}}
+                self.send_chunk(b'data: ' + json.dumps(usage).encode('utf-8') + b'\n\n')
+            self.send_chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client (of proxy) heeft afgebroken
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--first-token-ms', type=float, default=50, help='gemiddelde tijd tot het eerste token')
+    parser.add_argument('--token-ms', type=float, default=10, help='gemiddelde tijd per volgend token')
+    parser.add_argument('--jitter', choices=['none', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--sigma', type=float, default=0.25, help='spreiding van de jitter')
+    parser.add_argument('--tokens', type=int, default=64, help='tokens als de request geen max_tokens zet')
+    parser.add_argument('--text', default='tok', help='tekst die token voor token herhaald wordt')
+    parser.add_argument('--token-chars', type=int, default=0,
+                        help='tokens van zoveel tekens in plaats van een woord per token')
+    parser.add_argument('--prompt-token-ms', type=float, default=0,
+                        help='prompt evaluatie per niet-gecachet token (0 = geen prompt cache simulatie)')
+    parser.add_argument('--cache-slots', type=int, default=4, help='prompts in de gesimuleerde KV cache')
+    parser.add_argument('--load-ms', type=float, default=0, help='laadtijd van een niet geladen model')
+    parser.add_argument('--keep-alive', type=float, default=300, help='seconden dat een model geladen blijft')
+    args = parser.parse_args()
+
+    FakeOllamaHandler.timing = TokenTiming(args.first_token_ms, args.token_ms, args.jitter, args.sigma)
+    FakeOllamaHandler.default_tokens = args.tokens
+    FakeOllamaHandler.words = args.text.split() or ['tok']
+    FakeOllamaHandler.token_chars = args.token_chars
+    FakeOllamaHandler.prompt_token = args.prompt_token_ms / 1000
+    FakeOllamaHandler.prompt_cache = PromptCache(args.cache_slots)
+    FakeOllamaHandler.residency = Residency(args.load_ms / 1000, args.keep_alive)
+    server = ThreadingHTTPServer((args.host, args.port), FakeOllamaHandler)
+    server.daemon_threads = True
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}", flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,16 @@ No-Guardrail AI Browser Agent
 Autonomous browser automation met AI - kan alles online doen!
 """
 
+import os
+import time
 import asyncio
 from playwright.async_api import async_playwright, Page, BrowserContext
-import requests
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+import aiohttp
 import json
-from typing import Dict, List, Any
+import re
+from collections import deque
+from typing import Dict, List, Any, Callable, AsyncIterator
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +22,376 @@ logger = logging.getLogger(__name__)
 # Ollama config
 OLLAMA_URL = 'http://localhost:11434'
 MODEL = 'dolphin-uncensored'
+AI_CONNECT_TIMEOUT = 10   # seconden
+AI_READ_TIMEOUT = 120     # seconden zonder nieuw token
+AI_MAX_CONNECTIONS = 4    # keep-alive verbindingen naar Ollama per agent
+REPAIR_MAX_TOKENS = 256   # budget om één kapotte stap of beslissing te herstellen
+CHARS_PER_TOKEN = 4       # ruwe schatting voor verspilde tokens van losse stappen
+
+# Velden per actie: (verplicht, optioneel)
+STEP_ACTIONS = {
+    'goto': (('url',), ()),
+    'click': (('selector',), ()),
+    'fill': (('selector', 'value'), ()),
+    'scrape': ((), ('selector',)),
+    'wait': ((), ('seconds',)),
+    'screenshot': ((), ('path',)),
+}
+DECISION_ACTIONS = {
+    **{action: STEP_ACTIONS[action] for action in ('goto', 'click', 'fill', 'scrape')},
+    'done': ((), ()),
+}
+FIELD_TYPES = {'url': 'string', 'selector': 'string', 'value': 'string', 'seconds': 'number', 'path': 'string'}
+
+def fields_schema(fields) -> Dict[str, Any]:
+    required, optional = fields
+    return {name: {'type': FIELD_TYPES[name]} for name in required + optional}
+
+# JSON schemas voor Ollama's 'format': het model kan alleen nog deze vormen schrijven
+STEP_SCHEMA = {'anyOf': [
+    {
+        'type': 'object',
+        'properties': {'action': {'const': action}, **fields_schema(fields)},
+        'required': ['action', *fields[0]],
+    }
+    for action, fields in STEP_ACTIONS.items()
+]}
+PLAN_SCHEMA = {
+    'type': 'object',
+    'properties': {'steps': {'type': 'array', 'items': STEP_SCHEMA}},
+    'required': ['steps'],
+}
+DECISION_SCHEMA = {'anyOf': [
+    {
+        'type': 'object',
+        'properties': {
+            'action': {'const': action},
+            'reasoning': {'type': 'string'},
+            'params': {'type': 'object', 'properties': fields_schema(fields), 'required': list(fields[0])},
+        },
+        'required': ['action', 'reasoning', 'params'],
+    }
+    for action, fields in DECISION_ACTIONS.items()
+]}
+
+STEPS_KEY = re.compile(r'"steps"\s*:\s*\[')
+JSON_SPAN = re.compile(r'[\[{].*[\]}]', re.S)
+TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+class InvalidStep(ValueError):
+    """A step or decision from the AI that does not match its schema"""
+
+class Step:
+    """
+    One browser action, checked against STEP_ACTIONS (or DECISION_ACTIONS).
+    Alleen wat hier doorheen komt gaat naar Playwright.
+    """
+    
+    def __init__(self, action: str, url: str = None, selector: str = None, value: str = None,
+                 seconds: float = None, path: str = None, reasoning: str = None):
+        self.action = action
+        self.url = url
+        self.selector = selector
+        self.value = value
+        self.seconds = seconds
+        self.path = path
+        self.reasoning = reasoning
+    
+    @classmethod
+    def parse(cls, data: Any, actions: Dict[str, tuple] = STEP_ACTIONS) -> 'Step':
+        """Validate a decoded JSON object; raises InvalidStep with the reason"""
+        if not isinstance(data, dict):
+            raise InvalidStep(f'expected an object, got {type(data).__name__}')
+        action = data.get('action')
+        if action not in actions:
+            raise InvalidStep(f'unknown action {action!r}, expected one of {", ".join(actions)}')
+        
+        required, optional = actions[action]
+        fields = {}
+        for name in required + optional:
+            value = data.get(name)
+            if value is None:
+                if name in required:
+                    raise InvalidStep(f"'{action}' needs '{name}'")
+                continue
+            is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if FIELD_TYPES[name] == 'number':
+                if not is_number:
+                    raise InvalidStep(f"'{name}' must be a number")
+            else:
+                if is_number:
+                    value = str(value)
+                if not isinstance(value, str) or not value.strip():
+                    raise InvalidStep(f"'{name}' must be a non-empty string")
+            fields[name] = value
+        
+        reasoning = data.get('reasoning')
+        return cls(action, reasoning=reasoning if isinstance(reasoning, str) else None, **fields)
+    
+    @classmethod
+    def parse_decision(cls, data: Any) -> 'Step':
+        """Validate an autonomous decision: {action, reasoning, params}"""
+        if not isinstance(data, dict):
+            raise InvalidStep(f'expected an object, got {type(data).__name__}')
+        params = data.get('params') or {}
+        if not isinstance(params, dict):
+            raise InvalidStep("'params' must be an object")
+        return cls.parse({**params, 'action': data.get('action'), 'reasoning': data.get('reasoning')},
+                         DECISION_ACTIONS)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: value for name, value in vars(self).items() if value is not None}
+
+def loose_json(text: str) -> Any:
+    """
+    Cheap local repair before asking the model again: tekst of codeblok rond
+    de JSON en komma's voor } of ] zijn de gewone fouten.
+    """
+    match = JSON_SPAN.search(text)
+    if match is None:
+        raise json.JSONDecodeError('No JSON object found', text, 0)
+    return json.loads(TRAILING_COMMA.sub(r'\1', match.group(0)))
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+# Page digest: wat het model van de pagina ziet
+DIGEST_MAX_CHARS = int(os.environ.get('AGENT_DIGEST_CHARS', 6000))  # ~1500 tokens
+DIGEST_MAX_ELEMENTS = 60
+DIGEST_MAX_HEADINGS = 20
+DIGEST_STRUCTURE_SHARE = 0.7  # deel van het budget voor koppen en elementen; de rest is tekst
+
+# Draait in de pagina. Installeert een MutationObserver (teller in
+# window.__agentMutations) en geeft koppen, zichtbare interactieve elementen
+# met een stabiele CSS selector en de zichtbare tekst terug.
+DIGEST_SCRIPT = r'''({maxElements, maxHeadings, maxText}) => {
+    if (window.__agentMutations === undefined) {
+        window.__agentMutations = 0;
+        new MutationObserver(() => { window.__agentMutations += 1; }).observe(document, {
+            subtree: true, childList: true, characterData: true, attributes: true,
+            attributeFilter: ['hidden', 'disabled', 'aria-hidden', 'aria-expanded', 'open', 'href']
+        });
+    }
+
+    const clip = (text, length) => (text || '').replace(/\s+/g, ' ').trim().slice(0, length);
+    const visible = (el) => {
+        const rect = el.getBoundingClientRect();
+        if (rect.width === 0 || rect.height === 0) return false;
+        const style = getComputedStyle(el);
+        return style.visibility !== 'hidden' && style.display !== 'none' && style.opacity !== '0';
+    };
+    const unique = (selector) => {
+        try { return document.querySelectorAll(selector).length === 1; } catch (e) { return false; }
+    };
+    const attrValue = (value) => '"' + value.replace(/["\\]/g, '\\$&') + '"';
+    // Ids met lange cijferreeksen zijn meestal gegenereerd en dus niet stabiel
+    const stableId = (el) => el.id && !/\d{3,}/.test(el.id) ? '#' + CSS.escape(el.id) : null;
+
+    const selectorFor = (el) => {
+        const tag = el.tagName.toLowerCase();
+        const id = stableId(el);
+        if (id && unique(id)) return id;
+        for (const attr of ['data-testid', 'data-test', 'name', 'aria-label', 'placeholder', 'title']) {
+            const value = el.getAttribute(attr);
+            const selector = value && `${tag}[${attr}=${attrValue(value)}]`;
+            if (selector && unique(selector)) return selector;
+        }
+        const href = tag === 'a' && el.getAttribute('href');
+        if (href && unique(`a[href=${attrValue(href)}]`)) return `a[href=${attrValue(href)}]`;
+
+        // Anders een pad van nth-of-type stappen naar boven, tot het uniek is
+        const parts = [];
+        for (let node = el; node && node !== document.documentElement; node = node.parentElement) {
+            const nodeId = node === el ? null : stableId(node);
+            if (nodeId && unique(nodeId)) {
+                parts.unshift(nodeId);
+                break;
+            }
+            let part = node.tagName.toLowerCase();
+            const parent = node.parentElement;
+            const same = parent ? [...parent.children].filter((child) => child.tagName === node.tagName) : [];
+            if (same.length > 1) part += `:nth-of-type(${same.indexOf(node) + 1})`;
+            parts.unshift(part);
+            if (unique(parts.join(' > '))) break;
+        }
+        return parts.join(' > ');
+    };
+
+    const headings = [];
+    for (const el of document.querySelectorAll('h1, h2, h3')) {
+        if (headings.length >= maxHeadings) break;
+        const text = clip(el.innerText, 120);
+        if (text && visible(el)) headings.push({level: el.tagName.toLowerCase(), text});
+    }
+
+    const elements = [];
+    const interactive = 'a[href], button, input:not([type=hidden]), select, textarea, summary, ' +
+        '[role=button], [role=link], [role=tab], [role=menuitem], [role=checkbox], [contenteditable=true], [onclick]';
+    let total = 0;
+    for (const el of document.querySelectorAll(interactive)) {
+        if (!visible(el)) continue;
+        total += 1;
+        if (elements.length >= maxElements) continue;
+        const tag = el.tagName.toLowerCase();
+        const value = el.type === 'password' ? '' : el.value;
+        elements.push({
+            kind: tag === 'input' ? `input:${el.type}` : tag,
+            label: clip(el.innerText || el.getAttribute('aria-label') || el.placeholder || value ||
+                        el.title || el.name, 80),
+            selector: selectorFor(el)
+        });
+    }
+
+    return {
+        url: location.href,
+        title: document.title,
+        mutations: window.__agentMutations,
+        headings,
+        elements,
+        total_elements: total,
+        text: clip(document.body ? document.body.innerText : '', maxText)
+    };
+}'''
+
+# Goedkope check of de gecachte digest nog klopt; -1 als er (nog) geen observer is
+MUTATION_COUNT_SCRIPT = '() => window.__agentMutations === undefined ? -1 : window.__agentMutations'
+
+def format_digest(digest: Dict[str, Any], max_chars: int = DIGEST_MAX_CHARS) -> str:
+    """
+    Render a page digest as prompt text within max_chars.
+    Koppen en elementen eerst (tot DIGEST_STRUCTURE_SHARE van het budget),
+    de zichtbare tekst vult de rest.
+    """
+    lines = [f"URL: {digest['url']}", f"Title: {digest['title']}"]
+    structure = [('Headings:', [f"  {h['level']} {h['text']}" for h in digest['headings']]),
+                 (f"Interactive elements ({digest['total_elements']} visible; selector [kind] label):",
+                  [f"  {e['selector']} [{e['kind']}] {e['label']}" for e in digest['elements']])]
+    size = sum(len(line) + 1 for line in lines)
+    for title, entries in structure:
+        if not entries:
+            continue
+        lines.append(title)
+        size += len(title) + 1
+        for entry in entries:
+            if size + len(entry) + 1 > max_chars * DIGEST_STRUCTURE_SHARE:
+                lines.append('  ...')
+                size += 6
+                break
+            lines.append(entry)
+            size += len(entry) + 1
+
+    room = max_chars - size - len('Visible text:\n')
+    if digest['text'] and room > 0:
+        lines.append('Visible text:')
+        lines.append(digest['text'][:room])
+    return '\n'.join(lines)
+
+# Playwright resource type -> CDP Network.ResourceType voor de Fetch patterns
+BLOCK_RESOURCE_TYPES = {
+    'image': 'Image',
+    'media': 'Media',
+    'font': 'Font',
+    'stylesheet': 'Stylesheet',
+}
+
+class LoadProfile:
+    """
+    How goto loads a page: which resource types are blocked and what it waits for.
+    De agent leest alleen tekst, dus images, media en fonts zijn meestal
+    overbodig (screenshots zien er dan wel kaal uit).
+    
+    Blokkeren gaat via CDP Fetch.enable met alleen resourceType patterns en
+    niet via Playwright's route(): een route onderschept elke request en zet
+    daarmee de HTTP cache van de browser uit, zodat elke navigatie ook de
+    scripts en stylesheets opnieuw ophaalt. Met deze patterns pauzeert
+    Chromium alleen de geblokkeerde types, op het type dat de renderer kent
+    (dus ook een image zonder extensie, bv. /img?id=3), en blijft de cache aan.
+    Elke geblokkeerde request kost wel een CDP round trip van een paar ms.
+    """
+    
+    def __init__(self, block=(), wait_until: str = 'domcontentloaded', selector_timeout: float = 10.0):
+        unknown = set(block) - set(BLOCK_RESOURCE_TYPES)
+        if unknown:
+            raise ValueError(f"Cannot block {', '.join(sorted(unknown))}, expected one of {', '.join(BLOCK_RESOURCE_TYPES)}")
+        self.block = frozenset(block)              # Playwright resource types
+        self.wait_until = wait_until               # load, domcontentloaded, networkidle of commit
+        self.selector_timeout = selector_timeout   # seconden wachten op het element van de volgende stap
+    
+    def block_patterns(self) -> List[dict]:
+        """Request patterns for Fetch.enable, one per blocked resource type"""
+        return [{'resourceType': BLOCK_RESOURCE_TYPES[kind], 'requestStage': 'Request'}
+                for kind in sorted(self.block)]
+
+LOAD_PROFILES = {
+    'text': LoadProfile(block=('image', 'media', 'font')),
+    'full': LoadProfile(wait_until='networkidle'),  # alles laden en wachten tot het netwerk stil is
+}
+LOAD_PROFILE = os.environ.get('AGENT_LOAD_PROFILE', 'text')
+# Bv. "image,media,font,stylesheet"; overschrijft de block lijst van het profiel
+BLOCK_RESOURCES = os.environ.get('AGENT_BLOCK_RESOURCES')
+NAVIGATION_HISTORY = 50  # navigaties waarvan de timing bewaard blijft
+
+class StepStreamParser:
+    """
+    Incremental parser for the "steps" array of a plan that is still streaming.
+    feed() geeft de tekst van elke stap terug zodra zijn object compleet is,
+    zodat die al kan draaien terwijl het model de rest van het plan nog schrijft.
+    """
+    
+    def __init__(self):
+        self.text = ''
+        self.pos = 0            # tot hier is de tekst gescand
+        self.in_steps = False
+        self.closed = False     # de ']' van steps is gezien
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.start = None       # begin van het stap object dat nu binnenkomt
+        
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text; returns the step objects completed by it"""
+        self.text += text
+        steps = []
+        if self.closed:
+            return steps
+        if not self.in_steps:
+            match = STEPS_KEY.search(self.text)
+            if match is None:
+                return steps
+            self.in_steps = True
+            self.pos = match.end()
+        
+        for i in range(self.pos, len(self.text)):
+            char = self.text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == '\\':
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                if self.depth == 0 and char == '{':
+                    self.start = i
+                self.depth += 1
+            elif char in '}]':
+                if self.depth == 0:
+                    self.closed = True
+                    break
+                self.depth -= 1
+                if self.depth == 0 and self.start is not None:
+                    steps.append(self.text[self.start:i + 1])
+                    self.start = None
+        self.pos = len(self.text)
+        return steps
+    
+    def pending(self) -> str:
+        """The unfinished step object when the stream stopped halfway; '' otherwise"""
+        if self.closed or self.start is None:
+            return ''
+        return self.text[self.start:]
 
 class BrowserAgent:
     """
@@ -24,11 +399,53 @@ class BrowserAgent:
     Kan ALLES online doen: scrapen, forms invullen, bots draaien, etc.
     """
     
-    def __init__(self, headless: bool = False):
+    def __init__(self, headless: bool = False, ollama_url: str = OLLAMA_URL, model: str = MODEL,
+                 load_profile=LOAD_PROFILE):
         self.headless = headless
+        self.ollama_url = ollama_url
+        self.model = model
+        if not isinstance(load_profile, LoadProfile):
+            if load_profile not in LOAD_PROFILES:
+                raise ValueError(f"Unknown load profile {load_profile!r}, expected one of {', '.join(LOAD_PROFILES)}")
+            load_profile = LOAD_PROFILES[load_profile]
+            if BLOCK_RESOURCES is not None:
+                blocked = [kind.strip() for kind in BLOCK_RESOURCES.split(',') if kind.strip()]
+                load_profile = LoadProfile(blocked, load_profile.wait_until, load_profile.selector_timeout)
+        self.load_profile = load_profile
+        self.http = None  # aiohttp sessie naar Ollama; hoort bij de loop van de agent
         self.browser = None
         self.context = None
         self.page = None
+        self.cdp = None  # CDP sessie van de pagina, alleen als het profiel iets blokkeert
+        self.stats = {
+            'generations': 0,
+            'generated_tokens': 0,
+            'parsed': 0,            # plannen, stappen en beslissingen
+            'parse_failures': 0,    # waarvan ongeldige JSON of buiten het schema
+            'repaired_local': 0,
+            'repaired_model': 0,
+            'repair_failed': 0,
+            'repair_tokens': 0,
+            'wasted_tokens': 0,     # gegenereerd maar weggegooid
+            'digests': 0,           # page digests die in de pagina gemaakt zijn
+            'digest_cache_hits': 0,
+            'digest_bytes': 0,
+            'digest_ms': 0.0,
+            'last_digest_bytes': 0,
+            'last_digest_ms': 0.0,
+            'navigations': 0,
+            'navigation_ms': 0.0,     # tot de pagina bruikbaar was (load event + element)
+            'requests': 0,
+            'bytes_transferred': 0,   # ontvangen headers + body, zoals over de lijn
+            'blocked_requests': 0,
+        }
+        # Timing en bytes per navigatie; requests tellen mee bij de laatste goto
+        self.navigation = None
+        self.navigations = deque(maxlen=NAVIGATION_HISTORY)
+        # Laatste page digest; geldig zolang URL en mutatieteller gelijk zijn
+        self.digest = None
+        self.digest_url = None
+        self.digest_mutations = None
         
     async def start(self):
         """Start browser instance"""
@@ -54,44 +471,262 @@ class BrowserAgent:
         """)
         
         self.page = await self.context.new_page()
+        self.page.on('requestfinished', self.count_request)
+        
+        # Resource types die het profiel niet wil, worden gepauzeerd en meteen
+        # afgewezen; zonder route blijft de HTTP cache aan (zie LoadProfile)
+        if self.load_profile.block:
+            self.cdp = await self.context.new_cdp_session(self.page)
+            self.cdp.on('Fetch.requestPaused', self.fail_blocked)
+            await self.cdp.send('Fetch.enable', {'patterns': self.load_profile.block_patterns()})
+            self.page.on('requestfailed', self.count_blocked)
         logger.info("Browser agent started")
+    
+    async def fail_blocked(self, event) -> None:
+        """Fail a request Chromium paused because its resource type is blocked"""
+        try:
+            await self.cdp.send('Fetch.failRequest', {'requestId': event['requestId'], 'errorReason': 'BlockedByClient'})
+        except Exception:
+            pass  # pagina of sessie al gesloten
+
+    def count_blocked(self, request) -> None:
+        """Count requests failed because their resource type is blocked"""
+        # Fetch.failRequest geeft net::ERR_BLOCKED_BY_CLIENT.Inspector
+        if (request.failure or '').startswith('net::ERR_BLOCKED_BY_CLIENT'):
+            self.stats['blocked_requests'] += 1
+            if self.navigation is not None:
+                self.navigation['blocked'] += 1
+    
+    async def count_request(self, request) -> None:
+        """Add a finished request's size to the stats and the current navigation"""
+        navigation = self.navigation  # sizes() kan pas na de volgende goto terugkomen
+        try:
+            sizes = await request.sizes()
+        except Exception:
+            return  # pagina al gesloten
+        size = max(0, sizes['responseHeadersSize']) + max(0, sizes['responseBodySize'])
+        self.stats['requests'] += 1
+        self.stats['bytes_transferred'] += size
+        if navigation is not None:
+            navigation['requests'] += 1
+            navigation['bytes'] += size
         
-    async def ask_ai(self, prompt: str, context: str = None) -> str:
-        """Ask AI what to do next"""
+    async def ai_session(self) -> aiohttp.ClientSession:
+        """Pooled HTTP session to Ollama, created on first use"""
+        if self.http is None or self.http.closed:
+            self.http = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(sock_connect=AI_CONNECT_TIMEOUT, sock_read=AI_READ_TIMEOUT),
+                connector=aiohttp.TCPConnector(limit=AI_MAX_CONNECTIONS)
+            )
+        return self.http
+    
+    async def stream_ai(self, prompt: str, context: str = None, schema: Dict[str, Any] = None,
+                        usage: Dict[str, int] = None, options: Dict[str, Any] = None) -> AsyncIterator[str]:
+        """
+        Ask AI and yield its answer piece by piece while it is generated.
+        De event loop blijft vrij; andere taken lopen door. Met schema beperkt
+        Ollama de output tot die JSON vorm; usage krijgt eval_count.
+        """
         full_prompt = prompt
         if context:
             full_prompt = f"Context:\n{context}\n\nTask: {prompt}"
         
-        try:
-            response = requests.post(
-                f'{OLLAMA_URL}/api/generate',
-                json={
-                    'model': MODEL,
-                    'prompt': full_prompt,
-                    'stream': False,
-                    'options': {'temperature': 0.7}
-                },
-                timeout=120
-            )
+        payload = {
+            'model': self.model,
+            'prompt': full_prompt,
+            'stream': True,
+            'options': {'temperature': 0.7, **(options or {})}
+        }
+        if schema is not None:
+            payload['format'] = schema
+        
+        session = await self.ai_session()
+        async with session.post(f'{self.ollama_url}/api/generate', json=payload) as response:
             response.raise_for_status()
-            return response.json().get('response', '')
+            # NDJSON; de laatste regel (met 'context') kan groot zijn, dus zelf splitsen
+            buffer = b''
+            async for data in response.content.iter_any():
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise RuntimeError(chunk['error'])
+                    if chunk.get('response'):
+                        yield chunk['response']
+                    if chunk.get('done'):
+                        tokens = chunk.get('eval_count', 0)
+                        self.stats['generations'] += 1
+                        self.stats['generated_tokens'] += tokens
+                        if usage is not None:
+                            usage['eval_count'] = tokens
+    
+    async def ask_ai(self, prompt: str, context: str = None, schema: Dict[str, Any] = None,
+                     usage: Dict[str, int] = None, options: Dict[str, Any] = None) -> str:
+        """Ask AI what to do next"""
+        try:
+            return ''.join([text async for text in self.stream_ai(prompt, context, schema, usage, options)])
         except Exception as e:
             logger.error(f"AI request failed: {e}")
             return ""
     
+    async def repair(self, raw: str, error: str, validate: Callable[[Any], Step],
+                     schema: Dict[str, Any], kind: str):
+        """
+        Targeted repair of one broken step or decision; None when it cannot be saved.
+        Eerst lokaal (gratis), dan het model met alleen dit stuk, het schema en
+        een klein token budget: veel goedkoper dan het hele plan opnieuw.
+        """
+        try:
+            step = validate(loose_json(raw))
+            self.stats['repaired_local'] += 1
+            return step
+        except (json.JSONDecodeError, InvalidStep):
+            pass
+        
+        prompt = f"""This {kind} is invalid: {error}
+
+{raw}
+
+Return only the corrected {kind} as JSON."""
+        usage = {}
+        try:
+            step = validate(json.loads(await self.ask_ai(
+                prompt, schema=schema, usage=usage, options={'temperature': 0, 'num_predict': REPAIR_MAX_TOKENS})))
+        except (json.JSONDecodeError, InvalidStep) as e:
+            logger.warning(f"Could not repair {kind} from AI ({e}): {raw[:200]}")
+            self.stats['repair_failed'] += 1
+            self.stats['wasted_tokens'] += usage.get('eval_count', 0)
+            return None
+        finally:
+            self.stats['repair_tokens'] += usage.get('eval_count', 0)
+        
+        self.stats['repaired_model'] += 1
+        return step
+    
+    async def parse_step(self, raw: str):
+        """Typed Step from the text of one plan step; repaired if needed, None if hopeless"""
+        self.stats['parsed'] += 1
+        try:
+            return Step.parse(json.loads(raw))
+        except (json.JSONDecodeError, InvalidStep) as e:
+            error = str(e)
+        
+        self.stats['parse_failures'] += 1
+        step = await self.repair(raw, error, Step.parse, STEP_SCHEMA, 'step')
+        if step is None:
+            self.stats['wasted_tokens'] += estimate_tokens(raw)
+        return step
+    
+    async def parse_decision(self, raw: str, usage: Dict[str, int]):
+        """Typed Step from an autonomous decision; None if it cannot be saved"""
+        self.stats['parsed'] += 1
+        try:
+            return Step.parse_decision(json.loads(raw))
+        except (json.JSONDecodeError, InvalidStep) as e:
+            error = str(e)
+        
+        self.stats['parse_failures'] += 1
+        step = await self.repair(raw, error, Step.parse_decision, DECISION_SCHEMA, 'decision')
+        if step is None:
+            self.stats['wasted_tokens'] += usage.get('eval_count', 0)
+        return step
+    
+    def stats_snapshot(self) -> Dict[str, Any]:
+        """Counters plus the parse failure rate"""
+        parsed = self.stats['parsed']
+        digests = self.stats['digests']
+        navigations = self.stats['navigations']
+        return {
+            **self.stats,
+            'parse_failure_rate': round(self.stats['parse_failures'] / parsed, 3) if parsed else 0.0,
+            'avg_digest_bytes': round(self.stats['digest_bytes'] / digests) if digests else 0,
+            'avg_digest_ms': round(self.stats['digest_ms'] / digests, 2) if digests else 0.0,
+            'avg_navigation_ms': round(self.stats['navigation_ms'] / navigations, 1) if navigations else 0.0,
+            'recent_navigations': list(self.navigations)[-5:]
+        }
+    
     async def get_page_context(self) -> str:
-        """Get current page info for AI"""
+        """
+        Get current page info for AI: a compact digest made inside the page.
+        Gecached; alleen opnieuw als de URL verandert of de DOM gemuteerd is.
+        """
         url = self.page.url
-        title = await self.page.title()
-        content = await self.page.content()
+        try:
+            if self.digest is not None and url == self.digest_url:
+                if await self.page.evaluate(MUTATION_COUNT_SCRIPT) == self.digest_mutations:
+                    self.stats['digest_cache_hits'] += 1
+                    return self.digest
+            
+            start = time.perf_counter()
+            digest = await self.page.evaluate(DIGEST_SCRIPT, {
+                'maxElements': DIGEST_MAX_ELEMENTS,
+                'maxHeadings': DIGEST_MAX_HEADINGS,
+                'maxText': DIGEST_MAX_CHARS
+            })
+        except Exception as e:
+            # Bv. midden in een navigatie; volgende keer opnieuw
+            logger.warning(f"Page digest failed: {e}")
+            self.digest = None
+            return f"URL: {url}"
         
-        # Simplified context for AI
-        return f"URL: {url}\nTitle: {title}\nContent length: {len(content)} chars"
+        text = format_digest(digest)
+        elapsed = (time.perf_counter() - start) * 1000
+        size = len(text.encode('utf-8'))
+        self.digest, self.digest_url, self.digest_mutations = text, url, digest['mutations']
+        self.stats['digests'] += 1
+        self.stats['digest_bytes'] += size
+        self.stats['digest_ms'] += elapsed
+        self.stats['last_digest_bytes'] = size
+        self.stats['last_digest_ms'] = round(elapsed, 2)
+        logger.info(f"Page digest: {size} bytes, {len(digest['elements'])} elements in {elapsed:.1f} ms")
+        return text
     
-    async def goto(self, url: str) -> None:
-        """Navigate to URL"""
+    async def goto(self, url: str, wait_for: str = None) -> None:
+        """
+        Navigate to URL using the load profile.
+        Met wait_for wacht de agent daarna op dat element; in execute_task doet
+        run_step dat voor het element van de eerstvolgende stap.
+        """
         logger.info(f"Navigating to {url}")
-        await self.page.goto(url, wait_until='networkidle')
+        profile = self.load_profile
+        self.navigation = {
+            'url': url,
+            'wait_until': profile.wait_until,
+            'loaded_ms': None,
+            'selector': None,
+            'selector_ms': None,
+            'requests': 0,
+            'bytes': 0,
+            'blocked': 0,
+        }
+        self.navigations.append(self.navigation)
+        
+        start = time.perf_counter()
+        await self.page.goto(url, wait_until=profile.wait_until)
+        self.navigation['loaded_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        self.stats['navigations'] += 1
+        self.stats['navigation_ms'] += self.navigation['loaded_ms']
+        
+        if wait_for:
+            await self.wait_ready(wait_for)
+    
+    async def wait_ready(self, selector: str) -> None:
+        """
+        Wait until the element a step needs is on the page, once per navigation.
+        Een time-out is geen fout: de stap zelf meldt het als het element ontbreekt.
+        """
+        navigation = self.navigation
+        navigation['selector'] = selector
+        start = time.perf_counter()
+        try:
+            await self.page.wait_for_selector(selector, timeout=self.load_profile.selector_timeout * 1000)
+        except PlaywrightTimeoutError:
+            logger.warning(f"{selector} did not appear after navigating to {navigation['url']}")
+        navigation['selector_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        self.stats['navigation_ms'] += navigation['selector_ms']
     
     async def click(self, selector: str) -> None:
         """Click element"""
@@ -112,7 +747,8 @@ class BrowserAgent:
         await self.page.screenshot(path=path)
         logger.info(f"Screenshot saved to {path}")
     
-    async def execute_task(self, task: str) -> Dict[str, Any]:
+    async def execute_task(self, task: str,
+                           on_step: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
         """
         Let AI execute arbitrary task autonomously.
         Examples:
@@ -120,9 +756,16 @@ class BrowserAgent:
         - "Find cheapest flights to Barcelona"
         - "Monitor crypto prices and alert me"
         - "Fill out contact form on website X"
+        on_step krijgt een dict per voortgangsstap (plannen, elke actie), bv.
+        voor de progress stream van het dashboard.
         """
         logger.info(f"Executing task: {task}")
+
+        def report(**event):
+            if on_step is not None:
+                on_step(event)
         
+        report(stage='planning')
         # Get AI's plan
         context = await self.get_page_context()
         plan_prompt = f"""
@@ -144,34 +787,58 @@ Respond with a JSON plan:
 }}
 """
         
-        plan_response = await self.ask_ai(plan_prompt)
+        steps = []
+        results = []
+        
+        async def execute(raw):
+            step = await self.parse_step(raw)
+            if step is None:
+                return
+            index = len(steps)
+            steps.append(step)
+            report(stage='step', index=index, action=step.action, status='running')
+            text = await self.run_step(step)
+            if text is not None:
+                results.append(text)
+            report(stage='step', index=index, action=step.action, status='done')
         
         try:
-            # Parse AI's plan
-            plan = json.loads(plan_response)
-            results = []
+            # Elke stap draait zodra hij binnen is; het model schrijft intussen verder
+            parser = StepStreamParser()
+            usage = {}
+            stream = self.stream_ai(plan_prompt, schema=PLAN_SCHEMA, usage=usage)
+            try:
+                async for text in stream:
+                    for raw in parser.feed(text):
+                        await execute(raw)
+            finally:
+                await stream.aclose()
             
-            # Execute each step
-            for step in plan.get('steps', []):
-                action = step.get('action')
-                
-                if action == 'goto':
-                    await self.goto(step['url'])
-                elif action == 'click':
-                    await self.click(step['selector'])
-                elif action == 'fill':
-                    await self.fill(step['selector'], step['value'])
-                elif action == 'scrape':
-                    text = await self.scrape_text(step.get('selector', 'body'))
-                    results.append(text)
-                elif action == 'wait':
-                    await asyncio.sleep(step.get('seconds', 1))
-                elif action == 'screenshot':
-                    await self.screenshot(step.get('path', 'screenshot.png'))
+            # Afgebroken midden in een stap: die ene stap repareren
+            if parser.pending():
+                await execute(parser.pending())
+            
+            self.stats['parsed'] += 1
+            if not parser.in_steps:
+                # Geen "steps" array; misschien een kale lijst of een codeblok
+                self.stats['parse_failures'] += 1
+                try:
+                    plan = loose_json(parser.text)
+                except json.JSONDecodeError:
+                    self.stats['wasted_tokens'] += usage.get('eval_count', 0)
+                    raise
+                items = plan if isinstance(plan, list) else plan.get('steps') if isinstance(plan, dict) else None
+                if not isinstance(items, list):
+                    self.stats['wasted_tokens'] += usage.get('eval_count', 0)
+                    raise json.JSONDecodeError('No steps in plan', parser.text, 0)
+                self.stats['repaired_local'] += 1
+                for item in items:
+                    await execute(json.dumps(item))
+            report(stage='plan', steps=len(steps))
             
             return {
                 'success': True,
-                'plan': plan,
+                'plan': {'steps': [step.to_dict() for step in steps]},
                 'results': results
             }
             
@@ -182,6 +849,28 @@ Respond with a JSON plan:
             logger.error(f"Task execution failed: {e}")
             return {'success': False, 'error': str(e)}
     
+    async def run_step(self, step: Step):
+        """Execute one validated step; returns the text for 'scrape'"""
+        action = step.action
+        
+        # Eerste stap met een element na een navigatie: daarop wachten
+        if step.selector and self.navigation is not None and self.navigation['selector'] is None:
+            await self.wait_ready(step.selector)
+        
+        if action == 'goto':
+            await self.goto(step.url)
+        elif action == 'click':
+            await self.click(step.selector)
+        elif action == 'fill':
+            await self.fill(step.selector, step.value)
+        elif action == 'scrape':
+            return await self.scrape_text(step.selector or 'body')
+        elif action == 'wait':
+            await asyncio.sleep(step.seconds if step.seconds is not None else 1)
+        elif action == 'screenshot':
+            await self.screenshot(step.path or 'screenshot.png')
+        return None
+    
     async def autonomous_loop(self, goal: str, max_iterations: int = 10):
         """
         Fully autonomous mode: AI decides what to do until goal is reached.
@@ -208,26 +897,24 @@ Respond with ONE action in JSON format:
 }}
 """
             
-            decision = await self.ask_ai(decision_prompt)
+            usage = {}
+            decision = await self.ask_ai(decision_prompt, schema=DECISION_SCHEMA, usage=usage)
+            if not decision.strip():
+                continue  # AI request mislukt; al gelogd
             
             try:
-                action_data = json.loads(decision)
-                action = action_data.get('action')
-                params = action_data.get('params', {})
+                # Ongeldige beslissing: repareren in plaats van de iteratie te verliezen
+                step = await self.parse_decision(decision, usage)
+                if step is None:
+                    continue
                 
-                logger.info(f"AI decision: {action_data.get('reasoning')}")
+                logger.info(f"AI decision: {step.reasoning}")
                 
-                if action == 'done':
+                if step.action == 'done':
                     logger.info("Goal reached!")
                     break
-                elif action == 'goto':
-                    await self.goto(params.get('url'))
-                elif action == 'click':
-                    await self.click(params.get('selector'))
-                elif action == 'fill':
-                    await self.fill(params.get('selector'), params.get('value'))
-                elif action == 'scrape':
-                    result = await self.scrape_text(params.get('selector', 'body'))
+                result = await self.run_step(step)
+                if step.action == 'scrape':
                     logger.info(f"Scraped: {result[:200]}...")
                 
                 await asyncio.sleep(1)  # Be nice
@@ -238,6 +925,8 @@ Respond with ONE action in JSON format:
     
     async def close(self):
         """Cleanup"""
+        if self.http is not None:
+            await self.http.close()
         if self.browser:
             await self.browser.close()
             logger.info("Browser closed")
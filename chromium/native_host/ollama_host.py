@@ -2,63 +2,464 @@
 """
 No-Guardrail AI - Native Messaging Host
 Bridge tussen Chromium browser en lokale Ollama instance
+
+Berichten worden gelijktijdig afgehandeld: elk bericht mag een 'id' meegeven,
+het antwoord bevat dezelfde 'id'. Een ping of models request wacht dus niet
+meer op een lopende generatie. {'type': 'cancel', 'target': <id>} breekt een
+lopende request af.
+
+Met 'stream': true komen tokens binnen als 'chunk' berichten (gebundeld per
+tijd/grootte venster), gevolgd door één 'done' bericht met timing stats.
+Berichten boven Chrome's limiet van 1 MB gaan in 'part' stukken.
+
+Met 'session' houdt de host de chatgeschiedenis zelf bij: de extensie stuurt
+per beurt alleen het nieuwe bericht ('message' in plaats van 'messages').
+
+Daemon mode (ollama_host.py --daemon) draait lang en houdt de verbindingen
+naar Ollama en de modellijst warm; ollama_launcher.py is dan wat Chrome start
+en stuurt de berichten over een Unix socket door.
 """
 
+import os
 import sys
+import time
 import json
+import stat
+import fcntl
+import socket
 import struct
-import requests
 import logging
+import threading
+import contextlib
+import requests
 from typing import Dict, Any
 
 # Configuration
-OLLAMA_URL = 'http://localhost:11434'
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://localhost:11434')
 DEFAULT_MODEL = 'dolphin-uncensored'
 LOG_FILE = '/tmp/ollama_host.log'
+MAX_WORKERS = int(os.environ.get('OLLAMA_HOST_WORKERS', 4))  # gelijktijdige Ollama calls
+CONNECT_TIMEOUT = 3
+READ_TIMEOUT = 120  # seconden zonder nieuwe chunk van Ollama
+
+# Streaming: tokens bundelen tot dit venster of deze grootte bereikt is
+STREAM_BATCH_SECONDS = float(os.environ.get('OLLAMA_HOST_BATCH_MS', 40)) / 1000
+STREAM_BATCH_CHARS = int(os.environ.get('OLLAMA_HOST_BATCH_CHARS', 4096))
+
+# Chrome weigert berichten van de host boven 1 MB
+MAX_MESSAGE_BYTES = 1024 * 1024
+
+# Daemon mode; ollama_launcher.py gebruikt hetzelfde pad. Zonder override
+# staan socket en lock in een privé map (zie runtime_dir)
+SOCKET_PATH = os.environ.get('OLLAMA_HOST_SOCKET')
+SOCKET_NAME = 'ollama_host.sock'
+MODELS_CACHE_SECONDS = float(os.environ.get('OLLAMA_HOST_MODELS_TTL', 30))
+
+# Chat sessies aan de host kant
+SESSION_TOKEN_BUDGET = int(os.environ.get('OLLAMA_HOST_SESSION_TOKENS', 4096))  # prompt tokens per beurt
+SESSION_TRIM_TO = 0.5       # boven budget terug naar deze fractie, zodat de prefix een tijd gelijk blijft
+SESSION_TTL = float(os.environ.get('OLLAMA_HOST_SESSION_TTL', 3600))  # seconden zonder beurt
+MAX_SESSIONS = int(os.environ.get('OLLAMA_HOST_MAX_SESSIONS', 64))
+CHARS_PER_TOKEN = 4         # ruwe schatting, goed genoeg voor het budget
+
+# Berichten die direct op de lees-thread worden afgehandeld
+INLINE_TYPES = ('ping', 'cancel', 'session')
+# Korte Ollama calls: eigen thread buiten de workers, dus nooit achter generaties
+UNPOOLED_TYPES = ('models',)
 
 # Setup logging
 logging.basicConfig(
     filename=LOG_FILE,
     level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s'
 )
 
-def send_message(message: Dict[str, Any]) -> None:
+# Keep-alive verbindingen naar Ollama, gedeeld door alle workers
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS))
+
+# Gedeeld door alle verbindingen: hoogstens MAX_WORKERS Ollama calls tegelijk
+workers = threading.BoundedSemaphore(MAX_WORKERS)
+
+# Laatste /api/tags antwoord; in daemon mode scheelt dat een Ollama call per venster
+models_cache = {'models': None, 'fetched': 0.0}
+models_lock = threading.Lock()
+
+
+class Cancelled(Exception):
+    """Raised in a worker when its request was cancelled"""
+
+
+class Job:
     """
-    Send a message to the browser via stdout.
-    Native messaging protocol requires 4-byte length prefix.
+    One request that is being handled by a worker.
+    cancel() sluit de socket van de Ollama response; Ollama stopt dan met
+    genereren en de blokkerende read van de worker komt meteen terug. Een
+    cancel voor de eerste chunk werkt zodra de response headers binnen zijn.
     """
-    encoded_message = json.dumps(message).encode('utf-8')
-    message_length = len(encoded_message)
-    
-    # Write length (4 bytes, native byte order)
-    sys.stdout.buffer.write(struct.pack('I', message_length))
-    # Write message
-    sys.stdout.buffer.write(encoded_message)
-    sys.stdout.buffer.flush()
-    
-    logging.debug(f"Sent message: {message}")
 
-def read_message() -> Dict[str, Any]:
+    def __init__(self, request_id, channel):
+        self.id = request_id
+        self.channel = channel
+        self.cancelled = threading.Event()
+        self.response = None
+        self.lock = threading.Lock()
+
+    def attach(self, response: requests.Response) -> None:
+        with self.lock:
+            self.response = response
+        if self.cancelled.is_set():
+            response.close()
+            raise Cancelled()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        with self.lock:
+            if self.response is None:
+                return
+            # close() alleen maakt een read in een andere thread niet wakker
+            sock = getattr(getattr(self.response.raw, '_connection', None), 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.response.close()
+
+
+def split_text(text: str, budget: int) -> list:
+    """Cut text into pieces whose JSON encoding fits in budget bytes"""
+    pieces = []
+    start = 0
+    while start < len(text):
+        size = budget
+        while True:
+            piece = text[start:start + size]
+            encoded = len(json.dumps(piece))
+            if encoded <= budget:
+                break
+            # Escapes maken het stuk groter dan het aantal tekens
+            size = max(1, min(size - 1, size * budget // encoded))
+        pieces.append(piece)
+        start += len(piece)
+    return pieces
+
+def part_budget(message_id, size: int) -> int:
     """
-    Read a message from the browser via stdin.
+    Bytes left for the JSON encoded 'data' of one part of a size byte message:
+    de limiet min de velden eromheen, met de echte id. index en count krijgen
+    het grootst mogelijke aantal cijfers (elk stuk is minstens één byte).
     """
-    # Read message length (4 bytes)
-    text_length_bytes = sys.stdin.buffer.read(4)
-    if len(text_length_bytes) == 0:
-        sys.exit(0)
-    
-    text_length = struct.unpack('I', text_length_bytes)[0]
-    
-    # Read message
-    text = sys.stdin.buffer.read(text_length).decode('utf-8')
-    message = json.loads(text)
+    envelope = json.dumps({'id': message_id, 'type': 'part', 'index': size, 'count': size, 'data': ''})
+    budget = MAX_MESSAGE_BYTES - (len(envelope.encode('utf-8')) - len('""'))
+    if budget <= 0:
+        raise ValueError('Message id too long to split into parts')
+    return budget
+
+class Channel:
+    """
+    One connection to the browser: stdin/stdout, of een launcher in daemon mode.
+    Elke verbinding heeft zijn eigen request ids en schrijft één bericht
+    tegelijk; workers schrijven door elkaar.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.write_lock = threading.Lock()
+        self.jobs = {}  # request id -> Job
+        self.jobs_lock = threading.Lock()
+
+    def send(self, message: Dict[str, Any]) -> None:
+        """
+        Send a message to the browser.
+        Native messaging protocol requires 4-byte length prefix.
+        Een te groot bericht gaat als opeenvolgende 'part' berichten met elk een
+        stuk van de JSON tekst; de browser plakt 'data' aan elkaar en parset dat.
+        """
+        encoded_message = json.dumps(message).encode('utf-8')
+        if len(encoded_message) <= MAX_MESSAGE_BYTES:
+            frames = [encoded_message]
+        else:
+            pieces = split_text(encoded_message.decode('utf-8'), part_budget(message.get('id'), len(encoded_message)))
+            frames = [json.dumps({'id': message.get('id'), 'type': 'part', 'index': index,
+                                  'count': len(pieces), 'data': piece}).encode('utf-8')
+                      for index, piece in enumerate(pieces)]
+            logging.info(f"Split a {len(encoded_message)} byte message into {len(frames)} parts")
+        
+        with self.write_lock:
+            for frame in frames:
+                # Write length (4 bytes, native byte order)
+                self.writer.write(struct.pack('I', len(frame)))
+                # Write message
+                self.writer.write(frame)
+            self.writer.flush()
+        
+        logging.debug(f"Sent message: {encoded_message[:1000]}")
+
+    def read(self):
+        """
+        Read a message from the browser; None when the connection is closed.
+        """
+        # Read message length (4 bytes)
+        text_length_bytes = self.reader.read(4)
+        if len(text_length_bytes) < 4:
+            return None
+        
+        text_length = struct.unpack('I', text_length_bytes)[0]
+        
+        # Read message
+        text = self.reader.read(text_length).decode('utf-8')
+        message = json.loads(text)
+        
+        logging.debug(f"Received message: {message}")
+        return message
+
+    def reply(self, request_id, response: Dict[str, Any]) -> None:
+        """Send a response, tagged with the request id when the browser gave one"""
+        if request_id is not None:
+            response = {'id': request_id, **response}
+        self.send(response)
+
+    def cancel(self, request_id) -> bool:
+        """Cancel a running request; False if it is unknown or already done"""
+        with self.jobs_lock:
+            job = self.jobs.get(request_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def cancel_all(self) -> None:
+        with self.jobs_lock:
+            running = list(self.jobs.values())
+        for job in running:
+            job.cancel()
+
+    def dispatch(self, message: Dict[str, Any]) -> None:
+        """
+        Handle one message without blocking the read loop.
+        ping en cancel zijn goedkoop en gaan direct, net als models uit de
+        cache; de rest krijgt een worker thread (hoogstens MAX_WORKERS
+        tegelijk met Ollama bezig, behalve UNPOOLED_TYPES).
+        """
+        request_id = message.get('id')
+        job = Job(request_id, self)
+        msg_type = message.get('type', 'generate')
+        if msg_type in INLINE_TYPES or (msg_type == 'models' and not message.get('refresh')
+                                        and cached_models() is not None):
+            self.reply(request_id, handle_message(message, job))
+            return
+        
+        if request_id is not None:
+            with self.jobs_lock:
+                if request_id in self.jobs:
+                    self.reply(request_id, {'success': False, 'error': f'Request id {request_id} is already running'})
+                    return
+                self.jobs[request_id] = job
+        threading.Thread(target=self.run_job, args=(job, message, msg_type not in UNPOOLED_TYPES),
+                         name=f'job-{request_id}', daemon=True).start()
+
+    def run_job(self, job: Job, message: Dict[str, Any], pooled: bool = True) -> None:
+        try:
+            with workers if pooled else contextlib.nullcontext():
+                if job.cancelled.is_set():
+                    response = cancelled_result()
+                else:
+                    response = handle_message(message, job)
+        except Exception as e:
+            logging.error(f"Worker error: {str(e)}")
+            response = {'success': False, 'error': str(e)}
+        finally:
+            with self.jobs_lock:
+                if self.jobs.get(job.id) is job:
+                    del self.jobs[job.id]
+        if message.get('stream'):
+            # Laatste bericht van een stream, ook bij fouten of cancel
+            response = {'type': 'done', **response}
+        try:
+            self.reply(job.id, response)
+        except OSError:
+            pass  # browser (of launcher) is al weg
+
+    def serve(self) -> None:
+        """
+        Read loop: read messages from browser and hand them to workers.
+        """
+        try:
+            while True:
+                # Read message from browser
+                message = self.read()
+                if message is None:
+                    break
+                
+                # Process message; the worker sends the response
+                self.dispatch(message)
+        
+        except Exception as e:
+            logging.error(f"Fatal error: {str(e)}")
+            self.send({
+                'success': False,
+                'error': f'Host error: {str(e)}'
+            })
+        finally:
+            # Browser weg: lopende generaties hoeven niet af
+            self.cancel_all()
+
+def stream_ollama(path: str, payload: Dict[str, Any], job: Job = None):
+    """
+    POST to Ollama with streaming on and yield every JSON chunk.
+    Ook zonder stream naar de browser streamen we van Ollama: zo kan een
+    cancel de verbinding tussen twee chunks sluiten.
+    """
+    response = session.post(f'{OLLAMA_URL}{path}', json={**payload, 'stream': True},
+                            stream=True, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    try:
+        if job is not None:
+            job.attach(response)
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if job is not None and job.cancelled.is_set():
+                raise Cancelled()
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if 'error' in chunk:
+                raise RuntimeError(chunk['error'])
+            yield chunk
+        if job is not None and job.cancelled.is_set():
+            raise Cancelled()
+    except (requests.exceptions.RequestException, AttributeError, OSError, ValueError):
+        # Een gesloten response geeft hier allerlei fouten
+        if job is not None and job.cancelled.is_set():
+            raise Cancelled()
+        raise
+    finally:
+        response.close()
+
+class ChunkBatcher:
+    """
+    Bundles streamed text into 'chunk' messages for one request.
+    Het eerste token gaat meteen; daarna wordt verstuurd zodra het venster
+    sinds de vorige flush om is of er STREAM_BATCH_CHARS tekens klaarstaan.
+    Een timer verstuurt wat klaarstaat als het venster om is zonder dat er
+    een volgend token kwam, zodat tekst nooit langer dan het venster wacht.
+    close() moet na de laatste add() aangeroepen worden.
+    """
+
+    def __init__(self, job: Job, window: float = STREAM_BATCH_SECONDS, max_chars: int = STREAM_BATCH_CHARS):
+        self.job = job
+        self.window = window
+        self.max_chars = max_chars
+        self.pending = []
+        self.size = 0
+        self.last_flush = float('-inf')
+        self.frames = 0
+        self.chars = 0
+        self.lock = threading.Lock()
+        self.timer = None
+        self.closed = False
+
+    def add(self, text: str) -> None:
+        with self.lock:
+            self.pending.append(text)
+            self.size += len(text)
+            wait = self.last_flush + self.window - time.perf_counter()
+            if self.size >= self.max_chars or wait <= 0:
+                self._flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(wait, self._deadline)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._flush()
+
+    def close(self) -> None:
+        """Stop the deadline timer; text that is still pending is not sent"""
+        with self.lock:
+            self.closed = True
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+    def _deadline(self) -> None:
+        try:
+            self.flush()
+        except (OSError, ValueError):
+            pass  # browser is weg; de worker merkt dat zelf
+
+    def _flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.closed or not self.pending:
+            return
+        text = ''.join(self.pending)
+        self.job.channel.reply(self.job.id, {'type': 'chunk', 'seq': self.frames, 'text': text})
+        self.frames += 1
+        self.chars += len(text)
+        self.pending = []
+        self.size = 0
+        self.last_flush = time.perf_counter()
+
+def relay_stream(path: str, payload: Dict[str, Any], job: Job, text_of, on_chunk=None) -> Dict[str, Any]:
+    """
+    Relay Ollama's streamed chunks to the browser as batched 'chunk' messages.
+    Returns the summary for the final 'done' message. on_chunk ziet elke
+    Ollama chunk ook, bv. om het antwoord in een sessie te bewaren.
+    """
+    batcher = ChunkBatcher(job)
+    start = time.perf_counter()
+    first = None
+    received = 0
+    last = {}
+    try:
+        for chunk in stream_ollama(path, payload, job):
+            received += 1
+            if on_chunk is not None:
+                on_chunk(chunk)
+            text = text_of(chunk)
+            if text:
+                if first is None:
+                    first = time.perf_counter()
+                batcher.add(text)
+            last = chunk
+        batcher.flush()
+    finally:
+        # Geen chunk meer na het 'done' bericht
+        batcher.close()
+    total = time.perf_counter() - start
     
-    logging.debug(f"Received message: {message}")
-    return message
+    eval_seconds = last.get('eval_duration', 0) / 1e9
+    return {
+        'success': True,
+        'model': payload['model'],
+        'done_reason': last.get('done_reason'),
+        'stats': {
+            'first_token_ms': None if first is None else round((first - start) * 1000, 1),
+            'total_ms': round(total * 1000, 1),
+            'ollama_chunks': received,
+            'frames': batcher.frames,
+            'chars': batcher.chars,
+            'prompt_eval_count': last.get('prompt_eval_count'),
+            'eval_count': last.get('eval_count'),
+            'tokens_per_second': round(last['eval_count'] / eval_seconds, 2)
+            if last.get('eval_count') and eval_seconds else None,
+        }
+    }
 
-def call_ollama(prompt: str, model: str = DEFAULT_MODEL, 
-                system: str = None, context: str = None) -> Dict[str, Any]:
+def cancelled_result() -> Dict[str, Any]:
+    return {
+        'success': False,
+        'cancelled': True,
+        'error': 'Request cancelled'
+    }
+
+def call_ollama(prompt: str, model: str = DEFAULT_MODEL,
+                system: str = None, context: str = None, job: Job = None,
+                stream: bool = False) -> Dict[str, Any]:
     """
     Call Ollama API with the given prompt.
     """
@@ -71,7 +472,6 @@ def call_ollama(prompt: str, model: str = DEFAULT_MODEL,
         payload = {
             'model': model,
             'prompt': full_prompt,
-            'stream': False,
             'options': {
                 'temperature': 0.7,
                 'top_p': 0.9,
@@ -82,22 +482,25 @@ def call_ollama(prompt: str, model: str = DEFAULT_MODEL,
             payload['system'] = system
         
         logging.info(f"Calling Ollama with model: {model}")
-        response = requests.post(
-            f'{OLLAMA_URL}/api/generate',
-            json=payload,
-            timeout=120  # 2 minutes timeout
-        )
+        if stream:
+            return relay_stream('/api/generate', payload, job, lambda chunk: chunk.get('response', ''))
         
-        response.raise_for_status()
-        result = response.json()
+        parts = []
+        done = True
+        for chunk in stream_ollama('/api/generate', payload, job):
+            parts.append(chunk.get('response', ''))
+            done = chunk.get('done', done)
         
         return {
             'success': True,
-            'response': result.get('response', ''),
+            'response': ''.join(parts),
             'model': model,
-            'done': result.get('done', True)
+            'done': done
         }
-        
+    
+    except Cancelled:
+        logging.info(f"Generate request {job.id} cancelled")
+        return cancelled_result()
     except requests.exceptions.ConnectionError:
         logging.error("Failed to connect to Ollama")
         return {
@@ -117,7 +520,8 @@ def call_ollama(prompt: str, model: str = DEFAULT_MODEL,
             'error': str(e)
         }
 
-def call_ollama_chat(messages: list, model: str = DEFAULT_MODEL) -> Dict[str, Any]:
+def call_ollama_chat(messages: list, model: str = DEFAULT_MODEL, job: Job = None,
+                     stream: bool = False) -> Dict[str, Any]:
     """
     Call Ollama chat API with message history.
     """
@@ -125,29 +529,36 @@ def call_ollama_chat(messages: list, model: str = DEFAULT_MODEL) -> Dict[str, An
         payload = {
             'model': model,
             'messages': messages,
-            'stream': False,
             'options': {
                 'temperature': 0.7,
             }
         }
         
         logging.info(f"Calling Ollama chat with {len(messages)} messages")
-        response = requests.post(
-            f'{OLLAMA_URL}/api/chat',
-            json=payload,
-            timeout=120
-        )
+        if stream:
+            return relay_stream('/api/chat', payload, job,
+                                lambda chunk: (chunk.get('message') or {}).get('content', ''))
         
-        response.raise_for_status()
-        result = response.json()
+        message = {'role': 'assistant', 'content': ''}
+        parts = []
+        done = True
+        for chunk in stream_ollama('/api/chat', payload, job):
+            delta = chunk.get('message') or {}
+            message['role'] = delta.get('role', message['role'])
+            parts.append(delta.get('content', ''))
+            done = chunk.get('done', done)
+        message['content'] = ''.join(parts)
         
         return {
             'success': True,
-            'message': result.get('message', {}),
+            'message': message,
             'model': model,
-            'done': result.get('done', True)
+            'done': done
         }
-        
+    
+    except Cancelled:
+        logging.info(f"Chat request {job.id} cancelled")
+        return cancelled_result()
     except Exception as e:
         logging.error(f"Ollama chat error: {str(e)}")
         return {
@@ -155,7 +566,194 @@ def call_ollama_chat(messages: list, model: str = DEFAULT_MODEL) -> Dict[str, An
             'error': str(e)
         }
 
-def handle_message(message: Dict[str, Any]) -> Dict[str, Any]:
+def estimate_tokens(message: Dict[str, Any]) -> int:
+    return len(str(message.get('content', ''))) // CHARS_PER_TOKEN + 1
+
+class Session:
+    """
+    Chat history of one conversation, kept on the host.
+    Zolang het past gaat elke beurt naar /api/generate met Ollama's 'context'
+    van de vorige beurt: alleen het nieuwe bericht hoeft dan geëvalueerd te
+    worden. Past de context niet meer in het budget, dan gaat de beurt naar
+    /api/chat met een venster van de nieuwste berichten.
+    """
+
+    def __init__(self, session_id, model: str, system: str = None):
+        self.id = session_id
+        self.model = model
+        self.system = system
+        self.history = []         # berichten binnen het budget, oudste eerst
+        self.tokens = 0           # geschatte tokens van history
+        self.context = None       # Ollama context van de laatste /api/generate beurt
+        self.turns = 0
+        self.context_turns = 0
+        self.trimmed = 0
+        self.used = time.monotonic()
+        self.lock = threading.Lock()  # één beurt tegelijk per sessie
+
+    def add(self, message: Dict[str, Any]) -> None:
+        self.history.append(message)
+        self.tokens += estimate_tokens(message)
+
+    def discard(self, message: Dict[str, Any]) -> None:
+        """Take back a message whose turn failed"""
+        if self.history and self.history[-1] is message:
+            self.history.pop()
+            self.tokens -= estimate_tokens(message)
+
+    def trim(self) -> None:
+        """
+        Drop the oldest messages once the window is over budget.
+        Meteen terug naar SESSION_TRIM_TO van het budget: dan blijft het begin
+        van de prompt een paar beurten gelijk en kan Ollama zijn cache gebruiken.
+        """
+        if self.tokens <= SESSION_TOKEN_BUDGET:
+            return
+        while len(self.history) > 1 and self.tokens > SESSION_TOKEN_BUDGET * SESSION_TRIM_TO:
+            self.tokens -= estimate_tokens(self.history.pop(0))
+            self.trimmed += 1
+
+    def request(self, message: Dict[str, Any], model: str):
+        """(path, payload, text_of) for the next turn; message is already added"""
+        if model != self.model:
+            self.model = model
+            self.context = None
+        options = {'temperature': 0.7}
+        if message.get('role') == 'user' and (
+                self.turns == 0 or
+                self.context is not None and len(self.context) + estimate_tokens(message) <= SESSION_TOKEN_BUDGET):
+            payload = {'model': model, 'prompt': message.get('content', ''), 'options': options}
+            if self.context is None:
+                if self.system:
+                    payload['system'] = self.system
+            else:
+                payload['context'] = self.context
+            return '/api/generate', payload, lambda chunk: chunk.get('response', '')
+        
+        # Geen bruikbare context: de geschiedenis zelf sturen, binnen het budget
+        self.context = None
+        self.trim()
+        messages = ([{'role': 'system', 'content': self.system}] if self.system else []) + self.history
+        payload = {'model': model, 'messages': messages, 'options': options}
+        return '/api/chat', payload, lambda chunk: (chunk.get('message') or {}).get('content', '')
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'model': self.model,
+            'turns': self.turns,
+            'context_turns': self.context_turns,
+            'window_messages': len(self.history),
+            'window_tokens': self.tokens,
+            'context_tokens': len(self.context) if self.context else 0,
+            'trimmed_messages': self.trimmed,
+        }
+
+class SessionStore:
+    """Sessions by id; gedeeld door alle verbindingen, dus ook na een nieuwe connectNative"""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, ttl: float = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, session_id, model: str, system: str = None) -> Session:
+        now = time.monotonic()
+        with self.lock:
+            for key in [k for k, v in self.sessions.items() if now - v.used > self.ttl]:
+                del self.sessions[key]
+            session = self.sessions.get(session_id)
+            if session is None:
+                if len(self.sessions) >= self.max_sessions:
+                    oldest = min(self.sessions.values(), key=lambda v: v.used)
+                    del self.sessions[oldest.id]
+                session = self.sessions[session_id] = Session(session_id, model, system)
+            session.used = now
+            return session
+
+    def close(self, session_id) -> bool:
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def find(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+sessions = SessionStore()
+
+def call_session_chat(session_id, message: Dict[str, Any], model: str = DEFAULT_MODEL,
+                      system: str = None, job: Job = None, stream: bool = False) -> Dict[str, Any]:
+    """
+    One chat turn in a host-side session; message is only the new message.
+    """
+    session = sessions.get(session_id, model, system)
+    with session.lock:
+        session.add(message)
+        try:
+            path, payload, text_of = session.request(message, model)
+            context_reused = 'context' in payload
+            logging.info(f"Session {session_id} turn {session.turns + 1} via {path}")
+            
+            parts = []
+            last = {}
+
+            def collect(chunk):
+                nonlocal last
+                parts.append(text_of(chunk))
+                last = chunk
+            
+            if stream:
+                result = relay_stream(path, payload, job, text_of, collect)
+            else:
+                for chunk in stream_ollama(path, payload, job):
+                    collect(chunk)
+                result = {
+                    'success': True,
+                    'message': {'role': 'assistant', 'content': ''.join(parts)},
+                    'model': model,
+                    'done': last.get('done', True)
+                }
+        
+        except Cancelled:
+            # Het onbeantwoorde bericht hoort niet in de geschiedenis
+            session.discard(message)
+            logging.info(f"Session {session_id} turn cancelled")
+            return cancelled_result()
+        except Exception as e:
+            session.discard(message)
+            logging.error(f"Ollama session error: {str(e)}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        
+        session.add({'role': 'assistant', 'content': ''.join(parts)})
+        session.context = last.get('context') if path == '/api/generate' else None
+        session.turns += 1
+        session.context_turns += context_reused
+        return {**result, 'session': {**session.snapshot(), 'context_reused': context_reused}}
+
+def cached_models():
+    """The cached /api/tags models while they are fresh, else None"""
+    with models_lock:
+        if models_cache['models'] is not None and time.monotonic() - models_cache['fetched'] < MODELS_CACHE_SECONDS:
+            return models_cache['models']
+    return None
+
+def list_models(refresh: bool = False) -> list:
+    """Ollama's /api/tags models, at most MODELS_CACHE_SECONDS old"""
+    models = None if refresh else cached_models()
+    if models is not None:
+        return models
+    response = session.get(f'{OLLAMA_URL}/api/tags', timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    response.raise_for_status()
+    models = response.json().get('models', [])
+    with models_lock:
+        models_cache.update(models=models, fetched=time.monotonic())
+    return models
+
+def handle_message(message: Dict[str, Any], job: Job) -> Dict[str, Any]:
     """
     Process incoming message from browser.
     """
@@ -168,25 +766,43 @@ def handle_message(message: Dict[str, Any]) -> Dict[str, Any]:
         context = message.get('context', None)
         system = message.get('system', None)
         
-        return call_ollama(prompt, model, system, context)
-        
+        return call_ollama(prompt, model, system, context, job, bool(message.get('stream')))
+    
+    elif msg_type == 'chat' and message.get('session') is not None:
+        # Chat in een sessie: alleen het nieuwe bericht
+        return call_session_chat(message['session'], message.get('message') or {}, model,
+                                 message.get('system'), job, bool(message.get('stream')))
+    
     elif msg_type == 'chat':
         # Chat with message history
         messages = message.get('messages', [])
-        return call_ollama_chat(messages, model)
-        
+        return call_ollama_chat(messages, model, job, bool(message.get('stream')))
+    
+    elif msg_type == 'session':
+        # Sessie opvragen of sluiten
+        session_id = message.get('session')
+        if message.get('action') == 'close':
+            return {'success': True, 'closed': sessions.close(session_id)}
+        session = sessions.find(session_id)
+        if session is None:
+            return {'success': False, 'error': f'Unknown session: {session_id}'}
+        return {'success': True, 'session': session.snapshot()}
+    
     elif msg_type == 'ping':
         # Health check
         return {'success': True, 'pong': True}
-        
+    
+    elif msg_type == 'cancel':
+        # Lopende request afbreken; het antwoord daarop meldt zelf 'cancelled'
+        target = message.get('target')
+        return {'success': True, 'target': target, 'found': job.channel.cancel(target)}
+    
     elif msg_type == 'models':
         # List available models
         try:
-            response = requests.get(f'{OLLAMA_URL}/api/tags')
-            response.raise_for_status()
             return {
                 'success': True,
-                'models': response.json().get('models', [])
+                'models': list_models(refresh=bool(message.get('refresh')))
             }
         except Exception as e:
             return {
@@ -200,31 +816,108 @@ def handle_message(message: Dict[str, Any]) -> Dict[str, Any]:
             'error': f'Unknown message type: {msg_type}'
         }
 
+def check_private_dir(path: str) -> None:
+    """Raise PermissionError unless path is a real directory of this user that nobody else can use"""
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f'{path} is not a private directory of uid {os.getuid()}')
+
+def runtime_dir() -> str:
+    """
+    Directory for the daemon socket and lock: $XDG_RUNTIME_DIR, anders een
+    eigen map met mode 0700 in TMPDIR. In een gedeelde /tmp kan een andere
+    gebruiker een voorspelbaar pad anders als eerste aanmaken.
+    """
+    path = os.environ.get('XDG_RUNTIME_DIR')
+    if not path:
+        path = os.path.join(os.environ.get('TMPDIR', '/tmp'), f'ollama_host-{os.getuid()}')
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass  # check_private_dir beslist of hij bruikbaar is
+    check_private_dir(path)
+    return path
+
+def peer_uid(conn: socket.socket):
+    """uid of the process on the other end of a Unix socket; None where SO_PEERCRED is missing"""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    _, uid, _ = struct.unpack('3i', conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+    return uid
+
+def serve_connection(conn: socket.socket) -> None:
+    with conn:
+        if peer_uid(conn) not in (None, os.getuid()):
+            logging.warning("Refused a connection from another user")
+            return
+        Channel(conn.makefile('rb'), conn.makefile('wb')).serve()
+
+def serve_daemon(path: str = None) -> None:
+    """
+    Long-lived host: elke launcher verbinding wordt een eigen Channel.
+    Een lock file zorgt dat er maar één daemon per socket draait, ook als
+    twee launchers er tegelijk een starten. Lock en socket volgen geen
+    symlinks en zijn alleen voor deze gebruiker.
+    """
+    if path is None:
+        try:
+            path = SOCKET_PATH or os.path.join(runtime_dir(), SOCKET_NAME)
+        except OSError as e:
+            logging.error(f"No private directory for the daemon socket: {str(e)}")
+            return
+    try:
+        lock_fd = os.open(f'{path}.lock', os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    except OSError as e:
+        logging.error(f"Cannot open the daemon lock: {str(e)}")
+        return
+    lock_file = os.fdopen(lock_fd, 'w')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logging.info("Another daemon owns the socket, exiting")
+        return
+    
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        info = None
+    if info is not None:
+        if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+            logging.error(f"{path} exists and is not our socket, exiting")
+            return
+        os.unlink(path)  # socket van een gestopte daemon
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # socket is meteen 0600, niet pas na een chmod
+    try:
+        server.bind(path)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    logging.info(f"Ollama Native Messaging daemon listening on {path}")
+    
+    # Verbinding naar Ollama en modellijst klaarzetten voor de eerste launcher
+    try:
+        list_models(refresh=True)
+    except Exception as e:
+        logging.warning(f"Ollama not reachable yet: {str(e)}")
+    
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=serve_connection, args=(conn,), name='connection', daemon=True).start()
+
 def main():
     """
-    Main loop: read messages from browser, process, send response.
+    Serve the browser on stdin/stdout, or run as daemon with --daemon.
     """
-    logging.info("Ollama Native Messaging Host started")
+    if '--daemon' in sys.argv[1:]:
+        serve_daemon()
+        return
     
+    logging.info("Ollama Native Messaging Host started")
     try:
-        while True:
-            # Read message from browser
-            message = read_message()
-            
-            # Process message
-            response = handle_message(message)
-            
-            # Send response back to browser
-            send_message(response)
-            
+        Channel(sys.stdin.buffer, sys.stdout.buffer).serve()
     except KeyboardInterrupt:
         logging.info("Shutting down gracefully")
-    except Exception as e:
-        logging.error(f"Fatal error: {str(e)}")
-        send_message({
-            'success': False,
-            'error': f'Host error: {str(e)}'
-        })
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+No-Guardrail AI - Native Messaging Launcher
+Dunne launcher die Chrome start in plaats van ollama_host.py. Verbindt met de
+ollama_host daemon over een Unix socket en stuurt de bytes in beide richtingen
+door; de framing (4-byte lengte + JSON) is aan beide kanten gelijk.
+Bewust alleen stdlib modules die Python al bij het opstarten laadt: geen
+requests, geen logging, geen JSON.
+
+Draait er geen daemon, dan start de launcher er een en wacht kort; lukt ook
+dat niet, dan wordt dit proces gewoon ollama_host.py op stdin/stdout.
+"""
+
+import os
+import sys
+import time
+import stat
+import socket
+import threading
+
+HOST_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ollama_host.py')
+
+# Zelfde pad als de daemon (SOCKET_PATH en runtime_dir in ollama_host.py)
+SOCKET_DIR = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.environ.get('TMPDIR', '/tmp'),
+                                                                f'ollama_host-{os.getuid()}')
+SOCKET_PATH = os.environ.get('OLLAMA_HOST_SOCKET') or os.path.join(SOCKET_DIR, 'ollama_host.sock')
+DAEMON_START_TIMEOUT = 5  # seconden
+BUFFER_SIZE = 65536
+
+
+def private_dir(path):
+    """True if path is a directory of this user that nobody else can use"""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+
+def owned_by_us(sock):
+    """
+    True if the daemon on the other end runs as this user. Anders zou de
+    launcher prompts doorsturen naar wie het pad als eerste aanmaakte.
+    """
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, 12)  # struct ucred: pid, uid, gid
+        uid = int.from_bytes(creds[4:8], sys.byteorder)
+    else:
+        uid = os.stat(SOCKET_PATH).st_uid
+    return uid == os.getuid()
+
+
+def connect():
+    if not os.environ.get('OLLAMA_HOST_SOCKET') and not private_dir(SOCKET_DIR):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_PATH)
+        if owned_by_us(sock):
+            return sock
+    except OSError:
+        pass
+    sock.close()
+    return None
+
+
+def start_daemon():
+    """Start ollama_host.py --daemon detached and wait until it accepts"""
+    import subprocess  # alleen nodig bij een koude start
+    subprocess.Popen([sys.executable, HOST_SCRIPT, '--daemon'], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        sock = connect()
+        if sock is not None:
+            return sock
+        time.sleep(0.02)
+    return None
+
+
+def browser_to_daemon(sock):
+    while True:
+        data = os.read(0, BUFFER_SIZE)
+        if not data:
+            break
+        sock.sendall(data)
+    # Browser heeft de port gesloten; de daemon breekt dan de lopende requests af
+    try:
+        sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+
+
+def relay(sock):
+    threading.Thread(target=browser_to_daemon, args=(sock,), daemon=True).start()
+    out = sys.stdout.buffer
+    while True:
+        data = sock.recv(BUFFER_SIZE)
+        if not data:
+            break
+        out.write(data)
+        out.flush()
+
+
+def main():
+    sock = connect() or start_daemon()
+    if sock is None:
+        # Geen daemon mogelijk: dan maar de host zelf, zoals vroeger
+        os.execv(sys.executable, [sys.executable, HOST_SCRIPT] + sys.argv[1:])
+    try:
+        relay(sock)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Client disconnect detectie voor de guardrail proxy
+Eén achtergrond thread bewaakt de sockets van clients die op een completion
+wachten. Haakt een client af, dan wordt zijn upstream request meteen
+afgebroken in plaats van dat Ollama doorgenereert voor niemand.
+"""
+
+import os
+import time
+import socket
+import logging
+import selectors
+import threading
+
+POLL_INTERVAL = float(os.environ.get('DISCONNECT_POLL_INTERVAL', 0.25))  # seconden
+
+
+def client_gone(sock) -> bool:
+    """
+    True if the peer closed its side; pipelined data counts as still there.
+    Een TLS socket weigert MSG_PEEK en een gesloten socket geeft ValueError:
+    beide tellen als weg, anders zou de monitor thread eraan sterven.
+    """
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+class Watch:
+    """Registration of one client socket; stop() when the request is done"""
+
+    def __init__(self, monitor, sock, on_disconnect):
+        self.monitor = monitor
+        self.sock = sock
+        self.on_disconnect = on_disconnect
+        self.disconnected = False
+
+    def stop(self) -> None:
+        if self.sock is not None:
+            self.monitor.unregister(self)
+
+
+class DisconnectMonitor:
+    """
+    Watches client sockets for EOF while their request is in flight.
+    De socket wordt pas leesbaar als de client sluit (de request body is al
+    gelezen), dus de thread slaapt in select() tot er echt iets gebeurt.
+    """
+
+    def __init__(self, interval: float = POLL_INTERVAL):
+        self.interval = interval
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.started = False
+        self.disconnects = 0
+
+    def watch(self, sock, on_disconnect) -> Watch:
+        """Call on_disconnect() once if sock's peer hangs up before stop()"""
+        watch = Watch(self, sock, on_disconnect)
+        if sock is None:
+            return watch  # server geeft geen socket door: niets te bewaken
+        with self.lock:
+            try:
+                self.selector.register(sock, selectors.EVENT_READ, watch)
+            except (KeyError, ValueError, OSError):
+                watch.sock = None
+                return watch
+            if not self.started:
+                self.started = True
+                threading.Thread(target=self._loop, name='disconnect-monitor', daemon=True).start()
+        return watch
+
+    def unregister(self, watch: Watch) -> None:
+        with self.lock:
+            try:
+                if self.selector.get_key(watch.sock).data is watch:
+                    self.selector.unregister(watch.sock)
+            except (KeyError, ValueError, OSError):
+                pass
+            watch.sock = None
+
+    def _loop(self) -> None:
+        while True:
+            with self.lock:
+                empty = not self.selector.get_map()
+            if empty:
+                time.sleep(self.interval)
+                continue
+
+            try:
+                ready = self.selector.select(self.interval)
+            except (OSError, ValueError):
+                continue
+            for key, _ in ready:
+                watch = key.data
+                gone = client_gone(key.fileobj)
+                with self.lock:
+                    if watch.sock is None:
+                        continue  # intussen gestopt
+                    try:
+                        self.selector.unregister(key.fileobj)
+                    except (KeyError, ValueError, OSError):
+                        pass
+                    watch.sock = None
+                    if gone:
+                        watch.disconnected = True
+                        self.disconnects += 1
+                if gone:
+                    try:
+                        watch.on_disconnect()
+                    except Exception as e:
+                        logging.error(f"Disconnect handler failed: {e}")
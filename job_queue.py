@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Job queue voor de browser agent server
+Eén asyncio loop in een eigen thread bezit de browser agents: Playwright
+objecten horen bij de loop die ze maakte. Flask views zetten alleen jobs in
+de wachtrij en lezen de status; workers op die loop voeren ze uit.
+"""
+
+import os
+import math
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 1))          # taken tegelijk, elk met een eigen browser
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 16))  # wachtende taken
+JOB_HISTORY = int(os.environ.get('JOB_HISTORY', 100))         # afgeronde jobs die opvraagbaar blijven
+EVENT_HEARTBEAT = 15         # seconden; houdt SSE verbindingen door proxies heen open
+INITIAL_SERVICE_TIME = 60.0  # schatting tot de eerste taak klaar is
+EWMA_ALPHA = 0.2
+
+FINISHED = ('done', 'failed', 'cancelled')
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised when the queue has no room for another job; carries a Retry-After hint"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    One task for the browser agent.
+    Alle events worden bewaard, zodat een SSE client die later aansluit (of
+    opnieuw verbindt) eerst een replay krijgt en daarna live meeleest.
+    """
+
+    def __init__(self, task: str, mode: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.task = task
+        self.mode = mode
+        self.status = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self.handle = None  # asyncio.Task zolang de job draait; alleen op de loop gebruiken
+        self.cond = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    def publish(self, event_type: str, **data) -> None:
+        with self.cond:
+            self.events.append({'seq': len(self.events), 'type': event_type, 'time': time.time(), **data})
+            self.cond.notify_all()
+
+    def begin(self) -> None:
+        with self.cond:
+            self.status = 'running'
+            self.started = time.time()
+        self.publish('running')
+
+    def finish(self, status: str, result=None, error: str = None) -> None:
+        with self.cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+            # Laatste event; daarna sluit de stream
+            self.events.append({'seq': len(self.events), 'type': status, 'time': self.finished, 'error': error})
+            self.cond.notify_all()
+
+    def follow(self, start: int = 0, heartbeat: float = EVENT_HEARTBEAT):
+        """
+        Replay events from seq start, then yield new ones as they arrive.
+        Yields None after heartbeat seconds without news; stops after the last event.
+        """
+        index = start
+        while True:
+            with self.cond:
+                if index >= len(self.events) and not self.done:
+                    self.cond.wait(heartbeat)
+                pending = self.events[index:]
+                index += len(pending)
+                done = self.done and index >= len(self.events)
+            if not pending and not done:
+                yield None
+            yield from pending
+            if done:
+                return
+
+    def snapshot(self, result: bool = False) -> dict:
+        with self.cond:
+            snapshot = {
+                'id': self.id,
+                'task': self.task,
+                'mode': self.mode,
+                'status': self.status,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+                'progress': next((event for event in reversed(self.events) if event['type'] == 'progress'), None),
+                'error': self.error,
+            }
+            if result:
+                snapshot['result'] = self.result
+        return snapshot
+
+
+class JobQueue:
+    """
+    Bounded job queue served by workers on one long-lived event loop.
+    Elke worker heeft zijn eigen agent (browser + page), dus JOB_WORKERS taken
+    lopen echt naast elkaar zonder elkaars page te gebruiken.
+    """
+
+    def __init__(self, agent_factory, workers: int = JOB_WORKERS, limit: int = JOB_QUEUE_LIMIT,
+                 history: int = JOB_HISTORY):
+        self.agent_factory = agent_factory  # maakt een BrowserAgent; start() gebeurt op de loop
+        self.workers = max(1, workers)
+        self.limit = limit
+        self.history = history
+        self.jobs = OrderedDict()  # id -> Job, oudste eerst
+        self.lock = threading.Lock()
+        self.loop = None
+        self.queue = None
+        self.thread = None
+        self.agents = []
+        self.ready = threading.Event()
+        self.error = None  # waarom de agents niet gestart zijn
+        self.service_time = INITIAL_SERVICE_TIME
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+
+    def start(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name='job-loop', daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.loop.run_until_complete(self._main())
+
+    async def _main(self) -> None:
+        try:
+            for _ in range(self.workers):
+                agent = self.agent_factory()
+                await agent.start()
+                self.agents.append(agent)
+        except Exception as e:
+            logger.error(f"Failed to start browser agent: {e}")
+            self.error = str(e)
+            if not self.agents:
+                self._fail_queued()
+                return
+            logger.warning(f"Running with {len(self.agents)} of {self.workers} workers")
+
+        logger.info(f"Job queue ready with {len(self.agents)} workers")
+        self.ready.set()
+        await asyncio.gather(*(self._worker(agent) for agent in self.agents))
+
+    def _fail_queued(self) -> None:
+        with self.lock:
+            queued = [job for job in self.jobs.values() if job.status == 'queued']
+            for job in queued:
+                job.finish('failed', error=f'Browser agent not initialized: {self.error}')
+            self.failed += len(queued)
+
+    def _put(self, job: Job) -> None:
+        self.queue.put_nowait(job)
+
+    async def _worker(self, agent) -> None:
+        while True:
+            job = await self.queue.get()
+            with self.lock:
+                if job.status != 'queued':
+                    continue  # in de wachtrij geannuleerd
+                job.begin()
+            # Eigen task per job: cancel() breekt de taak af, niet de worker
+            job.handle = asyncio.ensure_future(self._execute(agent, job))
+            await self._settle(job)
+
+    async def _execute(self, agent, job: Job):
+        logger.info(f"Job {job.id} executing in {job.mode} mode: {job.task}")
+        return await agent.execute_task(job.task, on_step=lambda event: job.publish('progress', **event))
+
+    async def _settle(self, job: Job) -> None:
+        try:
+            result = await job.handle
+        except asyncio.CancelledError:
+            if not job.handle.cancelled():
+                raise  # de worker zelf wordt gestopt
+            logger.info(f"Job {job.id} cancelled")
+            job.finish('cancelled')
+            with self.lock:
+                self.cancelled += 1
+            return
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.finish('failed', error=str(e))
+            with self.lock:
+                self.failed += 1
+            return
+
+        success = not isinstance(result, dict) or result.get('success', True)
+        job.finish('done' if success else 'failed', result=result,
+                   error=None if success else result.get('error'))
+        with self.lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+            elapsed = job.finished - job.started
+            self.service_time = (1 - EWMA_ALPHA) * self.service_time + EWMA_ALPHA * elapsed
+
+    def submit(self, task: str, mode: str) -> Job:
+        """Queue a task; raises QueueFull when JOB_QUEUE_LIMIT jobs are already waiting"""
+        job = Job(task, mode)
+        with self.lock:
+            queued = sum(1 for other in self.jobs.values() if other.status == 'queued')
+            if queued >= self.limit:
+                self.rejected += 1
+                retry_after = math.ceil(self.service_time * (queued + 1) / self.workers)
+                raise QueueFull(f'Job queue is full ({queued} waiting)', retry_after)
+            self.jobs[job.id] = job
+            self._prune()
+        job.publish('queued', position=queued + 1)
+        self.loop.call_soon_threadsafe(self._put, job)
+        return job
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond JOB_HISTORY; call with the lock held"""
+        finished = [job for job in self.jobs.values() if job.done]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job.id]
+
+    def get(self, job_id: str):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def recent(self) -> list:
+        with self.lock:
+            return list(self.jobs.values())
+
+    def position(self, job: Job) -> int:
+        """1-based place in the queue; 0 when the job is not waiting"""
+        with self.lock:
+            queued = [other for other in self.jobs.values() if other.status == 'queued']
+        return queued.index(job) + 1 if job in queued else 0
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a waiting or running job; False if it is unknown or already finished"""
+        job = self.get(job_id)
+        if job is None:
+            return False
+        with self.lock:
+            if job.status == 'queued':
+                job.finish('cancelled')  # de worker slaat hem over
+                self.cancelled += 1
+                return True
+            if job.status != 'running':
+                return False
+        # De taak hoort bij de loop; daar afbreken (bij de eerstvolgende await)
+        self.loop.call_soon_threadsafe(self._cancel_running, job)
+        return True
+
+    def _cancel_running(self, job: Job) -> None:
+        if job.handle is not None and not job.handle.done():
+            job.handle.cancel()
+
+    def cancel_running(self) -> list:
+        """Cancel every running job; returns their ids"""
+        running = [job.id for job in self.recent() if job.status == 'running']
+        return [job_id for job_id in running if self.cancel(job_id)]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            statuses = [job.status for job in self.jobs.values()]
+            return {
+                'ready': self.ready.is_set(),
+                'error': self.error,
+                'workers': len(self.agents) or self.workers,
+                'queue_limit': self.limit,
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running'),
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'rejected': self.rejected,
+                'avg_job_seconds': round(self.service_time, 1),
+            }
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics voor de guardrail proxy
+Counters, gauges en histograms in het text exposition format. Met METRICS_DIR
+schrijft elk worker proces zijn waarden naar een eigen bestand en aggregeert
+/metrics over alle processen.
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '')  # leeg = alleen dit proces
+METRICS_DUMP_INTERVAL = 1.0  # seconden
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TTFT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+CHECK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    """
+    Metric store for one process.
+    Elke update houdt de lock maar voor één optelling vast; histogrammen
+    bewaren niet-cumulatieve bucket counts zodat processen simpel op te tellen zijn.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR):
+        self.families = {}  # name -> {'type', 'help', 'buckets'}
+        self.values = {}    # (name, labels) -> float, of [buckets..., +Inf, sum, count]
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.directory = directory
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._dump_loop, name='metrics-dump', daemon=True).start()
+
+    def counter(self, name: str, help_text: str) -> None:
+        self.families[name] = {'type': 'counter', 'help': help_text}
+
+    def gauge(self, name: str, help_text: str) -> None:
+        self.families[name] = {'type': 'gauge', 'help': help_text}
+
+    def histogram(self, name: str, help_text: str, buckets) -> None:
+        self.families[name] = {'type': 'histogram', 'help': help_text, 'buckets': list(buckets)}
+
+    def register_collector(self, collector) -> None:
+        """collector() is called at scrape/dump time and returns (name, labels, value) gauges/counters"""
+        self.collectors.append(collector)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, _labels_key(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.values[(name, _labels_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        buckets = self.families[name]['buckets']
+        index = bisect.bisect_left(buckets, value)
+        key = (name, _labels_key(labels))
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self) -> list:
+        """All samples of this process as [name, labels, value] lists"""
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    self.set(name, value, **labels)
+            except Exception as e:
+                logging.error(f"Metrics collector failed: {e}")
+
+        with self.lock:
+            return [
+                [name, list(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self.values.items()
+            ]
+
+    def dump(self) -> None:
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'time': time.time(), 'samples': self.snapshot()}, f)
+        os.replace(f'{path}.tmp', path)
+
+    def _dump_loop(self) -> None:
+        while True:
+            time.sleep(METRICS_DUMP_INTERVAL)
+            try:
+                self.dump()
+            except Exception as e:
+                logging.error(f"Metrics dump failed: {e}")
+
+    def _process_snapshots(self):
+        """Snapshots van alle processen; gauges van gestopte processen tellen niet mee"""
+        if not self.directory:
+            yield True, self.snapshot()
+            return
+
+        self.dump()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    stored = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield _pid_alive(stored['pid']), stored['samples']
+
+    def render(self) -> str:
+        """Prometheus text exposition format, aggregated over all worker processes"""
+        merged = {}
+        for alive, samples in self._process_snapshots():
+            for name, labels, value in samples:
+                family = self.families.get(name)
+                if family is None or (family['type'] == 'gauge' and not alive):
+                    continue
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if isinstance(value, list):
+                    current = merged.setdefault(key, [0] * len(value))
+                    for i, v in enumerate(value):
+                        current[i] += v
+                else:
+                    merged[key] = merged.get(key, 0) + value
+
+        lines = []
+        for name, family in self.families.items():
+            series = sorted((labels, value) for (n, labels), value in merged.items() if n == name)
+            lines.append(f'# HELP {name} {family["help"]}')
+            lines.append(f'# TYPE {name} {family["type"]}')
+            for labels, value in series:
+                if family['type'] != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(family['buckets'] + [float('inf')], value[:-2]):
+                    cumulative += count
+                    le = (('le', _format_value(bound)),)
+                    lines.append(f'{name}_bucket{_format_labels(labels, le)} {_format_value(cumulative)}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {_format_value(value[-1])}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Model routing voor de guardrail proxy
+Een virtueel model (bv. "auto") wordt per request vertaald naar een echt
+model: kleine prompts naar kleine modellen, tenzij dat model vol zit of
+traag is. De policies staan in een JSON config (MODEL_ROUTES_FILE).
+
+Voorbeeld (model_routes.json):
+    {"auto": {"default_max_tokens": 512,
+              "rules": [{"model": "dolphin-phi", "max_prompt_tokens": 1000, "max_tokens": 512,
+                         "max_queue_depth": 2, "min_tokens_per_second": 10},
+                        {"model": "dolphin-mixtral"}]}}
+"""
+
+import os
+import json
+import logging
+import threading
+
+MODEL_ROUTES_FILE = os.environ.get(
+    'MODEL_ROUTES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_routes.json')
+)
+CHARS_PER_TOKEN = 4     # ruwe schatting, goed genoeg om te routeren
+SPEED_EWMA_ALPHA = 0.2
+
+
+def estimate_prompt_tokens(messages) -> int:
+    chars = 0
+    for message in messages or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            # Multimodale berichten: alleen de tekst delen tellen
+            chars += sum(len(part.get('text', '')) for part in content if isinstance(part, dict))
+    return chars // CHARS_PER_TOKEN
+
+
+def requested_tokens(data: dict):
+    """max_tokens in any of the spellings clients use, or None"""
+    options = data.get('options') or {}
+    return data.get('max_tokens') or data.get('max_completion_tokens') or options.get('num_predict')
+
+
+def load_policies(path: str = MODEL_ROUTES_FILE) -> dict:
+    """Read routing policies; a missing file means no virtual models"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            policies = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.error(f"Could not load model routes from {path}: {e}")
+        return {}
+
+    for name, policy in policies.items():
+        if not policy.get('rules'):
+            raise ValueError(f'Model route {name!r} has no rules')
+        for rule in policy['rules']:
+            if 'model' not in rule:
+                raise ValueError(f'Model route {name!r} has a rule without a model')
+    return policies
+
+
+class ModelRouter:
+    """
+    Maps virtual model names to concrete models.
+    De regels van een policy staan van klein naar groot. Eerst tellen alleen
+    regels waar de request in past; daarvan wint de eerste die niet vol zit
+    en snel genoeg is, anders die met de laagste geschatte latency.
+    """
+
+    def __init__(self, policies: dict = None, load=None):
+        self.policies = load_policies() if policies is None else policies
+        self.load = load          # model -> (queued, active, limit, service_seconds)
+        self.available = None     # model -> bool, bv. uit de health snapshot
+        self.speeds = {}          # model -> EWMA van tokens per seconde
+        self.routes = {name: {} for name in self.policies}
+        self.lock = threading.Lock()
+
+    def virtual_models(self) -> list:
+        return sorted(self.policies)
+
+    def is_virtual(self, model: str) -> bool:
+        return model in self.policies
+
+    def observe(self, model: str, tokens_per_second: float) -> None:
+        """Feed the observed generation speed of a completion"""
+        with self.lock:
+            speed = self.speeds.get(model)
+            self.speeds[model] = tokens_per_second if speed is None else (
+                speed + SPEED_EWMA_ALPHA * (tokens_per_second - speed))
+
+    def estimate(self, model: str, tokens: int) -> float:
+        """Seconds until a completion of tokens tokens would be done on model"""
+        queued, active, limit, service = self.load(model) if self.load else (0, 0, 1, 0.0)
+        wait = max(queued + active - limit + 1, 0) * service / max(limit, 1)
+        speed = self.speeds.get(model)
+        return wait + (tokens / speed if speed else service)
+
+    def route(self, data: dict):
+        """
+        Concrete model for a request on a virtual model.
+        Returns (model, reason); reason is 'fits', 'fallback' of 'largest'.
+        """
+        policy = self.policies[data.get('model')]
+        prompt_tokens = estimate_prompt_tokens(data.get('messages'))
+        tokens = requested_tokens(data) or policy.get('default_max_tokens', 512)
+
+        rules = [rule for rule in policy['rules']
+                 if self.available is None or self.available(rule['model'])] or policy['rules']
+        fitting = [rule for rule in rules
+                   if prompt_tokens <= rule.get('max_prompt_tokens', float('inf'))
+                   and tokens <= rule.get('max_tokens', float('inf'))] or rules[-1:]
+
+        model, reason = None, None
+        for rule in fitting:
+            queued, _, _, _ = self.load(rule['model']) if self.load else (0, 0, 1, 0.0)
+            speed = self.speeds.get(rule['model'])
+            if queued > rule.get('max_queue_depth', float('inf')):
+                continue
+            if speed is not None and speed < rule.get('min_tokens_per_second', 0):
+                continue
+            model, reason = rule['model'], 'fits'
+            break
+
+        if model is None:
+            if len(fitting) == 1:
+                model, reason = fitting[0]['model'], 'largest'
+            else:
+                # Alles vol of traag: de snelste schatting
+                model = min((rule['model'] for rule in fitting), key=lambda m: self.estimate(m, tokens))
+                reason = 'fallback'
+
+        with self.lock:
+            counts = self.routes[data.get('model')]
+            counts[model] = counts.get(model, 0) + 1
+        return model, reason
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'virtual_models': {name: dict(counts) for name, counts in self.routes.items()},
+                'tokens_per_second': {model: round(speed, 2) for model, speed in self.speeds.items()},
+            }
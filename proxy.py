@@ -4,15 +4,89 @@ Minimale Guardrail Proxy voor Ollama
 Blokkeert alleen echt illegale content, laat de rest door.
 """
 
+import os
 import re
+import json
+import time
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import requests
+from audit_log import AuditLog
+from metrics import Registry, LATENCY_BUCKETS, TTFT_BUCKETS, TOKENS_PER_SECOND_BUCKETS, CHECK_BUCKETS
+from response_cache import ResponseCache, cache_key, is_deterministic
+from singleflight import SingleFlight
+from scheduler import Scheduler, QueueFull, BATCH_API_KEYS, MODEL_CONCURRENCY
+from upstream import BackendPool, CancelToken, HealthProber, NoBackendAvailable, RequestCancelled, OLLAMA_BACKENDS
+from disconnect import DisconnectMonitor
+from affinity import PREFIX_AFFINITY, prefix_key
+from model_router import ModelRouter
+from warm_pool import WarmPool, WARM_POOL
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Gedeelde keep-alive pool naar alle Ollama backends
+upstream = BackendPool(OLLAMA_BACKENDS)
+
+# Virtuele modellen (bv. "auto") uit MODEL_ROUTES_FILE
+router = ModelRouter()
+
+# Health en modellijst worden op de achtergrond ververst
+prober = HealthProber(upstream, virtual_models=router.virtual_models())
+prober.start()
+
+# Modellen voorladen en warm houden; residency staat in /health
+warm_pool = WarmPool(upstream)
+if WARM_POOL:
+    warm_pool.start()
+
+# Cache voor deterministische (temperature 0 / seed) completions
+response_cache = ResponseCache()
+
+# Gelijktijdige identieke requests delen één upstream call
+inflight = SingleFlight()
+
+# Clients die afhaken breken hun upstream generatie af
+disconnects = DisconnectMonitor()
+
+# Prometheus metrics (/metrics); met METRICS_DIR geaggregeerd over alle workers
+metrics = Registry()
+metrics.histogram('proxy_request_duration_seconds', 'Chat completion latency until the last byte', LATENCY_BUCKETS)
+metrics.histogram('proxy_time_to_first_token_seconds', 'Time until the first streamed event', TTFT_BUCKETS)
+metrics.histogram('proxy_tokens_per_second', 'Generation speed per request', TOKENS_PER_SECOND_BUCKETS)
+metrics.counter('proxy_eval_tokens_total', 'Generated tokens')
+metrics.counter('proxy_eval_seconds_total', 'Time spent generating tokens')
+metrics.counter('proxy_prompt_eval_tokens_total', 'Prompt tokens evaluated (Ollama prompt_eval_count)')
+metrics.counter('proxy_prompt_eval_seconds_total', 'Prompt evaluation time (Ollama prompt_eval_duration)')
+metrics.histogram('proxy_content_check_seconds', 'Time spent in the content check', CHECK_BUCKETS)
+metrics.histogram('proxy_queue_wait_seconds', 'Time waiting for a scheduler slot', LATENCY_BUCKETS)
+metrics.counter('proxy_http_requests_total', 'HTTP responses by endpoint and status')
+metrics.counter('proxy_upstream_requests_total', 'Upstream calls by backend')
+metrics.counter('proxy_upstream_errors_total', 'Failed upstream calls by backend')
+metrics.gauge('proxy_queue_depth', 'Requests waiting for a slot by model and priority')
+metrics.gauge('proxy_active_requests', 'Requests holding a slot by model')
+metrics.counter('proxy_response_cache_events_total', 'Response cache events')
+metrics.counter('proxy_cancelled_requests_total', 'Generations aborted because the client disconnected')
+metrics.counter('proxy_cancelled_seconds_saved_total', 'Estimated inference time saved by cancellations')
+metrics.counter('proxy_output_blocked_total', 'Completions stopped by the output guardrail')
+metrics.counter('proxy_affinity_routes_total', 'Prefix-affinity routing decisions by result')
+metrics.histogram('proxy_prompt_eval_duration_seconds',
+                  'Prompt evaluation by affinity result; source ollama (prompt_eval_duration) or ttft (upstream TTFT)',
+                  LATENCY_BUCKETS)
+metrics.histogram('proxy_affinity_time_to_first_token_seconds', 'Time to first token by affinity result', TTFT_BUCKETS)
+metrics.counter('proxy_model_routes_total', 'Virtual model requests by served model and reason')
+metrics.gauge('proxy_resident_model_bytes', 'Models loaded on a backend according to /api/ps')
+
+# Per-model admission control; de limiet schaalt mee met het aantal backends
+scheduler = Scheduler(default_limit=MODEL_CONCURRENCY * len(OLLAMA_BACKENDS))
+router.load = scheduler.load
+
+PROXY_PORT = int(os.environ.get('PROXY_PORT', 11435))
+
 # Minimale blacklist - alleen echt illegale categorieën
 ILLEGAL_PATTERNS = [
     # Child abuse
@@ -23,8 +97,38 @@ ILLEGAL_PATTERNS = [
     r'\b(doxxing|dox\s*someone|real\s*home\s*address\s*of|swatting)\b',
 ]
 
-# Log alle requests (voor audit)
-REQUEST_LOG = []
+# Eén gecombineerde regex: een veilige tekst wordt in één pass gescand
+# in plaats van één pass per patroon
+COMBINED_PATTERN = re.compile('|'.join(f'(?:{p})' for p in ILLEGAL_PATTERNS), re.IGNORECASE)
+COMPILED_PATTERNS = [re.compile(p, re.IGNORECASE) for p in ILLEGAL_PATTERNS]
+
+# Alle patronen zijn woorden verbonden door \s*, dus een match over de grens
+# tussen twee berichten bevat hooguit zoveel niet-witruimte tekens per kant
+BOUNDARY_WINDOW = 64
+
+# Gegenereerde tekst ook controleren (0 = alleen user input)
+SCAN_OUTPUT = os.environ.get('SCAN_OUTPUT', '1') != '0'
+OUTPUT_SCAN_STATS = {'streams': 0, 'events': 0, 'bodies': 0, 'blocked_streams': 0, 'blocked_bodies': 0}
+output_stats_lock = threading.Lock()
+
+# Staart van de output die per delta opnieuw gescand wordt (zie OutputScanner.tail)
+OUTPUT_CARRY_CHARS = 96
+WORD_CHAR = re.compile(r'\w')
+
+# Verdicts per berichtinhoud, zodat elke turn alleen nieuwe berichten scant
+VERDICT_CACHE_SIZE = 10000
+VERDICT_CACHE = OrderedDict()
+verdict_lock = threading.Lock()
+
+# Hop-by-hop headers (RFC 7230 sectie 6.1) gelden per verbinding en mogen
+# nooit naar de client doorgestuurd worden
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade',
+}
+
+# Log alle requests (voor audit): ring buffer in memory, segmenten op disk
+REQUEST_LOG = AuditLog()
 
 def log_request(user_content, blocked=False, reason=None):
     """Log alle requests voor audit trail"""
@@ -36,10 +140,6 @@ def log_request(user_content, blocked=False, reason=None):
     }
     REQUEST_LOG.append(log_entry)
     
-    # Keep last 1000 entries
-    if len(REQUEST_LOG) > 1000:
-        REQUEST_LOG.pop(0)
-    
     if blocked:
         logging.warning(f"BLOCKED: {reason} - Preview: {user_content[:100]}")
     else:
@@ -51,97 +151,813 @@ def check_content(text):
     Returns: (is_safe, reason_if_blocked)
     """
     text_lower = text.lower()
-    
-    for pattern in ILLEGAL_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
+    if not COMBINED_PATTERN.search(text_lower):
+        return True, None
+
+    # Zelfde reden als altijd: het eerste patroon uit de lijst dat matcht
+    for pattern, compiled in zip(ILLEGAL_PATTERNS, COMPILED_PATTERNS):
+        if compiled.search(text_lower):
             return False, f"Blocked: pattern matched - {pattern}"
-    
+
     return True, None
 
+def is_safe_cached(text):
+    """Single-message verdict, cached on a hash of the content"""
+    key = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+    with verdict_lock:
+        verdict = VERDICT_CACHE.get(key)
+        if verdict is not None:
+            VERDICT_CACHE.move_to_end(key)
+            return verdict
+
+    verdict = COMBINED_PATTERN.search(text.lower()) is None
+    with verdict_lock:
+        VERDICT_CACHE[key] = verdict
+        if len(VERDICT_CACHE) > VERDICT_CACHE_SIZE:
+            VERDICT_CACHE.popitem(last=False)
+    return verdict
+
+def tail_window(text):
+    """
+    The end of text that a match crossing into the next message can touch:
+    BOUNDARY_WINDOW non-whitespace chars plus one for \\b, with whitespace.
+    """
+    start, seen = len(text), 0
+    while start > 0 and seen <= BOUNDARY_WINDOW:
+        start -= 1
+        if not text[start].isspace():
+            seen += 1
+    return text[start:]
+
+def head_window(text):
+    """Mirror of tail_window for the start of a message"""
+    end, seen = 0, 0
+    while end < len(text) and seen <= BOUNDARY_WINDOW:
+        if not text[end].isspace():
+            seen += 1
+        end += 1
+    return text[:end]
+
+def crosses_boundary(contents):
+    """
+    True if a pattern matches across a join in ' '.join(contents).
+    De staart van alles tot nu toe loopt mee, zodat ook matches over
+    meerdere korte of lege berichten heen gevonden worden.
+    """
+    carry = None
+    for content in contents:
+        if carry is not None and COMBINED_PATTERN.search(f"{carry} {head_window(content)}".lower()):
+            return True
+        tail = tail_window(content)
+        if carry is not None and len(tail) == len(content):
+            # Kort bericht: de staart reikt tot in eerdere berichten
+            tail = tail_window(f"{carry} {content}")
+        carry = tail
+    return False
+
+def check_messages(messages):
+    """
+    Check the user messages of a chat history.
+    Geeft hetzelfde verdict en dezelfde reden als check_content op de
+    samengevoegde tekst, maar scant elk bericht maar één keer over alle turns.
+    Returns: (user_content, is_safe, reason_if_blocked)
+    """
+    contents = [m.get('content', '') for m in messages if m.get('role') == 'user']
+    user_content = ' '.join(contents)
+
+    if all(isinstance(c, str) for c in contents):
+        safe = all(is_safe_cached(c) for c in contents) and not crosses_boundary(contents)
+        if safe:
+            return user_content, True, None
+
+    # Geblokkeerd (zeldzaam): volledige scan voor de exacte reden
+    is_safe, reason = check_content(user_content)
+    return user_content, is_safe, reason
+
+class OutputScanner:
+    """
+    Incremental guardrail check of streamed completion deltas.
+    Per choice wordt alleen de staart (tail_window) van de tekst tot nu toe
+    bewaard, dus elke delta kost één regex pass over een begrensd venster
+    plus de delta zelf, hoe lang de completion ook wordt.
+    """
+
+    def __init__(self):
+        self.carry = {}       # choice index -> staart van de gegenereerde tekst
+        self.pending = set()  # choices met een match die tegen het einde aan ligt
+        self.events = 0
+
+    def feed(self, text, index=0):
+        """Scan one delta; returns the block reason or None"""
+        window = self.carry.get(index, '') + text
+        lowered = window.lower()
+        match = COMBINED_PATTERN.search(lowered)
+        self.pending.discard(index)
+        if match:
+            if match.end() < len(lowered):
+                return check_content(window)[1]
+            # Het volgende token kan de \b nog ongedaan maken ("pedo" + "phile"):
+            # pas beslissen met meer tekst of aan het einde van de stream
+            self.pending.add(index)
+        self.carry[index] = self.tail(window)
+        return None
+
+    @staticmethod
+    def tail(window):
+        """
+        Superset of tail_window(window), cheap in the common case: een vaste
+        slice met genoeg niet-witruimte tekens, anders de exacte Python loop.
+        Valt de snede midden in een woord ("tor|pedo"), dan staat er een '_'
+        voor: net als het echte teken ervoor een woordteken, dus \\b matcht
+        daar niet. Geen patroon begint met '_'.
+        """
+        tail = window[-OUTPUT_CARRY_CHARS:]
+        if len(tail) < len(window) and len(''.join(tail.split())) <= BOUNDARY_WINDOW:
+            tail = tail_window(window)
+        start = len(window) - len(tail)
+        if start and WORD_CHAR.match(window[start - 1]):
+            return '_' + tail
+        return tail
+
+    def feed_event(self, event):
+        """Scan the content deltas of one SSE event"""
+        self.events += 1
+        if b'"content"' not in event:
+            return None  # usage, finish_reason, [DONE]
+        payload = event.strip()
+        if not payload.startswith(b'data:'):
+            return None
+        try:
+            chunk = json.loads(payload[len(b'data:'):])
+        except ValueError:
+            return None
+        for choice in chunk.get('choices') or []:
+            text = (choice.get('delta') or {}).get('content')
+            if text and isinstance(text, str):
+                reason = self.feed(text, choice.get('index', 0))
+                if reason:
+                    return reason
+        return None
+
+    def finish(self):
+        """End of the stream: settle matches that touched the end of the text"""
+        for index in self.pending:
+            is_safe, reason = check_content(self.carry[index])
+            if not is_safe:
+                return reason
+        self.pending.clear()
+        return None
+
+def count_output_scan(**counts):
+    with output_stats_lock:
+        for name, value in counts.items():
+            OUTPUT_SCAN_STATS[name] += value
+
+def output_blocked(model, reason, stream):
+    logging.warning(f"BLOCKED OUTPUT: {reason} - Model: {model}")
+    metrics.inc('proxy_output_blocked_total', model=model, stream=str(stream).lower())
+    count_output_scan(**{'blocked_streams' if stream else 'blocked_bodies': 1})
+
+def allow_output(model, status, body):
+    """False (and logged) when a non-streamed completion must not reach the client"""
+    if not SCAN_OUTPUT or status != 200:
+        return True
+    is_safe, reason = check_output_body(body)
+    if not is_safe:
+        output_blocked(model, reason, stream=False)
+    return is_safe
+
+def check_output_body(body):
+    """
+    Check the generated text of a non-streamed completion.
+    Returns: (is_safe, reason_if_blocked)
+    """
+    if b'"content"' not in body:
+        return True, None
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return True, None
+    count_output_scan(bodies=1)
+    texts = [(choice.get('message') or {}).get('content') for choice in payload.get('choices') or []]
+    return check_content(' '.join(t for t in texts if isinstance(t, str)))
+
+def scan_output(events, model, slot=None):
+    """
+    Pass SSE events through the OutputScanner. Bij een match stopt de stream
+    met een error event; upstream wordt gesloten en het slot vrijgegeven.
+    Een event met een match tegen het einde van de tekst wacht op het volgende.
+    """
+    scanner = OutputScanner()
+    held = []
+    reason = None
+    try:
+        for event in events:
+            reason = scanner.feed_event(event)
+            if reason:
+                break
+            held.append(event)
+            if not scanner.pending:
+                yield from held
+                held = []
+        else:
+            reason = scanner.finish()
+            if not reason:
+                yield from held
+
+        if reason:
+            output_blocked(model, reason, stream=True)
+            if slot is not None:
+                slot.block()  # afgekapte run: niet in de service tijd, en geen client cancel
+            events.close()
+            yield OUTPUT_BLOCKED_EVENT
+    finally:
+        events.close()
+        count_output_scan(streams=1, events=scanner.events)
+
+def collect_state():
+    """Huidige stand van pool, scheduler en cache als metric samples"""
+    for backend in upstream.snapshot():
+        yield 'proxy_upstream_requests_total', {'backend': backend['url']}, backend['total_requests']
+        yield 'proxy_upstream_errors_total', {'backend': backend['url']}, backend['total_errors']
+    for model, queue in scheduler.snapshot().items():
+        yield 'proxy_active_requests', {'model': model}, queue['active']
+        for priority, depth in queue['queued'].items():
+            yield 'proxy_queue_depth', {'model': model, 'priority': priority}, depth
+        yield 'proxy_cancelled_requests_total', {'model': model}, queue['cancelled']
+        yield 'proxy_cancelled_seconds_saved_total', {'model': model}, queue['saved_seconds_estimate']
+    for event, count in dict(response_cache.counters).items():
+        yield 'proxy_response_cache_events_total', {'event': event}, count
+    affinity = upstream.affinity.snapshot()
+    for result in ('hits', 'misses', 'fallbacks'):
+        yield 'proxy_affinity_routes_total', {'result': result}, affinity[result]
+    for url, backend in warm_pool.snapshot()['backends'].items():
+        for entry in backend['models']:
+            yield 'proxy_resident_model_bytes', {'backend': url, 'model': entry['model']}, entry['size']
+
+metrics.register_collector(collect_state)
+
+def affinity_label(routed):
+    """
+    Affinity result as a metric label. 'off' is de baseline: de request is
+    niet op prefix gerouteerd (PREFIX_AFFINITY=0 of geen prefix), zodat er ook
+    met de feature uit een reeks is om hit/miss/fallback mee te vergelijken.
+    """
+    return routed or 'off'
+
+def record_generation(model, payload, seconds, affinity=None):
+    """
+    Token throughput of one completion. Ollama's eval_count/eval_duration
+    velden hebben voorrang; anders usage gedeeld door de gemeten tijd.
+    Met een affinity label (zie affinity_label) wordt Ollama's prompt
+    evaluatie ook per resultaat bijgehouden, om de winst van affinity te zien.
+    """
+    if payload.get('prompt_eval_duration'):
+        metrics.inc('proxy_prompt_eval_tokens_total', payload.get('prompt_eval_count', 0), model=model)
+        metrics.inc('proxy_prompt_eval_seconds_total', payload['prompt_eval_duration'] / 1e9, model=model)
+        if affinity is not None:
+            metrics.observe('proxy_prompt_eval_duration_seconds', payload['prompt_eval_duration'] / 1e9,
+                            model=model, affinity=affinity, source='ollama')
+
+    if payload.get('eval_duration'):
+        tokens = payload.get('eval_count', 0)
+        seconds = payload['eval_duration'] / 1e9
+    else:
+        tokens = (payload.get('usage') or {}).get('completion_tokens', 0)
+    if not tokens or seconds <= 0:
+        return
+
+    metrics.inc('proxy_eval_tokens_total', tokens, model=model)
+    metrics.inc('proxy_eval_seconds_total', seconds, model=model)
+    metrics.observe('proxy_tokens_per_second', tokens / seconds, model=model)
+    router.observe(model, tokens / seconds)
+
+def record_body(model, status, body, seconds, affinity=None):
+    """Generation stats from a non-streamed completion body"""
+    if status != 200 or (b'"usage"' not in body and b'"eval_count"' not in body):
+        return
+    try:
+        record_generation(model, json.loads(body), seconds, affinity)
+    except (ValueError, AttributeError):
+        pass
+
+def track_generation(events, model, affinity=None, sent=None):
+    """
+    Generation stats from the usage event of an upstream stream.
+    De /v1 endpoints van Ollama geven geen prompt_eval_duration; dan geldt de
+    upstream TTFT (vanaf sent, het versturen van de request) als prompt evaluatie.
+    """
+    start = time.perf_counter()
+    first = None
+    usage_event = None
+    for event in events:
+        if first is None:
+            first = time.perf_counter()
+        if b'"usage"' in event or b'"eval_count"' in event:
+            usage_event = event
+        yield event
+
+    payload = None
+    if usage_event is not None:
+        payload = usage_event.strip()
+        if payload.startswith(b'data:'):
+            payload = payload[len(b'data:'):]
+        try:
+            payload = json.loads(payload)
+            record_generation(model, payload, time.perf_counter() - (first or start), affinity)
+        except (ValueError, AttributeError):
+            payload = None
+    observe_prompt_eval_ttft(model, affinity, payload, sent, first)
+
+def observe_prompt_eval_ttft(model, affinity, payload, sent, first):
+    """Upstream TTFT as prompt evaluation, for streams without Ollama's prompt_eval_duration"""
+    if affinity is None or sent is None or first is None:
+        return
+    if isinstance(payload, dict) and payload.get('prompt_eval_duration'):
+        return  # al per affinity geteld in record_generation
+    metrics.observe('proxy_prompt_eval_duration_seconds', first - sent, model=model, affinity=affinity, source='ttft')
+
+def track_client(events, model, start, affinity=None):
+    """Time to first token and total duration as seen by one client"""
+    first = True
+    try:
+        for event in events:
+            if first:
+                first = False
+                ttft = time.perf_counter() - start
+                metrics.observe('proxy_time_to_first_token_seconds', ttft, model=model)
+                if affinity is not None:
+                    metrics.observe('proxy_affinity_time_to_first_token_seconds', ttft, affinity=affinity)
+            yield event
+    finally:
+        metrics.observe('proxy_request_duration_seconds', time.perf_counter() - start, model=model, stream='true')
+
+def model_available(model):
+    """Zonder modellijst (nog geen probe) geldt elk model als beschikbaar"""
+    ids = prober.model_ids
+    return not ids or model in ids or f'{model}:latest' in ids
+
+router.available = model_available
+
+def route_model(data):
+    """
+    Replace a virtual model in data by a concrete one.
+    Returns (served, virtual, reason); virtual en reason zijn None voor echte modellen.
+    """
+    virtual = data.get('model', '')
+    if not router.is_virtual(virtual):
+        return virtual, None, None
+    served, reason = router.route(data)
+    data['model'] = served
+    metrics.inc('proxy_model_routes_total', virtual=virtual, model=served, reason=reason)
+    return served, virtual, reason
+
+def routing_headers(served, virtual, reason):
+    if virtual is None:
+        return [('X-Served-Model', served)] if served else []
+    return [('X-Served-Model', served), ('X-Routed-From', virtual), ('X-Route-Reason', reason)]
+
+def filter_headers(headers):
+    """
+    Drop hop-by-hop headers (plus those named in Connection) from an upstream
+    response. Length and encoding are dropped too: requests already decoded
+    the body and Werkzeug frames it again. Date and Server zet de server van
+    de proxy zelf, anders krijgt de client ze dubbel.
+    """
+    connection_tokens = {
+        token.strip().lower()
+        for token in headers.get('Connection', '').split(',')
+        if token.strip()
+    }
+    dropped = HOP_BY_HOP_HEADERS | connection_tokens | {'content-length', 'content-encoding', 'date', 'server'}
+    return [(k, v) for k, v in headers.items() if k.lower() not in dropped]
+
+def iter_sse_events(response, slot=None, cancel=None):
+    """
+    Yield elk SSE event van upstream zodra het compleet is.
+    Er wordt nooit meer gebufferd dan één onvolledig event.
+    The scheduler slot (if any) is held until the stream ends; a stream that
+    stops early because the client left counts as a cancellation.
+    """
+    buffer = b''
+    upstream_ok = True
+    completed = False
+    try:
+        # chunk_size=None levert data zodra Ollama een chunk flusht
+        for chunk in response.iter_content(chunk_size=None):
+            buffer += chunk
+            while b'\n\n' in buffer:
+                event, buffer = buffer.split(b'\n\n', 1)
+                yield event + b'\n\n'
+        if buffer:
+            yield buffer
+        completed = True
+    except requests.RequestException:
+        if cancel is None or not cancel.cancelled:
+            upstream_ok = False
+            raise
+        logging.info("Client disconnected, upstream stream cancelled")
+    finally:
+        # Een client die afhaakt (GeneratorExit of cancel) is geen fout van de backend
+        upstream.release_response(response, ok=upstream_ok)
+        if slot is not None:
+            if completed or not upstream_ok:
+                slot.release()
+            else:
+                slot.cancel()
+
+def upstream_events(response, slot, model, cancel=None):
+    """SSE events from upstream, through the output guardrail when enabled"""
+    events = iter_sse_events(response, slot, cancel)
+    if SCAN_OUTPUT and response.status_code == 200:
+        events = scan_output(events, model, slot)
+    return track_generation(events, model, affinity_label(response.affinity), response.sent)
+
+def stream_response(response, slot, model, start, cancel, watch):
+    """Wrap a streaming upstream response as a chunked SSE passthrough"""
+    events = upstream_events(response, slot, model, cancel)
+    return sse_response(response.status_code, filter_headers(response.headers),
+                        closing(track_client(events, model, start, affinity_label(response.affinity)), watch.stop))
+
+def closing(events, on_close):
+    """Call on_close once the event stream ends, fails or is closed by the client"""
+    try:
+        yield from events
+    finally:
+        on_close()
+
+def watch_client(on_disconnect):
+    """
+    Call on_disconnect as soon as the current client hangs up.
+    Werkzeug en gunicorn geven de client socket door in de WSGI environ;
+    zonder socket wordt er niets bewaakt.
+    """
+    sock = request.environ.get('werkzeug.socket') or request.environ.get('gunicorn.socket')
+    return disconnects.watch(sock, on_disconnect)
+
+def leave_flight(flight, member):
+    """Drop a client from a flight; the last one to leave aborts the upstream call"""
+    if inflight.leave(flight, member) and flight.cancel is not None:
+        logging.info("All coalesced clients disconnected, cancelling upstream call")
+        flight.cancel.cancel()
+
+def sse_response(status, headers, events, extra_headers=()):
+    """Chunked SSE response from an iterator of events"""
+    if status != 200:
+        # Foutmeldingen van Ollama zijn gewone JSON, geen event stream
+        return Response(events, status=status, headers=headers + list(extra_headers))
+
+    headers = [(k, v) for k, v in headers if k.lower() != 'content-type']
+    headers += [
+        ('Cache-Control', 'no-cache'),
+        ('X-Accel-Buffering', 'no'),  # nginx e.d. niet laten bufferen
+    ]
+    headers += list(extra_headers)
+    return Response(
+        stream_with_context(events),
+        status=200,
+        headers=headers,
+        mimetype='text/event-stream',
+    )
+
+def request_priority(headers):
+    """Priority class from the X-Priority header, or batch for batch API keys"""
+    priority = headers.get('X-Priority', '').strip().lower()
+    if priority in ('interactive', 'batch'):
+        return priority
+
+    auth = headers.get('Authorization', '')
+    if auth.startswith('Bearer ') and auth[len('Bearer '):].strip() in BATCH_API_KEYS:
+        return 'batch'
+    return 'interactive'
+
+BLOCKED_ERROR = {
+    'error': {
+        'message': 'Content blocked by guardrail proxy',
+        'type': 'content_policy_violation',
+        'code': 'content_blocked'
+    }
+}
+
+OUTPUT_BLOCKED_ERROR = {
+    'error': {
+        'message': 'Generated content blocked by guardrail proxy',
+        'type': 'content_policy_violation',
+        'code': 'output_blocked'
+    }
+}
+
+# Afsluiting van een geblokkeerde stream: error event zoals OpenAI, dan [DONE]
+OUTPUT_BLOCKED_EVENT = b'data: ' + json.dumps(OUTPUT_BLOCKED_ERROR).encode('utf-8') + b'\n\ndata: [DONE]\n\n'
+
+def queue_full_error(e):
+    return {
+        'error': {
+            'message': str(e),
+            'type': 'rate_limit_exceeded',
+            'code': 'queue_full'
+        }
+    }
+
+def cache_mode(headers):
+    """
+    Cache-Control van de client: no-store slaat de cache volledig over,
+    no-cache haalt een vers antwoord op en bewaart dat opnieuw.
+    """
+    directives = headers.get('Cache-Control', '').lower()
+    if 'no-store' in directives:
+        return 'off'
+    if 'no-cache' in directives:
+        return 'refresh'
+    return 'use'
+
+def forward_completion(data, priority, cancel=None):
+    """
+    Wait for a scheduler slot and send the request upstream.
+    Returns (response, slot); de caller geeft het slot weer vrij.
+    """
+    slot = scheduler.acquire(data.get('model', ''), priority)
+    metrics.observe('proxy_queue_wait_seconds', slot.waited, model=slot.model)
+    try:
+        # Forward to the least-loaded Ollama backend
+        # Zelfde gespreksbegin -> zelfde backend, zodat Ollama's prompt cache raakt
+        sent = time.perf_counter()
+        response = upstream.post('/v1/chat/completions', json=data, stream=bool(data.get('stream')),
+                                 cancel=cancel, affinity=prefix_key(data) if PREFIX_AFFINITY else None)
+    except RequestCancelled:
+        slot.cancel()
+        raise
+    except Exception:
+        slot.release()
+        raise
+    response.sent = sent  # begin van de upstream TTFT
+    return response, slot
+
+def read_body(response, slot):
+    """Read a non-streamed upstream body and free its slot"""
+    try:
+        return response.content
+    finally:
+        slot.release()
+
+def lead_flight(flight, data, priority, key, start):
+    """
+    Run the upstream call for a coalesced flight and publish the result.
+    Fouten gaan naar alle wachtenden en worden hier opnieuw geraised.
+    """
+    try:
+        response, slot = forward_completion(data, priority, flight.cancel)
+        if not data.get('stream'):
+            body = read_body(response, slot)
+            record_body(slot.model, response.status_code, body, time.perf_counter() - start,
+                        affinity_label(response.affinity))
+    except Exception as e:
+        inflight.forget(flight)
+        flight.finish(e)
+        raise
+
+    if data.get('stream'):
+        flight.start(response.status_code, filter_headers(response.headers))
+        # Upstream lezen in een eigen thread, zodat volgers niet afhangen
+        # van de verbinding van de client die de call startte
+        threading.Thread(target=pump_flight, args=(flight, response, slot, data.get('model', '')),
+                         daemon=True).start()
+        return
+
+    if not allow_output(data.get('model', ''), response.status_code, body):
+        flight.start(403, [('Content-Type', 'application/json')])
+        body = json.dumps(OUTPUT_BLOCKED_ERROR).encode('utf-8')
+    else:
+        flight.start(response.status_code, filter_headers(response.headers))
+        if key is not None and response.status_code == 200:
+            response_cache.put(key, body, response.headers.get('Content-Type', 'application/json'),
+                               data.get('model', ''))
+    flight.publish(body)
+    inflight.forget(flight)
+    flight.finish()
+
+def pump_flight(flight, response, slot, model):
+    """Relay a streamed upstream response into a flight"""
+    error = None
+    try:
+        for event in upstream_events(response, slot, model, flight.cancel):
+            flight.publish(event)
+    except Exception as e:
+        logging.error(f"Upstream stream failed: {str(e)}")
+        error = e
+    finally:
+        inflight.forget(flight)
+        flight.finish(error)
+
 @app.route('/v1/chat/completions', methods=['POST'])
 def proxy_chat_completions():
     """Proxy voor Ollama chat completions API"""
+    start = time.perf_counter()
     try:
         data = request.json
+        model = data.get('model', '')
         
-        # Extract user content
-        messages = data.get('messages', [])
-        user_content = ' '.join([
-            m.get('content', '') 
-            for m in messages 
-            if m.get('role') == 'user'
-        ])
-        
-        # Check content
-        is_safe, reason = check_content(user_content)
+        # Check user content (alleen nieuwe berichten worden echt gescand)
+        user_content, is_safe, reason = check_messages(data.get('messages', []))
+        metrics.observe('proxy_content_check_seconds', time.perf_counter() - start)
         log_request(user_content, blocked=not is_safe, reason=reason)
         
         if not is_safe:
-            return jsonify({
-                'error': {
-                    'message': 'Content blocked by guardrail proxy',
-                    'type': 'content_policy_violation',
-                    'code': 'content_blocked'
-                }
-            }), 403
+            return jsonify(BLOCKED_ERROR), 403
         
-        # Forward to Ollama
-        ollama_url = 'http://localhost:11434/v1/chat/completions'
-        response = requests.post(ollama_url, json=data, stream=data.get('stream', False))
+        # Virtueel model ("auto") naar een echt model; de headers melden welk
+        model, virtual, reason = route_model(data)
+        g.routing_headers = routing_headers(model, virtual, reason)
+        warm_pool.touch(model)
         
-        if data.get('stream'):
-            # Pass through streaming response
-            return response.raw.read(), response.status_code, response.headers.items()
-        else:
-            return response.json(), response.status_code
+        # Identieke deterministische requests uit de cache bedienen
+        key = None
+        cache_status = None
+        if is_deterministic(data) and not data.get('stream'):
+            mode = cache_mode(request.headers)
+            if mode == 'off':
+                response_cache.count('bypassed')
+                cache_status = 'BYPASS'
+            else:
+                key = cache_key(data)
+                if mode == 'refresh':
+                    response_cache.count('bypassed')
+                    cache_status = 'BYPASS'
+                else:
+                    # De miss wordt pas geteld als duidelijk is of deze request een eigen call doet
+                    cached = response_cache.get(key, count_miss=False)
+                    if cached is not None:
+                        metrics.observe('proxy_request_duration_seconds', time.perf_counter() - start,
+                                        model=model, stream='false')
+                        return Response(cached.body, 200, content_type=cached.content_type,
+                                        headers={'X-Cache': 'HIT'})
+                    cache_status = 'MISS'
+        
+        extra_headers = [('X-Cache', cache_status)] if cache_status else []
+        stream = bool(data.get('stream'))
+        
+        if is_deterministic(data):
+            # Identieke gelijktijdige requests delen één upstream call; die
+            # wordt pas afgebroken als alle wachtende clients weg zijn
+            member = object()
+            flight, leader = inflight.join(f"{cache_key(data)}:{'stream' if stream else 'full'}", member)
+            if cache_status == 'MISS':
+                # Volgers wachten op de call van de leader; dat is geen eigen miss
+                response_cache.count('misses' if leader else 'coalesced')
+            if leader:
+                flight.cancel = CancelToken()
+            watch = watch_client(lambda: leave_flight(flight, member))
+            
+            def done():
+                watch.stop()
+                leave_flight(flight, member)
+            
+            try:
+                if leader:
+                    lead_flight(flight, data, request_priority(request.headers), key, start)
+                else:
+                    flight.wait_started()
+                    extra_headers.append(('X-Coalesced', 'true'))
+            except Exception:
+                done()
+                raise
+            
+            if stream:
+                return sse_response(flight.status, flight.headers,
+                                    closing(track_client(flight.follow(), model, start), done), extra_headers)
+            try:
+                body = flight.body()
+            finally:
+                done()
+            metrics.observe('proxy_request_duration_seconds', time.perf_counter() - start,
+                            model=model, stream='false')
+            return Response(body, flight.status, headers=flight.headers + extra_headers)
+        
+        # Haakt de client af, dan wordt de upstream request meteen afgebroken
+        cancel = CancelToken()
+        watch = watch_client(cancel.cancel)
+        try:
+            response, slot = forward_completion(data, request_priority(request.headers), cancel)
+        except Exception:
+            watch.stop()
+            raise
+        if stream:
+            # Stream elk event door zodra Ollama het uitzendt; slot vrij aan het einde
+            return stream_response(response, slot, model, start, cancel, watch)
+        
+        watch.stop()
+        body = read_body(response, slot)
+        elapsed = time.perf_counter() - start
+        record_body(model, response.status_code, body, elapsed, affinity_label(response.affinity))
+        metrics.observe('proxy_request_duration_seconds', elapsed, model=model, stream='false')
+        if not allow_output(model, response.status_code, body):
+            return jsonify(OUTPUT_BLOCKED_ERROR), 403
+        return Response(body, response.status_code, headers=filter_headers(response.headers) + extra_headers)
     
+    except QueueFull as e:
+        logging.warning(f"Rejected: {str(e)}")
+        return jsonify(queue_full_error(e)), 429, {'Retry-After': str(e.retry_after)}
+    except RequestCancelled as e:
+        # Niemand luistert meer; 499 zoals nginx voor "client closed request"
+        logging.info(f"Cancelled: {str(e)}")
+        return Response(status=499)
+    except NoBackendAvailable as e:
+        logging.error(f"Proxy error: {str(e)}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logging.error(f"Proxy error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/v1/models', methods=['GET'])
 def proxy_models():
-    """Proxy voor Ollama models API"""
-    try:
-        response = requests.get('http://localhost:11434/v1/models')
-        return response.json(), response.status_code
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    """Samengevoegde modellijst van alle backends, uit de prober snapshot"""
+    if prober.age() is None:
+        # Eerste request voor de eerste probe klaar is
+        prober.refresh()
+
+    snapshot = prober.snapshot()
+    headers = {'X-Snapshot-Age': str(snapshot['snapshot_age_seconds'])}
+    if not snapshot['connected'] and not snapshot['models']:
+        return jsonify({'error': 'No healthy Ollama backend available'}), 503, headers
+    return Response(prober.models_body, 200, mimetype='application/json', headers=headers)
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
+    snapshot = prober.snapshot()
     return jsonify({
         'status': 'healthy',
-        'ollama_connected': check_ollama_connection(),
+        'ollama_connected': snapshot['connected'],
+        'snapshot_age_seconds': snapshot['snapshot_age_seconds'],
+        'backends': upstream.snapshot(),
+        'residency': warm_pool.snapshot(),
         'requests_logged': len(REQUEST_LOG)
     })
 
 @app.route('/stats', methods=['GET'])
 def stats():
     """Get proxy statistics"""
-    blocked_count = sum(1 for log in REQUEST_LOG if log['blocked'])
     return jsonify({
-        'total_requests': len(REQUEST_LOG),
-        'blocked_requests': blocked_count,
-        'allowed_requests': len(REQUEST_LOG) - blocked_count,
-        'recent_logs': REQUEST_LOG[-10:]  # Last 10
+        **REQUEST_LOG.counts(),
+        'audit_entries_dropped': REQUEST_LOG.dropped,
+        'queue_depth': scheduler.queue_depth(),
+        'scheduler': scheduler.snapshot(),
+        'response_cache': response_cache.snapshot(),
+        'coalescing': inflight.snapshot(),
+        'affinity': upstream.affinity.snapshot(),
+        'routing': router.snapshot(),
+        'cancellations': {**scheduler.cancellations(), 'client_disconnects': disconnects.disconnects},
+        'output_scan': {'enabled': SCAN_OUTPUT, **OUTPUT_SCAN_STATS},
+        'recent_logs': REQUEST_LOG.recent(10)  # Last 10
     })
 
-def check_ollama_connection():
-    """Check if Ollama is running"""
+@app.route('/cache', methods=['DELETE'])
+def invalidate_cache():
+    """Invalidate cached responses, all of them or ?model=... only"""
+    removed = response_cache.invalidate(request.args.get('model'))
+    return jsonify({'invalidated': removed})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.after_request
+def count_response(response):
+    metrics.inc('proxy_http_requests_total', endpoint=request.endpoint or 'unknown',
+                status=str(response.status_code))
+    for name, value in g.get('routing_headers', ()):
+        response.headers[name] = value
+    return response
+
+@app.route('/audit', methods=['GET'])
+def audit():
+    """
+    Query the on-disk audit trail for a time window.
+    ?since=...&until=... als ISO timestamps, ?limit=N (max 10000)
+    """
     try:
-        response = requests.get('http://localhost:11434/v1/models', timeout=2)
-        return response.status_code == 200
-    except:
-        return False
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = datetime.fromisoformat(since) if since else None
+        until = datetime.fromisoformat(until) if until else None
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+    entries = REQUEST_LOG.query(since, until, limit)
+    return jsonify({'count': len(entries), 'entries': entries})
+
+def check_ollama_connection():
+    """Check if at least one Ollama backend is running"""
+    return upstream.any_healthy()
 
 if __name__ == '__main__':
     print("="*60)
     print("Guardrail Proxy Starting...")
     print("="*60)
-    print("Listening on: http://localhost:11435")
-    print("Forwarding to: http://localhost:11434 (Ollama)")
+    print(f"Listening on: http://localhost:{PROXY_PORT}")
+    print(f"Forwarding to: {', '.join(OLLAMA_BACKENDS)} (Ollama)")
     print("")
     print("Minimal guardrails active:")
     for pattern in ILLEGAL_PATTERNS:
@@ -152,8 +968,8 @@ if __name__ == '__main__':
     if check_ollama_connection():
         print("✓ Ollama is running")
     else:
-        print("⚠ Warning: Ollama not detected on port 11434")
+        print("⚠ Warning: no Ollama backend detected")
         print("  Start Ollama with: ollama serve")
     
     print("="*60)
-    app.run(host='0.0.0.0', port=11435, debug=False)
+    app.run(host='0.0.0.0', port=PROXY_PORT, debug=False)
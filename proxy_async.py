@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Asyncio serving mode voor de guardrail proxy
+Zelfde guardrail, audit log, cache, scheduler en backends als proxy.py, maar op
+aiohttp: de request body gaat na de content check als ruwe bytes naar Ollama
+(nooit opnieuw ge-encodeerd) en streaming verbindingen delen één event loop in
+plaats van elk een thread. Request coalescing zit alleen in de threaded server.
+Haakt een client af, dan annuleert aiohttp de handler en wordt de upstream
+verbinding meteen gesloten.
+
+De request body wordt wel in zijn geheel gedecodeerd, bewust: een parse die
+alleen model, stream en messages[].role/content uitleest en de rest overslaat
+draait in Python en was op elke gemeten body trager dan json/orjson in C op
+de hele body (ook met base64 images of tools). Cache key, prefix affinity en
+virtuele modellen hebben bovendien meer velden nodig.
+
+Start met: python proxy_async.py
+"""
+
+import json
+import time
+import asyncio
+import logging
+import aiohttp
+from aiohttp import web
+
+try:
+    # Snelle JSON parser als die geïnstalleerd is
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+import proxy
+from proxy import (
+    PROXY_PORT, BLOCKED_ERROR, OUTPUT_BLOCKED_ERROR, OUTPUT_BLOCKED_EVENT, SCAN_OUTPUT, OutputScanner,
+    check_messages, log_request, filter_headers, cache_mode, request_priority, queue_full_error,
+    record_body, record_generation, observe_prompt_eval_ttft, affinity_label, allow_output, output_blocked,
+    count_output_scan, route_model, routing_headers,
+    metrics, response_cache, scheduler, upstream, warm_pool,
+)
+from response_cache import cache_key, is_deterministic
+from scheduler import QueueFull
+from upstream import NoBackendAvailable, POOL_SIZE, CONNECT_TIMEOUT
+from affinity import PREFIX_AFFINITY, prefix_key
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+async def post_upstream(session, body: bytes, affinity: bytes = None):
+    """
+    Async counterpart of BackendPool.request: same backend choice, prefix
+    affinity and failover, maar de body wordt ongewijzigd doorgestuurd.
+    Returns (backend, response, affinity_result); de caller geeft de backend vrij.
+    """
+    tried = []
+    while True:
+        backend, routed = upstream.route(tried, affinity)
+        try:
+            response = await session.post(
+                f'{backend.url}/v1/chat/completions', data=body, headers=JSON_HEADERS
+            )
+        except aiohttp.ClientConnectorError:
+            # Verbinding niet gelukt, dus veilig om een andere backend te proberen
+            upstream.release(backend, ok=False)
+            tried.append(backend)
+            if len(tried) >= len(upstream.backends):
+                raise
+            continue
+        except asyncio.CancelledError:
+            # Client is weg; geen fout van de backend
+            upstream.release(backend)
+            raise
+        except Exception:
+            upstream.release(backend, ok=False)
+            raise
+        return backend, response, routed
+
+
+async def iter_sse_events(response):
+    """Yield each complete SSE event as soon as upstream sends it"""
+    buffer = b''
+    async for chunk in response.content.iter_any():
+        buffer += chunk
+        while b'\n\n' in buffer:
+            event, buffer = buffer.split(b'\n\n', 1)
+            yield event + b'\n\n'
+    if buffer:
+        yield buffer
+
+
+def json_error(payload: dict, status: int, headers: dict = None) -> web.Response:
+    return web.Response(body=json.dumps(payload), status=status,
+                        content_type='application/json', headers=headers)
+
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    """Async proxy voor Ollama chat completions API"""
+    start = time.perf_counter()
+    body = await request.read()
+    try:
+        data = json_loads(body)  # hele body, zie de module docstring
+    except ValueError as e:
+        return json_error({'error': f'Invalid JSON: {e}'}, 400)
+
+    model = data.get('model', '')
+    stream = bool(data.get('stream'))
+
+    # Check user content (alleen nieuwe berichten worden echt gescand)
+    user_content, is_safe, reason = check_messages(data.get('messages', []))
+    metrics.observe('proxy_content_check_seconds', time.perf_counter() - start)
+    log_request(user_content, blocked=not is_safe, reason=reason)
+    if not is_safe:
+        return json_error(BLOCKED_ERROR, 403)
+
+    # Virtueel model: alleen dan moet de body opnieuw geserialiseerd worden
+    model, virtual, route_reason = route_model(data)
+    if virtual is not None:
+        body = json.dumps(data).encode('utf-8')
+    request['routing_headers'] = routing_headers(model, virtual, route_reason)
+    warm_pool.touch(model)
+
+    key = None
+    headers = {}
+    if is_deterministic(data) and not stream:
+        mode = cache_mode(request.headers)
+        if mode == 'use':
+            key = cache_key(data)
+            cached = response_cache.get(key)
+            if cached is not None:
+                metrics.observe('proxy_request_duration_seconds', time.perf_counter() - start,
+                                model=model, stream='false')
+                return web.Response(body=cached.body, status=200,
+                                    headers={'Content-Type': cached.content_type, 'X-Cache': 'HIT'})
+            headers['X-Cache'] = 'MISS'
+        else:
+            if mode == 'refresh':
+                key = cache_key(data)
+            response_cache.count('bypassed')
+            headers['X-Cache'] = 'BYPASS'
+
+    try:
+        slot = await scheduler.acquire_async(model, request_priority(request.headers))
+    except QueueFull as e:
+        logging.warning(f"Rejected: {str(e)}")
+        return json_error(queue_full_error(e), 429, {'Retry-After': str(e.retry_after)})
+    metrics.observe('proxy_queue_wait_seconds', slot.waited, model=model)
+
+    sent = time.perf_counter()
+    try:
+        backend, response, routed = await post_upstream(request.app['session'], body,
+                                                         prefix_key(data) if PREFIX_AFFINITY else None)
+    except asyncio.CancelledError:
+        slot.cancel()
+        raise
+    except NoBackendAvailable as e:
+        slot.release()
+        return json_error({'error': str(e)}, 503)
+    except Exception as e:
+        slot.release()
+        logging.error(f"Proxy error: {str(e)}")
+        return json_error({'error': str(e)}, 500)
+    routed = affinity_label(routed)
+
+    if not stream or response.status != 200:
+        try:
+            payload = await response.read()
+        except asyncio.CancelledError:
+            response.close()
+            upstream.release(backend)
+            slot.cancel()
+            raise
+        except Exception:
+            response.close()
+            upstream.release(backend, ok=False)
+            slot.release()
+            raise
+        response.release()
+        upstream.release(backend, ok=response.status < 500)
+        slot.release()
+
+        elapsed = time.perf_counter() - start
+        record_body(model, response.status, payload, elapsed, routed)
+        metrics.observe('proxy_request_duration_seconds', elapsed, model=model, stream=str(stream).lower())
+        if not allow_output(model, response.status, payload):
+            return json_error(OUTPUT_BLOCKED_ERROR, 403)
+        if key is not None and response.status == 200:
+            response_cache.put(key, payload, response.headers.get('Content-Type', 'application/json'), model)
+        out = web.Response(body=payload, status=response.status)
+        out.headers.extend(filter_headers(response.headers))
+        out.headers.update(headers)
+        return out
+
+    out = web.StreamResponse(status=200)
+    out.headers.extend((k, v) for k, v in filter_headers(response.headers) if k.lower() != 'content-type')
+    out.headers['Content-Type'] = 'text/event-stream; charset=utf-8'
+    out.headers['Cache-Control'] = 'no-cache'
+    out.headers['X-Accel-Buffering'] = 'no'
+    out.headers.update(request['routing_headers'])
+
+    completed = False
+    upstream_ok = True
+    first = None
+    usage_event = None
+    scanner = OutputScanner() if SCAN_OUTPUT else None
+    held = []
+    reason = None
+    try:
+        await out.prepare(request)
+        async for event in iter_sse_events(response):
+            if first is None:
+                first = time.perf_counter()
+                metrics.observe('proxy_time_to_first_token_seconds', first - start, model=model)
+                metrics.observe('proxy_affinity_time_to_first_token_seconds', first - start, affinity=routed)
+            if b'"usage"' in event or b'"eval_count"' in event:
+                usage_event = event
+            if scanner is None:
+                await out.write(event)
+                continue
+
+            # Output guardrail, zie proxy.scan_output
+            reason = scanner.feed_event(event)
+            if reason:
+                break
+            held.append(event)
+            if not scanner.pending:
+                await out.write(b''.join(held))
+                held = []
+        else:
+            reason = scanner and scanner.finish()
+            if held and not reason:
+                await out.write(b''.join(held))
+
+        if reason:
+            response.close()
+            output_blocked(model, reason, stream=True)
+            await out.write(OUTPUT_BLOCKED_EVENT)
+        completed = True
+    except aiohttp.ClientError as e:
+        upstream_ok = False
+        logging.error(f"Upstream stream failed: {str(e)}")
+    except ConnectionResetError:
+        logging.info("Client disconnected during stream")
+    finally:
+        response.close()
+        # Een client die afhaakt (reset of geannuleerde handler) is geen fout van de backend
+        upstream.release(backend, ok=upstream_ok)
+        if reason:
+            slot.block()  # zie proxy.scan_output
+        elif completed or not upstream_ok:
+            slot.release()
+        else:
+            slot.cancel()
+        if scanner is not None:
+            count_output_scan(streams=1, events=scanner.events)
+        end = time.perf_counter()
+        metrics.observe('proxy_request_duration_seconds', end - start, model=model, stream='true')
+
+    payload = None
+    if usage_event is not None:
+        try:
+            payload = json_loads(usage_event.strip()[len(b'data:'):])
+            record_generation(model, payload, end - (first or start), routed)
+        except (ValueError, AttributeError):
+            payload = None
+    observe_prompt_eval_ttft(model, routed, payload, sent, first)
+    if completed:
+        await out.write_eof()
+    return out
+
+
+def call_flask_view(view, path: str, method: str, query_string: str):
+    """Run a Flask view in a request context; returns (status, body, headers)"""
+    with proxy.app.test_request_context(path, method=method, query_string=query_string):
+        response = proxy.app.make_response(view())
+    return (response.status_code, response.get_data(),
+            {k: v for k, v in response.headers.items() if k.lower() != 'content-length'})
+
+
+def flask_view(view):
+    """
+    Serve a Flask view (stats, health, ...) from the async server.
+    Niet elke view is goedkoop: /v1/models doet vóór de eerste probe een
+    blocking prober.refresh() naar alle backends, /audit leest segmenten van
+    disk en DELETE /cache verwijdert bestanden. Daarom draait de view in de
+    default executor; op de event loop zou hij elke lopende stream stilzetten.
+    """
+    async def handler(request: web.Request) -> web.Response:
+        status, body, headers = await asyncio.get_running_loop().run_in_executor(
+            None, call_flask_view, view, request.path, request.method, request.query_string)
+        return web.Response(body=body, status=status, headers=headers)
+    return handler
+
+
+@web.middleware
+async def count_response(request: web.Request, handler):
+    response = await handler(request)
+    metrics.inc('proxy_http_requests_total', endpoint=request.match_info.route.name or 'unknown',
+                status=str(response.status))
+    if not response.prepared:
+        response.headers.update(request.get('routing_headers', ()))
+    return response
+
+
+async def open_session(app: web.Application) -> None:
+    connector = aiohttp.TCPConnector(limit=0, limit_per_host=POOL_SIZE, keepalive_timeout=60)
+    app['session'] = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT),
+    )
+
+
+async def close_session(app: web.Application) -> None:
+    await app['session'].close()
+
+
+def build_app() -> web.Application:
+    app = web.Application(middlewares=[count_response], client_max_size=512 * 1024 * 1024)
+    app.router.add_post('/v1/chat/completions', chat_completions, name='proxy_chat_completions')
+    app.router.add_get('/v1/models', flask_view(proxy.proxy_models), name='proxy_models')
+    app.router.add_get('/health', flask_view(proxy.health), name='health')
+    app.router.add_get('/stats', flask_view(proxy.stats), name='stats')
+    app.router.add_get('/metrics', flask_view(proxy.prometheus_metrics), name='prometheus_metrics')
+    app.router.add_get('/audit', flask_view(proxy.audit), name='audit')
+    app.router.add_delete('/cache', flask_view(proxy.invalidate_cache), name='invalidate_cache')
+    app.on_startup.append(open_session)
+    app.on_cleanup.append(close_session)
+    return app
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Guardrail Proxy (async) Starting...")
+    print("=" * 60)
+    print(f"Listening on: http://localhost:{PROXY_PORT}")
+    print(f"Forwarding to: {', '.join(b.url for b in upstream.backends)} (Ollama)")
+    print("=" * 60)
+    web.run_app(build_app(), host='0.0.0.0', port=PROXY_PORT, handler_cancellation=True)
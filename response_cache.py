@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Response cache voor de guardrail proxy
+Niet-gestreamde deterministische chat completions (temperature 0 of vaste
+seed) worden bewaard in een LRU met TTL, optioneel met een disk tier die
+herstarts overleeft. De disk tier heeft zijn eigen limieten: verlopen en (boven
+de limiet) oudste bestanden worden op de achtergrond opgeruimd.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+RESPONSE_CACHE_ENTRIES = int(os.environ.get('RESPONSE_CACHE_ENTRIES', 1024))
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', 64 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 3600))  # seconden
+RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR', '')  # leeg = geen disk tier
+RESPONSE_CACHE_DISK_ENTRIES = int(os.environ.get('RESPONSE_CACHE_DISK_ENTRIES', 16384))
+RESPONSE_CACHE_DISK_BYTES = int(os.environ.get('RESPONSE_CACHE_DISK_BYTES', 512 * 1024 * 1024))
+DISK_SWEEP_INTERVAL = 60  # seconden; verlopen bestanden opruimen, ook zonder limiet te raken
+
+# Request velden die de output beïnvloeden en dus in de cache key horen
+KEY_FIELDS = (
+    'model', 'messages', 'temperature', 'top_p', 'top_k', 'seed', 'max_tokens',
+    'stop', 'presence_penalty', 'frequency_penalty', 'repeat_penalty', 'logit_bias',
+    'n', 'response_format', 'tools', 'tool_choice', 'options',
+)
+
+
+def is_deterministic(data: dict) -> bool:
+    """Temperature 0 of een vaste seed: dezelfde request geeft dezelfde output"""
+    return data.get('temperature') == 0 or data.get('seed') is not None
+
+
+def cache_key(data: dict) -> str:
+    """Canonical hash of the output-affecting request fields"""
+    canonical = json.dumps(
+        {field: data[field] for field in KEY_FIELDS if field in data},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class CachedResponse:
+    __slots__ = ('body', 'content_type', 'model', 'expires')
+
+    def __init__(self, body: bytes, content_type: str, model: str, expires: float):
+        self.body = body
+        self.content_type = content_type
+        self.model = model
+        self.expires = expires  # wall clock, zodat het ook op disk geldig blijft
+
+
+class ResponseCache:
+    """
+    In-memory LRU with TTL plus an optional disk tier.
+    De disk tier is FIFO op schrijftijd (mtime): een sweep over de directory
+    zelf ruimt op, dus ook als meerdere workers dezelfde directory delen.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_ENTRIES, max_bytes: int = RESPONSE_CACHE_BYTES,
+                 ttl: float = RESPONSE_CACHE_TTL, directory: str = RESPONSE_CACHE_DIR,
+                 disk_entries: int = RESPONSE_CACHE_DISK_ENTRIES, disk_bytes: int = RESPONSE_CACHE_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.disk_max_entries = disk_entries
+        self.disk_max_bytes = disk_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            'hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0, 'bypassed': 0,
+            'stores': 0, 'evictions': 0, 'disk_evictions': 0, 'expired': 0, 'invalidated': 0,
+        }
+        # Schatting van de disk tier: exact na elke sweep, daarna opgeteld per write
+        self.disk_count = 0
+        self.disk_size = 0
+        self.last_sweep = 0.0
+        self.sweeping = False
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self.prune_disk()
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get(self, key: str, count_miss: bool = True):
+        """
+        Cached entry or None. count_miss=False laat de caller een miss zelf
+        tellen, bv. als 'coalesced' wanneer de request bij een lopende call aansluit.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry.expires > now:
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry
+                self._remove(key)
+                self.counters['expired'] += 1
+
+        entry = self._disk_get(key, now)
+        with self.lock:
+            if entry is None:
+                if count_miss:
+                    self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self._insert(key, entry)
+        return entry
+
+    def put(self, key: str, body: bytes, content_type: str, model: str) -> None:
+        if len(body) > self.max_bytes:
+            return
+        entry = CachedResponse(body, content_type, model, time.time() + self.ttl)
+        with self.lock:
+            self._insert(key, entry)
+            self.counters['stores'] += 1
+        self._disk_put(key, entry)
+
+    def invalidate(self, model: str = None) -> int:
+        """Drop all entries, or only those for one model. Returns the number removed."""
+        removed = 0
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if model is None or e.model == model]:
+                self._remove(key)
+                removed += 1
+
+        if self.directory:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    if model is not None:
+                        with open(path, encoding='utf-8') as f:
+                            if json.load(f).get('model') != model:
+                                continue
+                    os.remove(path)
+                    removed += 1
+                except (OSError, ValueError):
+                    continue
+
+        with self.lock:
+            self.counters['invalidated'] += removed
+        return removed
+
+    def _insert(self, key: str, entry: CachedResponse) -> None:
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = entry
+        self.size += len(entry.body)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.counters['evictions'] += 1
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        self.size -= len(entry.body)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _disk_get(self, key: str, now: float):
+        if not self.directory:
+            return None
+        try:
+            with open(self._disk_path(key), encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stored['expires'] <= now:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+            return None
+        return CachedResponse(stored['body'].encode('utf-8'), stored['content_type'],
+                              stored['model'], stored['expires'])
+
+    def _disk_put(self, key: str, entry: CachedResponse) -> None:
+        if not self.directory:
+            return
+        path = self._disk_path(key)
+        try:
+            # Eerst naar een tijdelijk bestand, zodat lezers nooit een half bestand zien
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+                json.dump({
+                    'body': entry.body.decode('utf-8'),
+                    'content_type': entry.content_type,
+                    'model': entry.model,
+                    'expires': entry.expires,
+                }, f)
+                size = f.tell()
+            os.replace(f'{path}.tmp', path)
+        except (OSError, UnicodeDecodeError) as e:
+            logging.warning(f"Response cache disk write failed: {e}")
+            return
+
+        now = time.time()
+        with self.lock:
+            self.disk_count += 1
+            self.disk_size += size
+            due = (self.disk_count > self.disk_max_entries or self.disk_size > self.disk_max_bytes or
+                   now - self.last_sweep >= DISK_SWEEP_INTERVAL)
+            if not due or self.sweeping:
+                return
+            self.sweeping = True
+        # Opruimen buiten de request: de response hoeft niet op de directory scan te wachten
+        threading.Thread(target=self.prune_disk, name='response-cache-prune', daemon=True).start()
+
+    def prune_disk(self) -> int:
+        """
+        Remove expired disk entries, then the oldest ones until the disk tier
+        fits its entry and byte limits. Returns the number of files removed.
+        """
+        now = time.time()
+        files = []
+        try:
+            with os.scandir(self.directory) as items:
+                for item in items:
+                    if not item.name.endswith('.json'):
+                        continue  # o.a. .tmp bestanden die nog geschreven worden
+                    try:
+                        stat = item.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, item.path))
+        except OSError as e:
+            logging.warning(f"Response cache disk sweep failed: {e}")
+            with self.lock:
+                self.sweeping = False
+                self.last_sweep = now
+            return 0
+
+        # Oudste eerst; verlopen bestanden (mtime + ttl) staan dus vooraan
+        files.sort()
+        count = len(files)
+        size = sum(file_size for _, file_size, _ in files)
+        removed = 0
+        for mtime, file_size, path in files:
+            if mtime + self.ttl > now and count <= self.disk_max_entries and size <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass  # al weg, bv. door een andere worker
+            count -= 1
+            size -= file_size
+
+        with self.lock:
+            self.disk_count = count
+            self.disk_size = size
+            self.counters['disk_evictions'] += removed
+            self.sweeping = False
+            self.last_sweep = now
+        return removed
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                **self.counters,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'disk_tier': bool(self.directory),
+                'disk_entries': self.disk_count,
+                'disk_bytes': self.disk_size,
+            }
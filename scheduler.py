@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Admission control voor de guardrail proxy
+Per-model concurrency limits met een begrensde wachtrij en prioriteitsklassen,
+zodat bursts in de proxy wachten in plaats van in Ollama te time-outen.
+"""
+
+import os
+import math
+import asyncio
+import time
+import heapq
+import itertools
+import threading
+
+# Lagere waarde = eerder aan de beurt
+PRIORITIES = {'interactive': 0, 'batch': 1}
+
+# Gelijktijdige requests per model per backend (Ollama's OLLAMA_NUM_PARALLEL)
+MODEL_CONCURRENCY = int(os.environ.get('MODEL_CONCURRENCY', 2))
+
+# Overrides per model, bv. "dolphin-mixtral=1,dolphin-phi=8" (totaal over alle backends)
+MODEL_CONCURRENCY_LIMITS = {
+    name.strip(): int(limit)
+    for name, limit in (
+        item.split('=', 1)
+        for item in os.environ.get('MODEL_CONCURRENCY_LIMITS', '').split(',')
+        if '=' in item
+    )
+}
+
+# Maximaal aantal wachtende requests per model, per prioriteitsklasse
+QUEUE_LIMITS = {
+    'interactive': int(os.environ.get('QUEUE_LIMIT_INTERACTIVE', 32)),
+    'batch': int(os.environ.get('QUEUE_LIMIT_BATCH', 128)),
+}
+
+# API keys waarvan de requests altijd als batch gepland worden
+BATCH_API_KEYS = {key.strip() for key in os.environ.get('BATCH_API_KEYS', '').split(',') if key.strip()}
+
+QUEUE_TIMEOUT = float(os.environ.get('QUEUE_TIMEOUT', 60))  # seconden
+INITIAL_SERVICE_TIME = 10.0  # schatting tot de eerste request klaar is
+EWMA_ALPHA = 0.2
+
+
+class QueueFull(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Slot:
+    """An admitted request. release() must be called exactly once."""
+
+    def __init__(self, scheduler, model: str, priority: str, waited: float):
+        self.scheduler = scheduler
+        self.model = model
+        self.priority = priority
+        self.waited = waited
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self)
+
+    def cancel(self) -> None:
+        """Release after the client went away; the generation was cut short"""
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self, outcome='cancelled')
+
+    def block(self) -> None:
+        """Release after the output guardrail stopped the generation"""
+        if not self.released:
+            self.released = True
+            self.scheduler.release(self, outcome='blocked')
+
+
+class _Waiter:
+    __slots__ = ('wake', 'granted', 'cancelled')
+
+    def __init__(self, wake):
+        self.wake = wake  # threading.Event.set of een asyncio future callback
+        self.granted = False
+        self.cancelled = False
+
+
+class _ModelQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.waiters = []  # heap van (priority, seq, waiter)
+        self.queued = {name: 0 for name in PRIORITIES}
+        self.service_time = INITIAL_SERVICE_TIME
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.blocked = 0
+        self.saved_total = 0.0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def retry_after(self) -> int:
+        """Geschatte tijd tot er plaats is, op basis van queue depth"""
+        depth = sum(self.queued.values()) + 1
+        return max(1, math.ceil(self.service_time * depth / self.limit))
+
+    def snapshot(self) -> dict:
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'queued': dict(self.queued),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'cancelled': self.cancelled,
+            'blocked': self.blocked,
+            'saved_seconds_estimate': round(self.saved_total, 3),
+            'avg_wait_seconds': round(self.wait_total / self.admitted, 4) if self.admitted else 0.0,
+            'max_wait_seconds': round(self.wait_max, 4),
+            'avg_service_seconds': round(self.service_time, 3),
+        }
+
+
+class Scheduler:
+    """
+    Admission control in front of the upstream call.
+    Elk model heeft een eigen limiet; wie geen slot krijgt wacht in een
+    prioriteitsheap (interactive voor batch, daarbinnen FIFO).
+    """
+
+    def __init__(self, default_limit: int = MODEL_CONCURRENCY, limits: dict = None,
+                 queue_limits: dict = None, timeout: float = QUEUE_TIMEOUT):
+        self.default_limit = default_limit
+        self.limits = dict(MODEL_CONCURRENCY_LIMITS if limits is None else limits)
+        self.queue_limits = dict(QUEUE_LIMITS if queue_limits is None else queue_limits)
+        self.timeout = timeout
+        self.models = {}
+        self.lock = threading.Lock()
+        self.seq = itertools.count()
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self.models.get(model)
+        if queue is None:
+            queue = self.models[model] = _ModelQueue(self.limits.get(model, self.default_limit))
+        return queue
+
+    def acquire(self, model: str, priority: str = 'interactive', timeout: float = None) -> Slot:
+        """Wait for a slot on model; raises QueueFull when the queue is full or the wait times out"""
+        if priority not in PRIORITIES:
+            priority = 'interactive'
+        start = time.monotonic()
+        event = threading.Event()
+        slot, waiter = self._enqueue(model, priority, start, event.set)
+        if slot is not None:
+            return slot
+
+        event.wait(self.timeout if timeout is None else timeout)
+        return self._finish_wait(model, priority, start, waiter)
+
+    async def acquire_async(self, model: str, priority: str = 'interactive', timeout: float = None) -> Slot:
+        """
+        asyncio variant of acquire(): the coroutine waits on a future, so a
+        queued request does not tie up a thread.
+        """
+        if priority not in PRIORITIES:
+            priority = 'interactive'
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+            except RuntimeError:
+                pass  # loop is al gestopt
+
+        slot, waiter = self._enqueue(model, priority, start, wake)
+        if slot is not None:
+            return slot
+
+        try:
+            await asyncio.wait_for(granted, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Client is weg: een intussen toegekend slot meteen doorgeven
+            try:
+                self._finish_wait(model, priority, start, waiter).release()
+            except QueueFull:
+                pass
+            raise
+        return self._finish_wait(model, priority, start, waiter)
+
+    def _enqueue(self, model: str, priority: str, start: float, wake):
+        """Admit right away, or queue a waiter. Returns (slot, None) or (None, waiter)."""
+        with self.lock:
+            queue = self._queue(model)
+            while queue.waiters and queue.waiters[0][2].cancelled:
+                heapq.heappop(queue.waiters)
+            if queue.active < queue.limit and not queue.waiters:
+                queue.active += 1
+                return self._admitted(queue, model, priority, start), None
+
+            if queue.queued[priority] >= self.queue_limits[priority]:
+                queue.rejected += 1
+                raise QueueFull(f'Queue for {model} is full', queue.retry_after())
+
+            waiter = _Waiter(wake)
+            heapq.heappush(queue.waiters, (PRIORITIES[priority], next(self.seq), waiter))
+            queue.queued[priority] += 1
+            return None, waiter
+
+    def _finish_wait(self, model: str, priority: str, start: float, waiter: _Waiter) -> Slot:
+        with self.lock:
+            queue = self.models[model]
+            queue.queued[priority] -= 1
+            if not waiter.granted:
+                # Lazy verwijderen: release() slaat geannuleerde waiters over
+                waiter.cancelled = True
+                queue.timed_out += 1
+                raise QueueFull(f'Timed out waiting for {model}', queue.retry_after())
+            return self._admitted(queue, model, priority, start)
+
+    def _admitted(self, queue: _ModelQueue, model: str, priority: str, start: float) -> Slot:
+        waited = time.monotonic() - start
+        queue.admitted += 1
+        queue.wait_total += waited
+        queue.wait_max = max(queue.wait_max, waited)
+        return Slot(self, model, priority, waited)
+
+    def release(self, slot: Slot, outcome: str = 'completed') -> None:
+        """
+        Hand the slot to the next waiter, or free it.
+        outcome is 'completed', 'cancelled' (client weg) of 'blocked' (output guardrail).
+        """
+        with self.lock:
+            queue = self.models[slot.model]
+            elapsed = time.monotonic() - slot.started
+            if outcome == 'cancelled':
+                # Afgebroken generaties tellen niet mee in de service tijd;
+                # de rest van een gemiddelde generatie is bespaarde inference tijd
+                queue.cancelled += 1
+                queue.saved_total += max(0.0, queue.service_time - elapsed)
+            elif outcome == 'blocked':
+                # Ook afgekapt, maar door de proxy: geen bespaarde tijd voor de client
+                queue.blocked += 1
+            else:
+                queue.service_time += EWMA_ALPHA * (elapsed - queue.service_time)
+
+            while queue.waiters:
+                _, _, waiter = heapq.heappop(queue.waiters)
+                if not waiter.cancelled:
+                    # Slot gaat direct over; active blijft gelijk
+                    waiter.granted = True
+                    waiter.wake()
+                    return
+            queue.active -= 1
+
+    def load(self, model: str):
+        """(queued, active, limit, avg service seconds) of one model"""
+        with self.lock:
+            queue = self.models.get(model)
+            if queue is None:
+                return 0, 0, self.limits.get(model, self.default_limit), INITIAL_SERVICE_TIME
+            return sum(queue.queued.values()), queue.active, queue.limit, queue.service_time
+
+    def queue_depth(self) -> int:
+        with self.lock:
+            return sum(sum(q.queued.values()) for q in self.models.values())
+
+    def cancellations(self) -> dict:
+        """Cancelled generations over all models"""
+        with self.lock:
+            return {
+                'cancelled': sum(q.cancelled for q in self.models.values()),
+                'saved_seconds_estimate': round(sum(q.saved_total for q in self.models.values()), 3),
+            }
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {model: queue.snapshot() for model, queue in self.models.items()}
@@ -1,10 +1,10 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
-import asyncio
+import json
 import logging
 from browser_agent import BrowserAgent
+from job_queue import JobQueue, QueueFull
 import os
-from threading import Thread
 
 app = Flask(__name__, static_folder='.')
 CORS(app)  # Enable CORS for dashboard
@@ -12,21 +12,15 @@ CORS(app)  # Enable CORS for dashboard
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Global browser agent instance
-browser_agent = None
+def create_browser_agent():
+    """Create a browser agent; the job loop starts it and owns it from then on."""
+    return BrowserAgent(
+        ollama_url="http://localhost:11434",
+        model="dolphin-llama3:8b-256k"
+    )
 
-def init_browser_agent():
-    """Initialize the browser agent in a separate thread."""
-    global browser_agent
-    try:
-        logger.info("Initializing browser agent...")
-        browser_agent = BrowserAgent(
-            ollama_url="http://localhost:11434",
-            model="dolphin-llama3:8b-256k"
-        )
-        logger.info("Browser agent initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize browser agent: {e}")
+# Taken lopen op de loop thread van de queue, niet in de request thread
+jobs = JobQueue(create_browser_agent)
 
 @app.route('/')
 def index():
@@ -34,8 +28,8 @@ def index():
     return send_from_directory('.', 'dashboard.html')
 
 @app.route('/api/execute-task', methods=['POST'])
-async def execute_task():
-    """Execute a task using the browser agent."""
+def execute_task():
+    """Queue a task for the browser agent; returns the job id right away."""
     try:
         data = request.get_json()
         task = data.get('task', '')
@@ -47,54 +41,150 @@ async def execute_task():
                 'error': 'No task provided'
             }), 400
         
-        if browser_agent is None:
+        if jobs.error and not jobs.ready.is_set():
             return jsonify({
                 'success': False,
-                'error': 'Browser agent not initialized'
+                'error': f'Browser agent not initialized: {jobs.error}'
             }), 503
         
-        logger.info(f"Executing task in {mode} mode: {task}")
-        
-        # Execute the task
-        result = await browser_agent.execute_task(task)
+        job = jobs.submit(task, mode)
+        logger.info(f"Queued job {job.id} in {mode} mode: {task}")
         
         return jsonify({
             'success': True,
-            'result': result,
+            'job': job.snapshot(),
+            'job_id': job.id,
+            'position': jobs.position(job),
             'task': task,
             'mode': mode
-        })
+        }), 202
         
+    except QueueFull as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 429, {'Retry-After': str(e.retry_after)}
     except Exception as e:
-        logger.error(f"Error executing task: {e}")
+        logger.error(f"Error queueing task: {e}")
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def job_not_found(job_id):
+    return jsonify({
+        'success': False,
+        'error': f'Unknown job: {job_id}'
+    }), 404
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Recent jobs, newest first."""
+    return jsonify({
+        'success': True,
+        'jobs': [job.snapshot() for job in reversed(jobs.recent())],
+        'queue': jobs.snapshot()
+    })
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of one job."""
+    job = jobs.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    return jsonify({
+        'success': True,
+        'job': job.snapshot(),
+        'position': jobs.position(job)
+    })
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Result of a finished job; 202 while it is still queued or running."""
+    job = jobs.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    if not job.done:
+        return jsonify({
+            'success': False,
+            'job': job.snapshot(),
+            'error': f'Job is {job.status}'
+        }), 202
+    return jsonify({
+        'success': job.status == 'done',
+        'job': job.snapshot(result=True),
+        'result': job.result
+    })
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running job."""
+    job = jobs.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    cancelled = jobs.cancel(job_id)
+    return jsonify({
+        'success': cancelled,
+        'job': job.snapshot(),
+        'error': None if cancelled else f'Job is already {job.status}'
+    }), 200 if cancelled else 409
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a job's progress.
+    Eerst een replay van wat er al gebeurd is, dan live; de stream sluit na
+    het laatste event (done, failed of cancelled). Last-Event-ID hervat.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    start = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    def events():
+        for event in job.follow(start):
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # nginx e.d. niet laten bufferen
+        }
+    )
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get the current status of the browser agent."""
     return jsonify({
-        'browser_agent_ready': browser_agent is not None,
-        'ollama_connected': True if browser_agent else False
+        'browser_agent_ready': jobs.ready.is_set(),
+        'ollama_connected': jobs.ready.is_set(),
+        'jobs': jobs.snapshot(),
+        'agent_stats': [agent.stats_snapshot() for agent in jobs.agents]
     })
 
 @app.route('/api/stop', methods=['POST'])
-async def stop_task():
-    """Stop the current task."""
+def stop_task():
+    """Stop the current task: one job when a job_id is given, else every running job."""
     try:
-        if browser_agent:
-            await browser_agent.stop()
-            return jsonify({
-                'success': True,
-                'message': 'Task stopped'
-            })
+        data = request.get_json(silent=True) or {}
+        job_id = data.get('job_id')
+        if job_id:
+            if jobs.get(job_id) is None:
+                return job_not_found(job_id)
+            cancelled = [job_id] if jobs.cancel(job_id) else []
         else:
-            return jsonify({
-                'success': False,
-                'error': 'Browser agent not initialized'
-            }), 503
+            cancelled = jobs.cancel_running()
+        return jsonify({
+            'success': True,
+            'message': 'Task stopped' if cancelled else 'No running task',
+            'cancelled': cancelled
+        })
     except Exception as e:
         logger.error(f"Error stopping task: {e}")
         return jsonify({
@@ -103,10 +193,9 @@ async def stop_task():
         }), 500
 
 if __name__ == '__main__':
-    # Initialize browser agent in a separate thread
-    init_thread = Thread(target=init_browser_agent)
-    init_thread.start()
+    # Start the job loop; it initializes the browser agent in the background
+    jobs.start()
     
     # Run Flask server
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Request coalescing (singleflight) voor de guardrail proxy
+Identieke deterministische requests die tegelijk binnenkomen delen één
+upstream call; het resultaat gaat naar iedereen die meewacht.
+"""
+
+import threading
+
+
+class Flight:
+    """
+    One upstream call shared by every identical request.
+    Alle chunks worden bewaard, zodat wie laat aansluit eerst een replay krijgt
+    en daarna de live stream volgt.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.status = None
+        self.headers = []
+        self.chunks = []
+        self.started = False
+        self.done = False
+        self.error = None
+        self.members = set()  # clients die nog op het resultaat wachten
+        self.cancel = None    # CancelToken van de upstream call, gezet door de leader
+        self.cond = threading.Condition()
+
+    def start(self, status: int, headers: list) -> None:
+        with self.cond:
+            self.status = status
+            self.headers = headers
+            self.started = True
+            self.cond.notify_all()
+
+    def publish(self, chunk: bytes) -> None:
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, error: Exception = None) -> None:
+        with self.cond:
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+    def leave(self, member) -> bool:
+        """Drop a client; True when nobody is left and the call is still running"""
+        with self.cond:
+            if member not in self.members:
+                return False
+            self.members.discard(member)
+            return not self.members and not self.done
+
+    def wait_started(self) -> None:
+        """Block until the upstream status is known; re-raises the leader's error"""
+        with self.cond:
+            while not self.started and not self.done:
+                self.cond.wait()
+            if not self.started:
+                raise self.error
+
+    def body(self) -> bytes:
+        """Block until the flight is done and return the full body"""
+        with self.cond:
+            while not self.done:
+                self.cond.wait()
+            if not self.started:
+                raise self.error
+            return b''.join(self.chunks)
+
+    def follow(self):
+        """Replay emitted chunks, then yield new ones as they arrive"""
+        index = 0
+        while True:
+            with self.cond:
+                while index >= len(self.chunks) and not self.done:
+                    self.cond.wait()
+                pending = self.chunks[index:]
+                index += len(pending)
+                done = self.done
+            yield from pending
+            if done and index >= len(self.chunks):
+                return
+
+
+class SingleFlight:
+    """Registry of in-flight upstream calls keyed on the request"""
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.abandoned = 0
+
+    def join(self, key: str, member=None):
+        """
+        Returns (flight, is_leader). The leader must run the call and finish() it.
+        member identificeert de client voor leave(); None telt niet als wachtende.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight(key)
+                self.leaders += 1
+            else:
+                self.followers += 1
+            if member is not None:
+                with flight.cond:
+                    flight.members.add(member)
+            return flight, leader
+
+    def leave(self, flight: Flight, member) -> bool:
+        """
+        A client stopped waiting. Returns True when it was the last one: de
+        flight is dan vergeten en de caller moet de upstream call afbreken.
+        """
+        with self.lock:
+            if not flight.leave(member):
+                return False
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            self.abandoned += 1
+            return True
+
+    def forget(self, flight: Flight) -> None:
+        """Stop new requests from joining a flight"""
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'in_flight': len(self.flights),
+                'leaders': self.leaders,
+                'coalesced': self.followers,
+                'abandoned': self.abandoned,
+            }
@@ -0,0 +1,75 @@
+"""
+Gedeelde fixtures: nep-Ollama en proxy als subprocessen, zoals in
+benchmarks/bench_proxy.py. Modules die proxy.py importeren krijgen een
+environment zonder disk log, disk cache of warm pool.
+"""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+sys.path[:0] = [ROOT, BENCHMARKS]
+
+from bench_proxy import free_port, wait_until_up  # noqa: E402
+
+# Vóór de eerste import van proxy.py: niets naar disk, geen preloads
+TEST_ENV = {
+    'AUDIT_LOG_DIR': '',
+    'RESPONSE_CACHE_DIR': '',
+    'WARM_POOL': '0',
+}
+os.environ.update(TEST_ENV)
+os.environ.setdefault('OLLAMA_BACKENDS', f'http://127.0.0.1:{free_port()}')
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+@pytest.fixture(scope='module')
+def fake_ollama():
+    """Factory: start fake_ollama.py with extra arguments, returns its URL"""
+    processes = []
+
+    def start(*args):
+        url = f'http://127.0.0.1:{free_port()}'
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCHMARKS, 'fake_ollama.py'), '--port', url.rsplit(':', 1)[1], *args],
+            stdout=subprocess.DEVNULL,
+        ))
+        wait_until_up(f'{url}/v1/models')
+        return url
+
+    yield start
+    for process in processes:
+        stop(process)
+
+
+@pytest.fixture(scope='module')
+def start_proxy():
+    """Factory: start proxy.py or proxy_async.py in front of backends, returns its URL"""
+    processes = []
+
+    def start(script, backends, **env):
+        port = free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, script)], cwd=ROOT,
+            env={**os.environ, **TEST_ENV, 'OLLAMA_BACKENDS': ','.join(backends), 'PROXY_PORT': str(port), **env},
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+        url = f'http://127.0.0.1:{port}'
+        wait_until_up(f'{url}/health')
+        return url
+
+    yield start
+    for process in processes:
+        stop(process)
@@ -0,0 +1,60 @@
+"""
+AuditLog.query met naive en tijdzone-bewuste grenzen, in memory en op disk.
+Entries hebben naive lokale timestamps (datetime.now().isoformat()).
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import proxy
+from audit_log import AuditLog
+
+START = datetime(2026, 10, 17, 12, 0, 0)
+
+
+def fill(log, count=10):
+    for i in range(count):
+        log.append({'timestamp': (START + timedelta(minutes=i)).isoformat(),
+                    'content_preview': f'entry {i}', 'blocked': False, 'reason': None})
+
+
+def previews(entries):
+    return [entry['content_preview'] for entry in entries]
+
+
+@pytest.fixture(params=['memory', 'disk'])
+def log(request, tmp_path):
+    log = AuditLog(directory=str(tmp_path) if request.param == 'disk' else '')
+    fill(log)
+    if request.param == 'disk':
+        deadline = time.monotonic() + 5
+        while len(log.query(limit=100)) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)  # de writer thread schrijft op de achtergrond
+    return log
+
+
+def test_naive_bounds(log):
+    entries = log.query(START + timedelta(minutes=2), START + timedelta(minutes=5))
+    assert previews(entries) == ['entry 2', 'entry 3', 'entry 4']
+    assert previews(log.query(limit=2)) == ['entry 8', 'entry 9']
+
+
+def test_aware_bounds_are_local_time(log):
+    since = (START + timedelta(minutes=2)).astimezone(timezone.utc)
+    until = (START + timedelta(minutes=5)).astimezone(timezone(timedelta(hours=5, minutes=30)))
+    assert previews(log.query(since, until)) == ['entry 2', 'entry 3', 'entry 4']
+    assert previews(log.query(None, until, limit=1)) == ['entry 4']
+
+
+def test_audit_view_accepts_an_offset(monkeypatch):
+    log = AuditLog(directory='')
+    fill(log)
+    monkeypatch.setattr(proxy, 'REQUEST_LOG', log)
+    client = proxy.app.test_client()
+
+    response = client.get('/audit?since=2020-01-01T00:00:00Z&limit=3')
+    assert response.status_code == 200
+    assert previews(response.get_json()['entries']) == ['entry 0', 'entry 1', 'entry 2']
+    assert client.get('/audit?since=yesterday').status_code == 400
@@ -0,0 +1,117 @@
+"""
+check_messages (verdict cache + boundary windows) moet exact hetzelfde
+verdict en dezelfde reden geven als de oorspronkelijke per-patroon scan van
+de samengevoegde user berichten.
+"""
+
+import random
+
+import pytest
+
+import proxy
+from proxy import BOUNDARY_WINDOW, check_messages, crosses_boundary, is_safe_cached
+from bench_content_check import reference_check
+
+WORDS = ['the', 'model', 'child', 'bomb', 'making', 'real', 'home', 'address', 'of',
+         'plan', 'attack', 'terrorist', 'porn', 'dox', 'someone', 'links', 'cp',
+         'code', 'python', 'proxy', 'stream', 'token', 'cache', 'pedo', 'swatting']
+SEPARATORS = [' ', '  ', '\n', '\t', ' \n ', '']
+
+# Matches die alleen over de grens tussen berichten heen bestaan
+BOUNDARY_CASES = [
+    ['child', 'porn'],
+    ['terrorist attack', 'plan'],
+    ['bomb', '', '', 'making'],
+    ['real', 'home', 'address', 'of'],
+    ['x' * 1000 + ' jihad', 'instructions ' + 'y' * 1000],
+    ['child' + ' ' * 5000, ' ' * 5000 + 'porn'],
+    ['cp', '\n\t', 'links'],
+    ['dox', 'someone else'],
+    ['terrorist', ' ' * BOUNDARY_WINDOW, 'attack', 'plan'],
+]
+
+# Bijna-matches over de grens: \b en tekens ertussen houden ze veilig
+NEAR_MISSES = [
+    ['xcp', 'links'],
+    ['child', 'pornx'],
+    ['bomb', 'maker'],
+    ['terrorist', 'x', 'attack plan'],
+    ['real home', 'addresses of'],
+    ['terrorist', 'a' * (BOUNDARY_WINDOW + 10), 'attack plan'],
+]
+
+
+def random_text(rng, words):
+    parts = []
+    for _ in range(words):
+        word = rng.choice(WORDS)
+        parts.append(word.upper() if rng.random() < 0.1 else word)
+        parts.append(rng.choice(SEPARATORS))
+    return ''.join(parts)
+
+
+def user_messages(contents):
+    return [{'role': 'user', 'content': content} for content in contents]
+
+
+def assert_same_verdict(messages):
+    _, is_safe, reason = check_messages(messages)
+    assert (is_safe, reason) == reference_check(messages), messages
+
+
+@pytest.fixture(autouse=True)
+def empty_verdict_cache():
+    proxy.VERDICT_CACHE.clear()
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_random_histories(seed):
+    """Random histories vol patroonfragmenten, ook over berichtgrenzen heen"""
+    rng = random.Random(seed)
+    blocked = 0
+    for _ in range(5000):
+        messages = [
+            {'role': rng.choice(['user', 'user', 'assistant']), 'content': random_text(rng, rng.randint(0, 6))}
+            for _ in range(rng.randint(0, 6))
+        ]
+        assert_same_verdict(messages)
+        blocked += not reference_check(messages)[0]
+    assert blocked  # de random cases raken de patronen echt
+
+
+@pytest.mark.parametrize('contents', BOUNDARY_CASES)
+def test_match_across_boundary(contents):
+    # Geen enkel bericht is op zich geblokkeerd; alleen de naad
+    assert all(is_safe_cached(content) for content in contents)
+    assert crosses_boundary(contents)
+    assert_same_verdict(user_messages(contents))
+    assert not check_messages(user_messages(contents))[1]
+
+
+@pytest.mark.parametrize('contents', NEAR_MISSES)
+def test_near_miss_across_boundary(contents):
+    assert not crosses_boundary(contents)
+    assert check_messages(user_messages(contents))[1]
+    assert_same_verdict(user_messages(contents))
+
+
+def test_assistant_messages_are_not_joined():
+    messages = [
+        {'role': 'user', 'content': 'child'},
+        {'role': 'assistant', 'content': 'Waar gaat het over?'},
+        {'role': 'user', 'content': 'porn'},
+    ]
+    assert_same_verdict(messages)
+    assert not check_messages(messages)[1]
+    assert check_messages(messages[:2])[1]
+
+
+def test_cached_verdicts_match_reference():
+    """A second turn with the same history is served from the verdict cache"""
+    messages = user_messages(['how do I cache tokens', 'Bomb  MAKING guide', 'thanks'])
+    assert_same_verdict(messages)
+    cached = len(proxy.VERDICT_CACHE)
+    assert_same_verdict(messages)
+    assert len(proxy.VERDICT_CACHE) == cached
+    assert not is_safe_cached('Bomb  MAKING guide')
+    assert is_safe_cached('how do I cache tokens')
@@ -0,0 +1,217 @@
+"""
+ChunkBatcher, het opsplitsen in 'part' berichten, de workers en de daemon
+socket van de native messaging host. De Channel schrijft naar een buffer;
+fake_ollama.py speelt Ollama waar dat nodig is.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import subprocess
+
+import pytest
+
+from conftest import ROOT
+
+sys.path.insert(0, os.path.join(ROOT, 'chromium', 'native_host'))
+
+import ollama_host  # noqa: E402
+import ollama_launcher  # noqa: E402
+from ollama_host import MAX_MESSAGE_BYTES, Channel, ChunkBatcher, Job  # noqa: E402
+
+WINDOW = 0.05
+REPLY_SECONDS = 2
+
+
+def frames(buffer: io.BytesIO) -> list:
+    data = buffer.getvalue()
+    result = []
+    while data:
+        length = struct.unpack('I', data[:4])[0]
+        result.append(data[4:4 + length])
+        data = data[4 + length:]
+    return result
+
+
+def sent_messages(buffer: io.BytesIO) -> list:
+    return [json.loads(frame) for frame in frames(buffer)]
+
+
+@pytest.fixture
+def channel():
+    return Channel(io.BytesIO(), io.BytesIO())
+
+
+def test_pending_text_is_sent_at_the_deadline(channel):
+    batcher = ChunkBatcher(Job(7, channel), window=WINDOW, max_chars=4096)
+    batcher.add('Hallo')   # eerste token gaat meteen
+    batcher.add(' wereld')  # wacht op het venster; er komt geen volgend token
+    assert [m['text'] for m in sent_messages(channel.writer)] == ['Hallo']
+
+    time.sleep(WINDOW * 3)
+    assert [m['text'] for m in sent_messages(channel.writer)] == ['Hallo', ' wereld']
+    assert [m['seq'] for m in sent_messages(channel.writer)] == [0, 1]
+    batcher.close()
+
+
+def test_nothing_is_sent_after_close(channel):
+    batcher = ChunkBatcher(Job(7, channel), window=WINDOW, max_chars=4096)
+    batcher.add('a')
+    batcher.add('b')
+    batcher.flush()
+    batcher.add('c')
+    batcher.close()
+    time.sleep(WINDOW * 3)
+    assert [m['text'] for m in sent_messages(channel.writer)] == ['a', 'b']
+
+
+def test_max_chars_flushes_right_away(channel):
+    batcher = ChunkBatcher(Job(7, channel), window=60, max_chars=10)
+    batcher.add('x')
+    batcher.add('y' * 4)
+    batcher.add('z' * 6)
+    assert [m['text'] for m in sent_messages(channel.writer)] == ['x', 'yyyyzzzzzz']
+    batcher.close()
+
+
+@pytest.mark.parametrize('request_id', [1, 'kort', 'j' * 5000, 'é "\\' * 2000],
+                         ids=['int', 'kort', 'lang', 'escapes'])
+def test_parts_fit_the_limit(channel, request_id):
+    # Veel escapes: de JSON tekst is groter dan het aantal tekens
+    text = ('token "quoted" \\ é\n' * 60000)[:1_500_000]
+    channel.send({'id': request_id, 'type': 'done', 'response': text})
+
+    parts = frames(channel.writer)
+    assert len(parts) > 1
+    assert all(len(part) <= MAX_MESSAGE_BYTES for part in parts)
+    messages = [json.loads(part) for part in parts]
+    assert all(m['id'] == request_id and m['count'] == len(parts) for m in messages)
+    assert json.loads(''.join(m['data'] for m in messages))['response'] == text
+
+
+def test_part_budget_rejects_an_id_larger_than_a_message():
+    with pytest.raises(ValueError):
+        ollama_host.part_budget('x' * MAX_MESSAGE_BYTES, MAX_MESSAGE_BYTES * 2)
+
+
+def wait_for_reply(buffer: io.BytesIO, request_id, timeout: float = REPLY_SECONDS):
+    deadline = time.monotonic() + timeout
+    while True:
+        for message in sent_messages(buffer):
+            if message.get('id') == request_id:
+                return message
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(0.01)
+
+
+def test_models_does_not_wait_for_busy_workers(fake_ollama, channel, monkeypatch):
+    # Elke generatie duurt ~10 s; alle MAX_WORKERS workers zijn bezet
+    url = fake_ollama('--first-token-ms', '0', '--token-ms', '200', '--jitter', 'none', '--tokens', '50')
+    monkeypatch.setattr(ollama_host, 'OLLAMA_URL', url)
+    monkeypatch.setitem(ollama_host.models_cache, 'models', None)
+    try:
+        for request_id in range(ollama_host.MAX_WORKERS):
+            channel.dispatch({'id': request_id, 'type': 'generate', 'model': 'dolphin-phi', 'prompt': 'hoi'})
+        deadline = time.monotonic() + REPLY_SECONDS
+        while ollama_host.workers._value and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert ollama_host.workers._value == 0
+
+        # Niet in de cache: eigen thread naar Ollama
+        channel.dispatch({'id': 'models-1', 'type': 'models'})
+        reply = wait_for_reply(channel.writer, 'models-1')
+        assert reply is not None and reply['success']
+        assert reply['models']
+
+        # Uit de cache: het antwoord staat er al als dispatch terugkomt
+        channel.dispatch({'id': 'models-2', 'type': 'models'})
+        assert wait_for_reply(channel.writer, 'models-2', timeout=0)['models'] == reply['models']
+    finally:
+        channel.cancel_all()
+        deadline = time.monotonic() + REPLY_SECONDS
+        while ollama_host.workers._value < ollama_host.MAX_WORKERS and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+def test_runtime_dir_is_private(tmp_path, monkeypatch):
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    path = ollama_host.runtime_dir()
+    info = os.lstat(path)
+    assert path == str(tmp_path / f'ollama_host-{os.getuid()}')
+    assert info.st_mode & 0o777 == 0o700 and info.st_uid == os.getuid()
+    assert ollama_host.runtime_dir() == path
+
+
+@pytest.mark.parametrize('kind', ['open', 'symlink', 'file'])
+def test_runtime_dir_refuses_a_prepared_path(tmp_path, monkeypatch, kind):
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    path = tmp_path / f'ollama_host-{os.getuid()}'
+    if kind == 'open':
+        path.mkdir()
+        path.chmod(0o777)
+    elif kind == 'symlink':
+        (tmp_path / 'elders').mkdir(mode=0o700)
+        path.symlink_to(tmp_path / 'elders')
+    else:
+        path.write_text('')
+    with pytest.raises(PermissionError):
+        ollama_host.runtime_dir()
+    assert not ollama_launcher.private_dir(str(path))
+
+
+def test_daemon_lock_does_not_follow_a_symlink(tmp_path):
+    target = tmp_path / 'target'
+    (tmp_path / 'host.sock.lock').symlink_to(target)
+    ollama_host.serve_daemon(str(tmp_path / 'host.sock'))  # geeft op in plaats van te binden
+    assert not target.exists()
+    assert not (tmp_path / 'host.sock').exists()
+
+
+def test_daemon_keeps_a_file_that_is_not_its_socket(tmp_path):
+    path = tmp_path / 'host.sock'
+    path.write_text('van iemand anders')
+    ollama_host.serve_daemon(str(path))
+    assert path.read_text() == 'van iemand anders'
+
+
+def test_launcher_checks_the_peer(monkeypatch):
+    ours, theirs = socket.socketpair(socket.AF_UNIX)
+    with ours, theirs:
+        assert ollama_launcher.owned_by_us(ours)
+        assert ollama_host.peer_uid(ours) == os.getuid()
+        monkeypatch.setattr(os, 'getuid', lambda: ollama_host.peer_uid(ours) + 1)
+        assert not ollama_launcher.owned_by_us(ours)
+
+
+def test_launcher_relays_to_the_daemon(tmp_path, fake_ollama):
+    runtime = tmp_path / 'run'
+    runtime.mkdir(mode=0o700)
+    env = {**os.environ, 'XDG_RUNTIME_DIR': str(runtime), 'OLLAMA_URL': fake_ollama()}
+    env.pop('OLLAMA_HOST_SOCKET', None)
+    host_dir = os.path.dirname(ollama_host.__file__)
+    daemon = subprocess.Popen([sys.executable, os.path.join(host_dir, 'ollama_host.py'), '--daemon'], env=env)
+    try:
+        socket_path = runtime / ollama_host.SOCKET_NAME
+        deadline = time.monotonic() + 5
+        while not socket_path.exists() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert os.lstat(socket_path).st_mode & 0o777 == 0o600
+
+        # Zonder bereikbare Ollama kan alleen de daemon (met zijn modellijst) antwoorden
+        body = json.dumps({'id': 1, 'type': 'models'}).encode('utf-8')
+        launcher = subprocess.run([sys.executable, os.path.join(host_dir, 'ollama_launcher.py')],
+                                  env={**env, 'OLLAMA_URL': 'http://127.0.0.1:9'},
+                                  input=struct.pack('I', len(body)) + body, capture_output=True, timeout=10)
+        frame = launcher.stdout
+        reply = json.loads(frame[4:4 + struct.unpack('I', frame[:4])[0]])
+        assert reply['id'] == 1 and reply['success'] and reply['models']
+    finally:
+        daemon.terminate()
+        daemon.wait(5)
@@ -0,0 +1,61 @@
+"""
+OutputScanner houdt alleen een staart van de stream vast. Die snede mag geen
+woordgrens opleveren die niet in de echte tekst staat ("tor|pedo").
+"""
+
+import json
+
+import pytest
+
+from proxy import OUTPUT_CARRY_CHARS, OutputScanner, check_content, scan_output
+
+HARMLESS = [
+    'The submarine fired a torpedo at the destroyer... ',
+    'Copy the file over tcp links and scp links to the backup host. ',
+    'My pedometer counted ten thousand steps; the encyclopedia says that is plenty. ',
+]
+
+
+def scan(text, size):
+    """Verdict of text streamed in deltas of size characters"""
+    scanner = OutputScanner()
+    for start in range(0, len(text), size):
+        reason = scanner.feed(text[start:start + size])
+        if reason:
+            return reason
+    return scanner.finish()
+
+
+def sse_event(text):
+    chunk = {'object': 'chat.completion.chunk',
+             'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}]}
+    return b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n'
+
+
+@pytest.mark.parametrize('size', range(1, 9))
+@pytest.mark.parametrize('sentence', HARMLESS)
+def test_cut_inside_a_word_is_not_a_boundary(sentence, size):
+    text = sentence * (3 * OUTPUT_CARRY_CHARS // len(sentence) + 2)
+    assert check_content(text) == (True, None)
+    assert scan(text, size) is None
+
+
+@pytest.mark.parametrize('size', [1, 3, 7])
+def test_match_after_the_cut_is_still_blocked(size):
+    text = HARMLESS[0] * 5 + 'here are cp links'
+    assert not check_content(text)[0]
+    assert scan(text, size) == check_content(text)[1]
+
+
+@pytest.mark.parametrize('size', [1, 3, 7])
+def test_match_split_over_the_carry(size):
+    # "child" ligt al ruim in de staart als "porn" binnenkomt
+    text = HARMLESS[1] * 3 + 'child' + ' ' * (OUTPUT_CARRY_CHARS // 2) + 'porn'
+    assert not check_content(text)[0]
+    assert scan(text, size) == check_content(text)[1]
+
+
+def test_scan_output_passes_a_sub_word_stream():
+    text = HARMLESS[0] * 10
+    events = [sse_event(text[i:i + 3]) for i in range(0, len(text), 3)] + [b'data: [DONE]\n\n']
+    assert list(scan_output((event for event in events), 'test')) == events
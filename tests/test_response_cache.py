@@ -0,0 +1,117 @@
+"""
+ResponseCache: LRU volgorde, TTL, de disk tier over een herstart heen en
+DELETE /cache, los en via beide proxies tegen fake_ollama.py.
+"""
+
+import os
+import time
+
+import pytest
+import requests
+
+import proxy
+from response_cache import ResponseCache
+
+BODY = b'{"choices": []}'
+JSON = 'application/json'
+
+
+def keys(cache):
+    return list(cache.entries)
+
+
+def test_lru_evicts_the_least_recently_used():
+    cache = ResponseCache(max_entries=3, directory='')
+    for key in 'abc':
+        cache.put(key, BODY, JSON, 'm')
+    assert cache.get('a') is not None  # a is nu het meest recent gebruikt
+    cache.put('d', BODY, JSON, 'm')
+
+    assert keys(cache) == ['c', 'a', 'd']
+    assert cache.get('b') is None
+    assert cache.snapshot()['evictions'] == 1
+
+
+def test_lru_evicts_on_bytes():
+    cache = ResponseCache(max_entries=10, max_bytes=3 * len(BODY), directory='')
+    for key in 'abcd':
+        cache.put(key, BODY, JSON, 'm')
+    assert keys(cache) == ['b', 'c', 'd']
+    assert cache.snapshot()['bytes'] == 3 * len(BODY)
+
+    cache.put('big', BODY * 4, JSON, 'm')  # groter dan de hele cache: niet bewaard
+    assert 'big' not in cache.entries
+
+
+def test_ttl_expiry():
+    cache = ResponseCache(ttl=0.05, directory='')
+    cache.put('a', BODY, JSON, 'm')
+    assert cache.get('a').body == BODY
+    time.sleep(0.1)
+
+    assert cache.get('a') is None
+    snapshot = cache.snapshot()
+    assert (snapshot['expired'], snapshot['misses'], snapshot['entries']) == (1, 1, 0)
+
+
+def test_disk_round_trip(tmp_path):
+    body = '{"content": "héél goed"}'.encode('utf-8')
+    cache = ResponseCache(directory=str(tmp_path))
+    cache.put('a', body, JSON, 'm')
+    assert os.listdir(tmp_path) == ['a.json']
+
+    # Nieuwe instantie, zoals na een herstart: de entry komt van disk terug in memory
+    restarted = ResponseCache(directory=str(tmp_path))
+    entry = restarted.get('a')
+    assert (entry.body, entry.content_type, entry.model) == (body, JSON, 'm')
+    assert entry.expires == pytest.approx(cache.entries['a'].expires)
+    assert restarted.snapshot()['disk_hits'] == 1
+    assert 'a' in restarted.entries
+
+
+def test_expired_disk_entry_is_removed(tmp_path):
+    ResponseCache(ttl=0.05, directory=str(tmp_path)).put('a', BODY, JSON, 'm')
+    time.sleep(0.1)
+    assert ResponseCache(directory=str(tmp_path), ttl=3600).get('a') is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_invalidate_per_model(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path))
+    cache.put('a', BODY, JSON, 'm')
+    cache.put('b', BODY, JSON, 'other')
+
+    assert cache.invalidate('m') == 2  # memory en disk
+    assert keys(cache) == ['b'] and os.listdir(tmp_path) == ['b.json']
+    assert cache.invalidate() == 2
+    assert keys(cache) == [] and os.listdir(tmp_path) == []
+
+
+def test_delete_cache_view(monkeypatch, tmp_path):
+    cache = ResponseCache(directory=str(tmp_path))
+    cache.put('a', BODY, JSON, 'm')
+    cache.put('b', BODY, JSON, 'other')
+    monkeypatch.setattr(proxy, 'response_cache', cache)
+    client = proxy.app.test_client()
+
+    assert client.delete('/cache?model=m').get_json() == {'invalidated': 2}
+    assert client.delete('/cache').get_json() == {'invalidated': 2}
+    assert cache.snapshot()['entries'] == 0
+
+
+@pytest.mark.parametrize('script', ['proxy.py', 'proxy_async.py'])
+def test_delete_cache_through_the_proxy(script, fake_ollama, start_proxy):
+    url = start_proxy(script, [fake_ollama('--first-token-ms', '0', '--token-ms', '0', '--tokens', '4')])
+    body = {'model': 'dolphin-phi', 'temperature': 0, 'stream': False,
+            'messages': [{'role': 'user', 'content': f'Hallo via {script}'}]}
+
+    def chat():
+        response = requests.post(f'{url}/v1/chat/completions', json=body, timeout=30)
+        assert response.status_code == 200
+        return response.headers['X-Cache']
+
+    assert chat() == 'MISS'
+    assert chat() == 'HIT'
+    response = requests.delete(f'{url}/cache', params={'model': 'dolphin-phi'}, timeout=30)
+    assert response.json() == {'invalidated': 1}
+    assert chat() == 'MISS'
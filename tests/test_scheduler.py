@@ -0,0 +1,232 @@
+"""
+Scheduler: admission per model, prioriteit, QueueFull, time-outs, lazy
+verwijderde waiters en de asyncio variant. Kleine limieten en korte time-outs.
+"""
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from scheduler import INITIAL_SERVICE_TIME, QueueFull, Scheduler
+
+TIMEOUT = 2.0
+SHORT = 0.05
+
+
+def make(limit=1, interactive=4, batch=4, timeout=TIMEOUT):
+    return Scheduler(default_limit=limit, limits={}, queue_limits={'interactive': interactive, 'batch': batch},
+                     timeout=timeout)
+
+
+def queued(scheduler, model='m'):
+    return sum(scheduler.snapshot()[model]['queued'].values())
+
+
+def wait_until(condition, timeout=TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+class Waiter(threading.Thread):
+    """acquire() in een eigen thread; onthoudt het slot of de QueueFull"""
+
+    def __init__(self, scheduler, priority='interactive', timeout=None, model='m', on_admit=None):
+        super().__init__(daemon=True)
+        self.scheduler, self.priority, self.timeout, self.model = scheduler, priority, timeout, model
+        self.on_admit = on_admit
+        self.slot = self.error = None
+
+    def run(self):
+        try:
+            self.slot = self.scheduler.acquire(self.model, self.priority, self.timeout)
+            if self.on_admit:
+                self.on_admit(self)
+        except QueueFull as e:
+            self.error = e
+
+
+def test_admits_up_to_the_limit_per_model():
+    scheduler = make(limit=2)
+    slots = [scheduler.acquire('m'), scheduler.acquire('m'), scheduler.acquire('other')]
+    assert [s.waited < SHORT for s in slots] == [True] * 3
+    assert scheduler.load('m')[:3] == (0, 2, 2)
+
+    for slot in slots:
+        slot.release()
+        slot.release()  # tweede keer is een no-op
+    assert scheduler.load('m')[:3] == (0, 0, 2)
+
+
+def test_interactive_goes_before_batch_and_fifo_within_a_class():
+    scheduler = make(limit=1)
+    running = scheduler.acquire('m')
+    order = []
+    waiters = []
+    for name, priority in [('b1', 'batch'), ('i1', 'interactive'), ('b2', 'batch'), ('i2', 'interactive')]:
+        waiter = Waiter(scheduler, priority, on_admit=lambda w, name=name: (order.append(name), w.slot.release()))
+        waiter.start()
+        waiters.append(waiter)
+        wait_until(lambda n=len(waiters): queued(scheduler) == n)
+
+    running.release()
+    for waiter in waiters:
+        waiter.join(TIMEOUT)
+    assert order == ['i1', 'i2', 'b1', 'b2']
+    assert scheduler.load('m')[1] == 0
+
+
+def test_unknown_priority_is_interactive():
+    scheduler = make(limit=1)
+    running = scheduler.acquire('m')
+    batch = Waiter(scheduler, 'batch')
+    batch.start()
+    wait_until(lambda: queued(scheduler) == 1)
+    odd = Waiter(scheduler, 'urgent')
+    odd.start()
+    wait_until(lambda: scheduler.snapshot()['m']['queued']['interactive'] == 1)
+
+    running.release()
+    odd.join(TIMEOUT)
+    assert odd.slot is not None and batch.slot is None
+    odd.slot.release()
+    batch.join(TIMEOUT)
+    batch.slot.release()
+
+
+def test_full_queue_raises_with_retry_after():
+    scheduler = make(limit=1, interactive=1, batch=0)
+    running = scheduler.acquire('m')
+    waiter = Waiter(scheduler)
+    waiter.start()
+    wait_until(lambda: queued(scheduler) == 1)
+
+    with pytest.raises(QueueFull) as full:
+        scheduler.acquire('m', 'interactive')
+    # (wachtend + 1) * service tijd / limiet
+    assert full.value.retry_after == 2 * INITIAL_SERVICE_TIME
+    with pytest.raises(QueueFull):
+        scheduler.acquire('m', 'batch')
+    assert scheduler.snapshot()['m']['rejected'] == 2
+
+    running.release()
+    waiter.join(TIMEOUT)
+    waiter.slot.release()
+
+
+def test_timeout_raises_and_the_waiter_is_skipped_lazily():
+    scheduler = make(limit=1)
+    running = scheduler.acquire('m')
+    with pytest.raises(QueueFull) as timed_out:
+        scheduler.acquire('m', timeout=SHORT)
+    assert 'Timed out' in str(timed_out.value)
+    assert timed_out.value.retry_after >= 1
+    snapshot = scheduler.snapshot()['m']
+    assert snapshot['timed_out'] == 1 and queued(scheduler) == 0
+    assert len(scheduler.models['m'].waiters) == 1  # nog in de heap, als geannuleerd gemarkeerd
+
+    # Het slot slaat de verlopen waiter over en gaat naar de volgende
+    waiter = Waiter(scheduler)
+    waiter.start()
+    wait_until(lambda: queued(scheduler) == 1)
+    running.release()
+    waiter.join(TIMEOUT)
+    assert waiter.slot is not None
+    assert scheduler.models['m'].waiters == []
+    waiter.slot.release()
+    assert scheduler.load('m')[1] == 0
+
+
+def test_cancelled_waiters_at_the_front_are_dropped_on_enqueue():
+    scheduler = make(limit=1)
+    running = scheduler.acquire('m')
+    for _ in range(2):
+        with pytest.raises(QueueFull):
+            scheduler.acquire('m', timeout=SHORT)
+    running.release()
+    # Leeg op de geannuleerde waiters na: een nieuwe request mag meteen door
+    slot = scheduler.acquire('m', timeout=SHORT)
+    assert scheduler.models['m'].waiters == []
+    slot.release()
+
+
+def test_release_outcomes():
+    scheduler = make(limit=1)
+    scheduler.acquire('m').cancel()
+    scheduler.acquire('m').block()
+    snapshot = scheduler.snapshot()['m']
+    assert (snapshot['cancelled'], snapshot['blocked']) == (1, 1)
+    assert snapshot['avg_service_seconds'] == INITIAL_SERVICE_TIME  # afgebroken runs tellen niet mee
+    assert scheduler.cancellations()['saved_seconds_estimate'] > 0
+
+    scheduler.acquire('m').release()
+    assert scheduler.snapshot()['m']['avg_service_seconds'] < INITIAL_SERVICE_TIME
+
+
+def test_acquire_async_waits_without_a_thread():
+    async def main():
+        scheduler = make(limit=1)
+        running = await scheduler.acquire_async('m')
+        batch = asyncio.ensure_future(scheduler.acquire_async('m', 'batch'))
+        interactive = asyncio.ensure_future(scheduler.acquire_async('m', 'interactive'))
+        await asyncio.sleep(SHORT)
+        assert queued(scheduler) == 2
+
+        running.release()
+        slot = await asyncio.wait_for(interactive, TIMEOUT)
+        assert not batch.done()
+        slot.release()
+        (await asyncio.wait_for(batch, TIMEOUT)).release()
+
+        running = await scheduler.acquire_async('m')
+        with pytest.raises(QueueFull):
+            await scheduler.acquire_async('m', timeout=SHORT)
+        running.release()
+        assert scheduler.load('m')[1] == 0
+
+    asyncio.run(main())
+
+
+def test_acquire_async_cancelled_after_the_grant_passes_the_slot_on():
+    async def main():
+        scheduler = make(limit=1)
+        running = await scheduler.acquire_async('m')
+        first = asyncio.ensure_future(scheduler.acquire_async('m'))
+        second = asyncio.ensure_future(scheduler.acquire_async('m'))
+        await asyncio.sleep(SHORT)
+
+        # first wordt geannuleerd en krijgt het slot voor het wakker wordt:
+        # de CancelledError tak moet het toegekende slot aan second doorgeven
+        first.cancel()
+        running.release()
+        assert scheduler.models['m'].active == 1
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        slot = await asyncio.wait_for(second, TIMEOUT)
+        assert scheduler.models['m'].active == 1
+        slot.release()
+        assert scheduler.models['m'].active == 0
+        assert queued(scheduler) == 0
+
+    asyncio.run(main())
+
+
+def test_acquire_async_cancelled_while_queued():
+    async def main():
+        scheduler = make(limit=1)
+        running = await scheduler.acquire_async('m')
+        waiting = asyncio.ensure_future(scheduler.acquire_async('m'))
+        await asyncio.sleep(SHORT)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert queued(scheduler) == 0
+
+        running.release()
+        assert scheduler.models['m'].active == 0  # de geannuleerde waiter krijgt niets
+
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""
+Streaming passthrough van proxy.py en proxy_async.py tegen fake_ollama.py:
+events komen door terwijl upstream nog genereert, de response headers
+bevatten geen hop-by-hop of dubbele headers, en de output guardrail laat een
+stream in sub-word tokens door als de hele tekst onschuldig is.
+"""
+
+import json
+import time
+import http.client
+from urllib.parse import urlsplit
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+
+from proxy import filter_headers
+
+TOKENS = 8
+FIRST_TOKEN_MS = 20
+TOKEN_MS = 100
+UPSTREAM_SECONDS = (FIRST_TOKEN_MS + (TOKENS - 1) * TOKEN_MS) / 1000
+
+# "tor|pedo": tokens van 3 tekens knippen de staart van de output scan midden in een woord
+SUB_WORD_TEXT = 'The submarine fired a torpedo at the destroyer'
+SUB_WORD_TOKENS = 60
+
+# Hop-by-hop headers die de server van de proxy zelf nooit zet
+FORBIDDEN_HEADERS = {'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers', 'upgrade'}
+
+
+@pytest.fixture(scope='module')
+def ollama(fake_ollama):
+    return fake_ollama('--first-token-ms', str(FIRST_TOKEN_MS), '--token-ms', str(TOKEN_MS),
+                       '--jitter', 'none', '--tokens', str(TOKENS))
+
+
+@pytest.fixture(scope='module')
+def sub_word_ollama(fake_ollama):
+    return fake_ollama('--first-token-ms', '0', '--token-ms', '0', '--jitter', 'none',
+                       '--tokens', str(SUB_WORD_TOKENS), '--text', SUB_WORD_TEXT, '--token-chars', '3')
+
+
+def stream_chat(url: str):
+    """POST a streamed chat; returns (status, raw header list, seconds to first chunk, total seconds, body)"""
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    body = json.dumps({'model': 'dolphin-phi', 'stream': True,
+                       'messages': [{'role': 'user', 'content': 'Schrijf een gedicht'}]})
+    start = time.perf_counter()
+    try:
+        conn.request('POST', '/v1/chat/completions', body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        first = None
+        chunks = []
+        while True:
+            chunk = response.read1(65536)
+            if not chunk:
+                break
+            if first is None:
+                first = time.perf_counter() - start
+            chunks.append(chunk)
+        return response.status, response.getheaders(), first, time.perf_counter() - start, b''.join(chunks)
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize('script', ['proxy.py', 'proxy_async.py'])
+def test_stream_passthrough(script, ollama, start_proxy):
+    status, headers, first, total, body = stream_chat(start_proxy(script, [ollama]))
+
+    assert status == 200
+    assert body.count(b'"content"') == TOKENS
+    assert body.rstrip().endswith(b'data: [DONE]')
+
+    # Het eerste event is er lang voordat upstream klaar is met genereren
+    assert total >= UPSTREAM_SECONDS
+    assert first < UPSTREAM_SECONDS / 2
+
+    names = [name.lower() for name, _ in headers]
+    assert len(names) == len(set(names)), f'duplicate headers: {headers}'
+    assert not FORBIDDEN_HEADERS & set(names)
+    assert dict(headers)['Content-Type'].startswith('text/event-stream')
+    assert 'BaseHTTP' not in dict(headers).get('Server', '')  # de Server header van fake_ollama.py
+
+
+@pytest.mark.parametrize('script', ['proxy.py', 'proxy_async.py'])
+def test_sub_word_stream_is_not_blocked(script, sub_word_ollama, start_proxy):
+    status, _, _, _, body = stream_chat(start_proxy(script, [sub_word_ollama]))
+
+    assert status == 200
+    assert b'output_blocked' not in body
+    assert body.rstrip().endswith(b'data: [DONE]')
+    text = ''.join(
+        json.loads(line[len(b'data:'):])['choices'][0]['delta'].get('content') or ''
+        for line in body.splitlines() if line.startswith(b'data: {')
+    )
+    assert len(text) == 3 * SUB_WORD_TOKENS
+    assert 'torpedo' in text
+
+
+def test_filter_headers():
+    headers = CaseInsensitiveDict({
+        'Content-Type': 'text/event-stream',
+        'Content-Length': '12',
+        'Connection': 'keep-alive, X-Trace',
+        'Keep-Alive': 'timeout=5',
+        'Transfer-Encoding': 'chunked',
+        'X-Trace': 'abc',
+        'Date': 'Sat, 17 Oct 2026 10:00:00 GMT',
+        'Server': 'BaseHTTP/0.6 Python/3.11',
+        'X-Request-Id': '42',
+    })
+    assert filter_headers(headers) == [('Content-Type', 'text/event-stream'), ('X-Request-Id', '42')]
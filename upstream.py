@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+Upstream client voor de guardrail proxy
+Pooled keep-alive verbindingen naar één of meer Ollama backends.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from affinity import AffinityTable
+
+# Komma-gescheiden lijst, bv. "http://gpu1:11434,http://gpu2:11434"
+OLLAMA_BACKENDS = [
+    url.strip().rstrip('/')
+    for url in os.environ.get('OLLAMA_BACKENDS', 'http://localhost:11434').split(',')
+    if url.strip()
+]
+
+POOL_SIZE = int(os.environ.get('OLLAMA_POOL_SIZE', 32))  # keep-alive verbindingen per backend
+CONNECT_TIMEOUT = 3      # seconden; genereren zelf heeft geen timeout
+MAX_FAILURES = 3         # opeenvolgende fouten voor een backend uitgeworpen wordt
+EJECT_SECONDS = 10       # wachttijd voor een uitgeworpen backend opnieuw geprobed wordt
+PROBE_TIMEOUT = 2
+PROBE_INTERVAL = float(os.environ.get('HEALTH_PROBE_INTERVAL', 5))  # seconden
+
+
+class NoBackendAvailable(Exception):
+    """Raised when every configured backend is ejected"""
+
+
+class RequestCancelled(Exception):
+    """Raised when a CancelToken aborted the upstream request"""
+
+
+# De CancelToken van de request die in deze thread een verbinding pakt
+_current = threading.local()
+
+
+class CancelToken:
+    """
+    Lets another thread abort an upstream request.
+    De token onthoudt welke pool verbinding de request gebruikt; cancel()
+    sluit die socket, zodat een blokkerende read in Ollama's antwoord meteen
+    terugkomt en Ollama de generatie stopt.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def attach(self, connection) -> None:
+        with self.lock:
+            self.connection = connection
+
+    def detach(self, connection) -> None:
+        """Called before the connection goes back to the pool"""
+        with self.lock:
+            if self.connection is connection:
+                self.connection = None
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.cancelled = True
+            sock = getattr(self.connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class _TrackingMixin:
+    """Koppelt een uitgeleende verbinding aan de CancelToken van de huidige request"""
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        token = getattr(_current, 'token', None)
+        conn.cancel_token = token
+        if token is not None:
+            token.attach(conn)
+        return conn
+
+    def _put_conn(self, conn):
+        token = getattr(conn, 'cancel_token', None)
+        if token is not None:
+            # Eerst loskoppelen: een late cancel() mag geen verbinding van een
+            # andere request sluiten
+            token.detach(conn)
+            conn.cancel_token = None
+        super()._put_conn(conn)
+
+
+class _TrackingHTTPPool(_TrackingMixin, HTTPConnectionPool):
+    pass
+
+
+class _TrackingHTTPSPool(_TrackingMixin, HTTPSConnectionPool):
+    pass
+
+
+class _TrackingAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': _TrackingHTTPPool, 'https': _TrackingHTTPSPool}
+
+
+class Backend:
+    """One Ollama host with its own connection pool and health state"""
+
+    def __init__(self, url: str, pool_size: int = POOL_SIZE):
+        self.url = url
+        self.session = requests.Session()
+        adapter = _TrackingAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0  # 0 = gezond
+        self.total_requests = 0
+        self.total_errors = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until == 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'consecutive_failures': self.failures,
+            'total_requests': self.total_requests,
+            'total_errors': self.total_errors,
+        }
+
+
+class BackendPool:
+    """
+    Least-outstanding-requests load balancer over Ollama backends.
+    Een backend die MAX_FAILURES keer na elkaar faalt wordt uitgeworpen en
+    pas weer toegelaten als een health probe slaagt. Requests met een
+    affinity key gaan bij voorkeur naar de backend die die prefix al kent.
+    """
+
+    def __init__(self, urls, pool_size: int = POOL_SIZE,
+                 max_failures: int = MAX_FAILURES, eject_seconds: float = EJECT_SECONDS,
+                 affinity: AffinityTable = None):
+        if not urls:
+            raise ValueError('At least one Ollama backend is required')
+        self.backends = [Backend(url, pool_size) for url in urls]
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.affinity = AffinityTable() if affinity is None else affinity
+        self.lock = threading.Lock()
+
+    def acquire(self, exclude=()) -> Backend:
+        """Pick the healthy backend with the fewest requests in flight"""
+        return self.route(exclude)[0]
+
+    def route(self, exclude=(), affinity=None):
+        """
+        acquire() with prefix affinity. Returns (backend, result); result is
+        'hit', 'miss' or 'fallback' from the affinity table, None without key.
+        """
+        with self.lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            if not candidates:
+                raise NoBackendAvailable('No healthy Ollama backend available')
+            backend = min(candidates, key=lambda b: b.outstanding)
+            result = None
+            if affinity is not None:
+                backend, result = self.affinity.route(affinity, candidates, backend)
+            backend.outstanding += 1
+            backend.total_requests += 1
+            return backend, result
+
+    def release(self, backend: Backend, ok: bool = True) -> None:
+        """Return a backend slot and record the outcome"""
+        with self.lock:
+            backend.outstanding -= 1
+            self._record(backend, ok)
+
+    def record_probe(self, backend: Backend, ok: bool) -> None:
+        """
+        Outcome of a background health probe. Een mislukte probe telt als
+        fout; een uitgeworpen backend komt pas na de cooldown terug.
+        """
+        with self.lock:
+            if backend.healthy:
+                self._record(backend, ok)
+            elif ok and backend.ejected_until <= time.monotonic():
+                backend.ejected_until = 0.0
+                backend.failures = 0
+                logging.info(f"Re-admitted backend {backend.url}")
+
+    def _record(self, backend: Backend, ok: bool) -> None:
+        if ok:
+            backend.failures = 0
+            return
+        backend.failures += 1
+        backend.total_errors += 1
+        if backend.healthy and backend.failures >= self.max_failures:
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            # Na een herstart is de prompt cache toch leeg
+            self.affinity.forget_backend(backend.url)
+            logging.warning(f"Ejected backend {backend.url} after {backend.failures} failures")
+
+    def probe(self, backend: Backend) -> bool:
+        """Health probe: kan de backend zijn modellen opsommen?"""
+        try:
+            response = backend.session.get(f'{backend.url}/api/tags', timeout=PROBE_TIMEOUT)
+            return response.status_code == 200
+        except requests.RequestException:
+            return False
+
+    def readmit_due(self) -> None:
+        """Probe ejected backends whose cooldown has passed"""
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            for backend in self.backends:
+                if not backend.healthy and backend.ejected_until <= now:
+                    # Claim de probe zodat andere threads niet tegelijk proben
+                    backend.ejected_until = now + self.eject_seconds
+                    due.append(backend)
+
+        for backend in due:
+            if self.probe(backend):
+                with self.lock:
+                    backend.ejected_until = 0.0
+                    backend.failures = 0
+                logging.info(f"Re-admitted backend {backend.url}")
+
+    def request(self, method: str, path: str, stream: bool = False, cancel: CancelToken = None,
+                affinity: bytes = None, **kwargs) -> requests.Response:
+        """
+        Send a request to the least-loaded backend (or the one pinned to the
+        affinity key), failing over to the next one when the connection cannot
+        be made. Met stream=True blijft de backend bezet tot release_response()
+        aangeroepen wordt. A cancelled request raises RequestCancelled and is
+        not a backend failure. response.affinity holds the routing result.
+        """
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, None))
+        tried = []
+        while True:
+            if cancel is not None and cancel.cancelled:
+                raise RequestCancelled('Request cancelled by the client')
+            backend, routed = self.route(tried, affinity)
+            _current.token = cancel
+            try:
+                response = backend.session.request(
+                    method, f'{backend.url}{path}', stream=stream, **kwargs
+                )
+            except requests.RequestException as e:
+                if cancel is not None and cancel.cancelled:
+                    self.release(backend)
+                    raise RequestCancelled('Request cancelled by the client') from e
+                self.release(backend, ok=False)
+                if not isinstance(e, requests.ConnectionError):
+                    raise
+                # Niets verstuurd, dus veilig om een andere backend te proberen
+                tried.append(backend)
+                if len(tried) >= len(self.backends):
+                    raise
+                continue
+            finally:
+                _current.token = None
+
+            response.backend = backend
+            response.affinity = routed
+            if not stream:
+                self.release(backend, ok=response.status_code < 500)
+            return response
+
+    def release_response(self, response: requests.Response, ok: bool = True) -> None:
+        """Close a streamed response and free its backend slot"""
+        response.close()
+        self.release(response.backend, ok=ok and response.status_code < 500)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def any_healthy(self) -> bool:
+        """True if at least one backend answers a health probe"""
+        self.readmit_due()
+        return any(b.healthy and self.probe(b) for b in self.backends)
+
+    def snapshot(self) -> list:
+        with self.lock:
+            return [b.snapshot() for b in self.backends]
+
+
+class HealthProber:
+    """
+    Background thread that probes every backend on an interval and keeps a
+    snapshot of backend health plus the merged model list. /health en
+    /v1/models lezen alleen die snapshot en doen zelf geen upstream calls.
+    """
+
+    def __init__(self, pool: BackendPool, interval: float = PROBE_INTERVAL, virtual_models=()):
+        self.pool = pool
+        self.interval = interval
+        self.virtual_models = list(virtual_models)  # door de proxy gerouteerd, bv. "auto"
+        self.lock = threading.Lock()
+        self.models_body = None   # voorgeserialiseerde /v1/models response
+        self.model_ids = []
+        self.connected = False
+        self.updated = None       # time.monotonic() van de laatste refresh
+        self.refreshes = 0
+        self.started = False
+
+    def start(self) -> None:
+        if not self.started:
+            self.started = True
+            threading.Thread(target=self._loop, name='health-prober', daemon=True).start()
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Health probe failed: {e}")
+            time.sleep(self.interval)
+
+    def refresh(self) -> None:
+        """Probe all backends and rebuild the snapshot"""
+        models = {}
+        for backend in self.pool.backends:
+            try:
+                response = backend.session.get(f'{backend.url}/v1/models', timeout=PROBE_TIMEOUT)
+                ok = response.status_code == 200
+                if ok:
+                    for model in response.json().get('data', []):
+                        models.setdefault(model['id'], model)
+            except (requests.RequestException, ValueError, KeyError):
+                ok = False
+            self.pool.record_probe(backend, ok)
+
+        model_ids = sorted(models)
+        listed = [models[m] for m in model_ids] + [
+            {'id': name, 'object': 'model', 'created': 0, 'owned_by': 'guardrail-proxy'}
+            for name in self.virtual_models if name not in models
+        ]
+        body = json.dumps({'object': 'list', 'data': listed}).encode('utf-8')
+        connected = any(b.healthy for b in self.pool.backends)
+        with self.lock:
+            self.models_body = body
+            self.model_ids = model_ids
+            self.connected = connected
+            self.updated = time.monotonic()
+            self.refreshes += 1
+
+    def age(self):
+        """Seconds since the last refresh, or None if there was none yet"""
+        with self.lock:
+            return None if self.updated is None else time.monotonic() - self.updated
+
+    def snapshot(self) -> dict:
+        age = self.age()
+        with self.lock:
+            return {
+                'connected': self.connected,
+                'models': list(self.model_ids),
+                'snapshot_age_seconds': None if age is None else round(age, 3),
+                'probe_interval_seconds': self.interval,
+                'refreshes': self.refreshes,
+            }
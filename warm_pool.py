@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Warm pool voor de Ollama backends van de guardrail proxy
+Een model koud laden kost Ollama vele seconden; die betaalt de eerste request
+na een stille periode. De warm pool laadt de geconfigureerde modellen bij het
+starten, verlengt keep_alive van modellen met recent verkeer en haalt grote
+idle modellen weg als een backend boven zijn geheugenbudget zit.
+Residency komt uit Ollama's /api/ps en staat in /health.
+"""
+
+import os
+import time
+import logging
+import threading
+import requests
+
+# Altijd warm te houden modellen, komma-gescheiden, bv. "dolphin3,dolphin-phi"
+WARM_MODELS = [m.strip() for m in os.environ.get('WARM_MODELS', '').split(',') if m.strip()]
+WARM_POOL = os.environ.get('WARM_POOL', '1') != '0'
+WARM_KEEP_ALIVE = os.environ.get('WARM_KEEP_ALIVE', '30m')           # keep_alive die we meesturen
+WARM_INTERVAL = float(os.environ.get('WARM_INTERVAL', 60))           # seconden tussen rondes
+WARM_RECENT_SECONDS = float(os.environ.get('WARM_RECENT_SECONDS', 1800))  # "recent verkeer"
+WARM_IDLE_SECONDS = float(os.environ.get('WARM_IDLE_SECONDS', 900))  # pas daarna mag een model weg
+# Geheugenbudget per backend in GB (size uit /api/ps); 0 = geen budget
+WARM_MEMORY_BUDGET = float(os.environ.get('WARM_MEMORY_BUDGET_GB', 0)) * 1024 ** 3
+LOAD_TIMEOUT = 300       # seconden; een groot model laden duurt lang
+PS_TIMEOUT = 2
+
+
+def canonical(model: str) -> str:
+    """Ollama noemt "dolphin3" in /api/ps "dolphin3:latest" """
+    return model if ':' in model else f'{model}:latest'
+
+
+class WarmPool:
+    """
+    Background thread that keeps models resident on every backend.
+    Elke ronde: residency ophalen, ontbrekende vaste modellen laden,
+    keep_alive verlengen voor wat recent gebruikt is, en boven budget de
+    grootste idle modellen (niet uit WARM_MODELS) met keep_alive 0 lossen.
+    """
+
+    def __init__(self, pool, models=WARM_MODELS, interval: float = WARM_INTERVAL,
+                 keep_alive=WARM_KEEP_ALIVE, memory_budget: float = WARM_MEMORY_BUDGET):
+        self.pool = pool
+        self.models = [canonical(m) for m in models]
+        self.interval = interval
+        self.keep_alive = keep_alive
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        self.last_used = {}       # canonical model -> time.time() van de laatste request
+        self.residency = {}       # backend url -> [{model, size, size_vram, expires_at}]
+        self.updated = None       # time.monotonic() van de laatste ronde
+        self.counters = {'preloads': 0, 'refreshes': 0, 'evictions': 0, 'errors': 0}
+        self.started = False
+
+    def start(self) -> None:
+        if not self.started:
+            self.started = True
+            threading.Thread(target=self._loop, name='warm-pool', daemon=True).start()
+
+    def _loop(self) -> None:
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f"Warm pool round failed: {e}")
+            time.sleep(self.interval)
+
+    def touch(self, model: str) -> None:
+        """Record traffic for a model (once per proxied request)"""
+        with self.lock:
+            self.last_used[canonical(model)] = time.time()
+
+    def tick(self) -> None:
+        """One round over all healthy backends"""
+        now = time.time()
+        with self.lock:
+            recent = {m for m, used in self.last_used.items() if now - used <= WARM_RECENT_SECONDS}
+            idle = {m: now - used for m, used in self.last_used.items()}
+
+        for backend in self.pool.backends:
+            if not backend.healthy:
+                continue
+            resident = self.ps(backend)
+            if resident is None:
+                continue
+            names = {entry['model'] for entry in resident}
+
+            for model in self.models:
+                if model not in names:
+                    self.load(backend, model, 'preloads')
+            for model in sorted(recent & names):
+                self.load(backend, model, 'refreshes')
+
+            if self.memory_budget:
+                self.evict(backend, resident, idle)
+
+            resident = self.ps(backend)
+            with self.lock:
+                self.residency[backend.url] = resident if resident is not None else []
+        with self.lock:
+            self.updated = time.monotonic()
+
+    def ps(self, backend):
+        """Resident models of one backend, or None when /api/ps failed"""
+        try:
+            response = backend.session.get(f'{backend.url}/api/ps', timeout=PS_TIMEOUT)
+            response.raise_for_status()
+            return [{
+                'model': canonical(entry.get('name') or entry.get('model', '')),
+                'size': entry.get('size', 0),
+                'size_vram': entry.get('size_vram', 0),
+                'expires_at': entry.get('expires_at'),
+            } for entry in response.json().get('models') or []]
+        except (requests.RequestException, ValueError) as e:
+            self.count('errors')
+            logging.warning(f"Residency of {backend.url} unknown: {e}")
+            return None
+
+    def load(self, backend, model: str, counter: str, keep_alive=None) -> bool:
+        """
+        Load a model or reset its keep_alive timer on one backend.
+        Een /api/generate zonder prompt laadt alleen het model; keep_alive 0 lost het.
+        """
+        keep_alive = self.keep_alive if keep_alive is None else keep_alive
+        try:
+            response = backend.session.post(f'{backend.url}/api/generate',
+                                            json={'model': model, 'keep_alive': keep_alive},
+                                            timeout=(PS_TIMEOUT, LOAD_TIMEOUT))
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.count('errors')
+            logging.warning(f"Warm pool could not set keep_alive={keep_alive} for {model} on {backend.url}: {e}")
+            return False
+        self.count(counter)
+        return True
+
+    def evict(self, backend, resident: list, idle: dict) -> None:
+        """Unload the largest idle models until the backend fits its budget"""
+        used = sum(entry['size'] for entry in resident)
+        candidates = sorted(
+            (entry for entry in resident
+             if entry['model'] not in self.models and idle.get(entry['model'], float('inf')) >= WARM_IDLE_SECONDS),
+            key=lambda entry: entry['size'], reverse=True,
+        )
+        for entry in candidates:
+            if used <= self.memory_budget:
+                break
+            if self.load(backend, entry['model'], 'evictions', keep_alive=0):
+                logging.info(f"Evicted idle {entry['model']} from {backend.url}")
+                used -= entry['size']
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self.lock:
+            return {
+                'enabled': WARM_POOL,
+                'pinned': list(self.models),
+                'keep_alive': self.keep_alive,
+                'memory_budget_bytes': int(self.memory_budget) or None,
+                'round_age_seconds': None if self.updated is None else round(time.monotonic() - self.updated, 3),
+                'backends': {
+                    url: {
+                        'resident_bytes': sum(entry['size'] for entry in resident),
+                        'models': [{
+                            **entry,
+                            'idle_seconds': round(now - self.last_used[entry['model']], 1)
+                            if entry['model'] in self.last_used else None,
+                        } for entry in resident],
+                    } for url, resident in self.residency.items()
+                },
+                **self.counters,
+            }